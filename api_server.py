@@ -0,0 +1,44 @@
+"""Serve retrieval and RAG chat over HTTP for other programs, next to or instead of the UI.
+
+Searches the same data_* databases as the pages. Concurrent queries are embedded together in one
+Ollama request per model, chat answers stream as server-sent events, and requests over the
+admission limits get a 503 with Retry-After.
+
+Run from the repository root:
+    python api_server.py --port 8000
+    curl -X POST localhost:8000/retrieve -d '{"database": "data_DESU", "collection": "collection_1", "query": "What is RAG?"}'
+    curl -N -X POST localhost:8000/chat -d '{"database": "data_DESU", "collection": "collection_1", "question": "What is RAG?"}'
+    curl localhost:8000/stats
+"""
+import argparse
+import uvicorn
+from pages.backend.api import create_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--root", default=".", help="Directory holding the data_* databases")
+    parser.add_argument("--batch-window-ms", type=float, default=5.0, help="How long a query waits for others to share its embedding request, 0 disables batching")
+    parser.add_argument("--max-batch", type=int, default=64, help="Queries per embedding request")
+    parser.add_argument("--max-retrievals", type=int, default=32, help="Retrievals served at once")
+    parser.add_argument("--max-chats", type=int, default=8, help="Chat answers streamed at once")
+    parser.add_argument("--max-queued", type=int, default=128, help="Requests of each kind waiting for a slot before new ones get a 503")
+    parser.add_argument("--queue-timeout", type=float, default=10.0, help="Seconds a request waits for a slot before it gets a 503")
+    args = parser.parse_args()
+
+    app = create_app(
+        root=args.root,
+        batch_window=args.batch_window_ms / 1000,
+        max_batch=args.max_batch,
+        max_retrievals=args.max_retrievals,
+        max_chats=args.max_chats,
+        max_queued=args.max_queued,
+        queue_timeout=args.queue_timeout,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
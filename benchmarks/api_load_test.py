@@ -0,0 +1,212 @@
+"""Load-test the HTTP API with concurrent retrieval and streamed chat clients.
+
+Serves a throwaway database from a local fake Ollama server, once per query batching window,
+and reports throughput, latency percentiles, time to first chat token, 503 rejections and the
+mean number of queries per embedding request. With --url an already running server is tested
+instead.
+
+Run from the repository root:
+    python -m benchmarks.api_load_test --clients 32 --duration 10 --batch-windows 0,5 --parallel 2 --embed-latency 0.02
+    python -m benchmarks.api_load_test --url http://127.0.0.1:8000 --database data_DESU --collection collection_1
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import aiohttp
+from benchmarks.corpus import make_corpus, make_queries
+from benchmarks.fake_ollama import add_latency_arguments, server_from_arguments
+from benchmarks.run import COLLECTION, EMBEDDING_MODEL, latency_summary
+
+
+def make_database(work_dir, args):
+    from pages.backend.chunking import split_documents
+    from pages.backend.collection_map import get_collection_map
+    from pages.backend.ingest import ingest_documents
+    db_path = os.path.join(work_dir, "data_bench")
+    os.makedirs(db_path)
+    docs = make_corpus(args.documents, seed=args.seed)
+    chunks = split_documents(docs, {"method": "characters", "chunk_size": 500, "chunk_overlap": 50})
+    get_collection_map(db_path).set_collection(COLLECTION, EMBEDDING_MODEL)
+    ingest_documents(chunks, db_path, [COLLECTION], {COLLECTION: EMBEDDING_MODEL})
+    return docs
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_api(root, batch_window, args):
+    import uvicorn
+    from pages.backend.api import create_app
+    app = create_app(
+        root=root,
+        batch_window=batch_window,
+        max_retrievals=args.max_retrievals,
+        max_chats=args.max_chats,
+        max_queued=args.max_queued,
+        queue_timeout=args.queue_timeout,
+    )
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, f"http://127.0.0.1:{port}"
+
+
+async def retrieve_client(session, url, queries, deadline, results, args):
+    while time.perf_counter() < deadline:
+        body = {
+            "database": args.database,
+            "collection": args.collection,
+            "query": queries[results["sent"] % len(queries)],
+            "search_type": args.search_type,
+            "k": args.k,
+        }
+        results["sent"] += 1
+        start = time.perf_counter()
+        async with session.post(f"{url}/retrieve", json=body) as response:
+            await response.read()
+        if response.status == 200:
+            results["latencies"].append(time.perf_counter() - start)
+        elif response.status == 503:
+            results["rejected"] += 1
+            await asyncio.sleep(float(response.headers.get("Retry-After", 1)))
+        else:
+            results["errors"] += 1
+
+
+async def chat_client(session, url, queries, deadline, results, args):
+    while time.perf_counter() < deadline:
+        body = {
+            "database": args.database,
+            "collection": args.collection,
+            "question": queries[results["sent"] % len(queries)],
+            "search_type": args.search_type,
+            "k": args.k,
+            "llm": args.llm,
+        }
+        results["sent"] += 1
+        start = time.perf_counter()
+        first_token = None
+        failed = False
+        async with session.post(f"{url}/chat", json=body) as response:
+            if response.status == 503:
+                results["rejected"] += 1
+                await asyncio.sleep(float(response.headers.get("Retry-After", 1)))
+                continue
+            async for line in response.content:
+                if line.startswith(b"event: token") and first_token is None:
+                    first_token = time.perf_counter() - start
+                elif line.startswith(b"event: error"):
+                    failed = True
+        if response.status != 200 or failed:
+            results["errors"] += 1
+            continue
+        results["latencies"].append(time.perf_counter() - start)
+        if first_token is not None:
+            results["first_token"].append(first_token)
+
+
+async def load(url, queries, args):
+    kinds = {kind: {"sent": 0, "latencies": [], "first_token": [], "rejected": 0, "errors": 0} for kind in ("retrieve", "chat")}
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=None)) as session:
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(
+            *(retrieve_client(session, url, queries, deadline, kinds["retrieve"], args) for _ in range(args.clients)),
+            *(chat_client(session, url, queries, deadline, kinds["chat"], args) for _ in range(args.chat_clients)),
+        )
+        elapsed = time.perf_counter() - start
+        async with session.get(f"{url}/stats") as response:
+            server_stats = json.loads(await response.read())
+    summary = {}
+    for kind, results in kinds.items():
+        if not results["sent"]:
+            continue
+        summary[kind] = {
+            "per_second": len(results["latencies"]) / elapsed,
+            "rejected": results["rejected"],
+            "errors": results["errors"],
+        }
+        if results["latencies"]:
+            summary[kind].update(latency_summary(results["latencies"]))
+        if results["first_token"]:
+            summary[kind]["first_token_p50_ms"] = latency_summary(results["first_token"])["p50_ms"]
+    summary["mean_batch_size"] = server_stats["query_batches"]["mean_batch_size"]
+    return summary
+
+
+def print_summary(label, summary):
+    for kind in ("retrieve", "chat"):
+        if kind not in summary:
+            continue
+        stats = summary[kind]
+        line = f"{label:<12} {kind:<9} {stats['per_second']:>8.1f}/s"
+        if "p50_ms" in stats:
+            line += f"  p50 {stats['p50_ms']:>7.1f} ms  p95 {stats['p95_ms']:>7.1f} ms  p99 {stats['p99_ms']:>7.1f} ms"
+        if "first_token_p50_ms" in stats:
+            line += f"  first token p50 {stats['first_token_p50_ms']:.1f} ms"
+        print(line + f"  503s {stats['rejected']}  errors {stats['errors']}")
+    print(f"{label:<12} {summary['mean_batch_size']:.1f} queries per embedding request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="Test this running server instead of starting one")
+    parser.add_argument("--database", default="data_bench")
+    parser.add_argument("--collection", default=COLLECTION)
+    parser.add_argument("--documents", type=int, default=300, help="Documents in the throwaway database")
+    parser.add_argument("--queries", type=int, default=5000, help="Distinct queries, few repeat so most miss the query cache")
+    parser.add_argument("--clients", type=int, default=32, help="Concurrent retrieval clients")
+    parser.add_argument("--chat-clients", type=int, default=4, help="Concurrent chat clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per run")
+    parser.add_argument("--batch-windows", default="0,5", help="Comma separated query batching windows in ms, one run each")
+    parser.add_argument("--search-type", default="top_k")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--llm", default="llama3.1")
+    parser.add_argument("--max-retrievals", type=int, default=32)
+    parser.add_argument("--max-chats", type=int, default=8)
+    parser.add_argument("--max-queued", type=int, default=128)
+    parser.add_argument("--queue-timeout", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=0)
+    add_latency_arguments(parser)
+    parser.set_defaults(parallel=2, embed_latency=0.02, embed_item_latency=0.001)
+    args = parser.parse_args()
+
+    if args.url:
+        queries = [f"question {index} about the documentation" for index in range(args.queries)]
+        print_summary("server", asyncio.run(load(args.url, queries, args)))
+        return
+
+    server = server_from_arguments(args).start()
+    os.environ["OLLAMA_HOST"] = server.url
+    work_dir = tempfile.mkdtemp(prefix="easy_rag_api_")
+    try:
+        docs = make_database(work_dir, args)
+        print(f"{args.clients} retrieval and {args.chat_clients} chat clients for {args.duration:.0f} s per run, "
+              f"fake Ollama serving {args.parallel} requests at once\n")
+        for index, window_ms in enumerate(float(window) for window in args.batch_windows.split(",")):
+            # New queries for every run, so no run is answered from the query cache of the one before
+            queries = make_queries(docs, args.queries, seed=args.seed + 1 + index)
+            api, url = start_api(work_dir, window_ms / 1000, args)
+            try:
+                print_summary(f"window {window_ms:g} ms", asyncio.run(load(url, queries, args)))
+            finally:
+                api.should_exit = True
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Synthetic, seeded corpora and queries shaped like scraped documentation pages."""
+import numpy as np
+from langchain_core.documents import Document
+
+
+def vocabulary(size, rng):
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(letters, size=rng.integers(3, 10))))
+    return sorted(words)
+
+
+def make_corpus(documents=1000, words_per_document=400, vocabulary_size=20000, sources=None, seed=0):
+    """Documents with Zipf-distributed words, a code-like token per document and one source per document.
+
+    `sources` groups documents into fewer sources, like the pages of one sitemap.
+    """
+    rng = np.random.default_rng(seed)
+    words = np.array(vocabulary(vocabulary_size, rng))
+    docs = []
+    for index in range(documents):
+        ranks = np.minimum(rng.zipf(1.2, size=words_per_document), vocabulary_size) - 1
+        text = words[ranks]
+        # Sentences of 8 to 20 words, paragraphs of 5 sentences, so the splitter has boundaries to use
+        sentences, position = [], 0
+        while position < len(text):
+            length = int(rng.integers(8, 21))
+            sentences.append(" ".join(text[position:position + length]).capitalize() + ".")
+            position += length
+        paragraphs = [" ".join(sentences[start:start + 5]) for start in range(0, len(sentences), 5)]
+        paragraphs.append(f"Error code E{index:05d} is documented on this page.")
+        source = f"https://docs.example.com/page/{index % sources if sources else index}"
+        docs.append(Document(page_content="\n\n".join(paragraphs), metadata={"source": source, "title": f"Page {index}"}))
+    return docs
+
+
+def make_queries(docs, count=100, words=6, seed=1):
+    """Queries built from words of random documents, so each has a plausible answer in the corpus."""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for _ in range(count):
+        doc_words = docs[int(rng.integers(len(docs)))].page_content.replace(".", "").split()
+        start = int(rng.integers(max(len(doc_words) - words, 1)))
+        queries.append(" ".join(doc_words[start:start + words]).lower())
+    return queries
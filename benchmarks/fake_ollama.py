@@ -0,0 +1,178 @@
+"""A local stand-in for the Ollama HTTP API, for benchmarks that must not depend on a real model server.
+
+Embeddings are deterministic feature-hashed bags of words, so texts that share words are close and
+retrieval results are stable between runs. Generations stream a fixed number of tokens. Like
+OLLAMA_NUM_PARALLEL, --parallel limits the requests served at once, the others queue.
+
+Run on its own and point the app at it:
+    python -m benchmarks.fake_ollama --port 11435 --embed-latency 0.02
+    OLLAMA_HOST=http://127.0.0.1:11435 streamlit run main.py
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def embed_text(text, dim):
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in WORD_PATTERN.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        index = int.from_bytes(digest[:4], "little") % dim
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if not norm:
+        vector[0] = 1.0
+        return vector.tolist()
+    return (vector / norm).tolist()
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate small writes, Nagle would add ~40 ms to every response
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunk(self, payload):
+        data = (json.dumps(payload) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n" % len(data) + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        self._send_json({"models": []})
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with self.server.slots:
+            self.handle_request(request)
+
+    def handle_request(self, request):
+        server = self.server
+        if self.path in ("/api/embed", "/api/embeddings"):
+            texts = request.get("input", request.get("prompt", ""))
+            texts = [texts] if isinstance(texts, str) else texts
+            server.record("embed_requests", 1)
+            server.record("embedded_texts", len(texts))
+            time.sleep(server.embed_latency + server.embed_item_latency * len(texts))
+            embeddings = [embed_text(text, server.dim) for text in texts]
+            if self.path == "/api/embeddings":
+                self._send_json({"embedding": embeddings[0]})
+            else:
+                self._send_json({"model": request.get("model"), "embeddings": embeddings})
+        elif self.path in ("/api/chat", "/api/generate") and not request.get("prompt") and not request.get("messages"):
+            # An empty request only loads the model
+            server.record("load_requests", 1)
+            self._send_json({"model": request.get("model"), "created_at": "2024-01-01T00:00:00Z", "response": "", "done": True, "done_reason": "load"})
+        elif self.path in ("/api/chat", "/api/generate"):
+            server.record("generate_requests", 1)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            time.sleep(server.first_token_latency)
+            for index in range(server.answer_tokens):
+                token = f" token{index}"
+                self._send_chunk({
+                    "model": request.get("model"),
+                    "created_at": "2024-01-01T00:00:00Z",
+                    "message": {"role": "assistant", "content": token},
+                    "response": token,
+                    "done": False,
+                })
+                time.sleep(server.token_latency)
+            self._send_chunk({
+                "model": request.get("model"),
+                "created_at": "2024-01-01T00:00:00Z",
+                "message": {"role": "assistant", "content": ""},
+                "response": "",
+                "done": True,
+                "done_reason": "stop",
+                "eval_count": server.answer_tokens,
+                "prompt_eval_count": 0,
+            })
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self._send_json({})
+
+
+class FakeOllama(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, dim=384, embed_latency=0.0, embed_item_latency=0.0,
+                 first_token_latency=0.0, token_latency=0.0, answer_tokens=64, parallel=0):
+        super().__init__(("127.0.0.1", port), FakeOllamaHandler)
+        self.dim = dim
+        self.embed_latency = embed_latency
+        self.embed_item_latency = embed_item_latency
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.answer_tokens = answer_tokens
+        self.slots = threading.BoundedSemaphore(parallel) if parallel else contextlib.nullcontext()
+        self.counters = {"embed_requests": 0, "embedded_texts": 0, "generate_requests": 0, "load_requests": 0}
+        self.counters_lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def record(self, counter, amount):
+        with self.counters_lock:
+            self.counters[counter] += amount
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def add_latency_arguments(parser):
+    parser.add_argument("--dim", type=int, default=384, help="Embedding dimension (all-minilm is 384)")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Seconds per embedding request")
+    parser.add_argument("--embed-item-latency", type=float, default=0.0, help="Extra seconds per embedded text")
+    parser.add_argument("--first-token-latency", type=float, default=0.0, help="Seconds before the first generated token")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds between generated tokens")
+    parser.add_argument("--answer-tokens", type=int, default=64)
+    parser.add_argument("--parallel", type=int, default=0, help="Requests served at once, like OLLAMA_NUM_PARALLEL (0 is unlimited)")
+
+
+def server_from_arguments(args, port=0):
+    return FakeOllama(
+        port=port,
+        dim=args.dim,
+        embed_latency=args.embed_latency,
+        embed_item_latency=args.embed_item_latency,
+        first_token_latency=args.first_token_latency,
+        token_latency=args.token_latency,
+        answer_tokens=args.answer_tokens,
+        parallel=args.parallel,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=11435)
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+    server = server_from_arguments(args, port=args.port)
+    print(f"Fake Ollama listening on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
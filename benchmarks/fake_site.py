@@ -0,0 +1,176 @@
+"""A local stand-in for a documentation website, for fetcher benchmarks that must not depend on the network.
+
+Serves /sitemap.xml, a sitemap index over two halves of the pages, and /page/<n> HTML pages with
+ETag and Last-Modified validators, answering conditional requests with 304. Every page URL can fail
+its first --fail-first requests with a 503, and the time span of every request is kept so the
+fetcher's concurrency can be checked afterwards.
+
+Run on its own and ingest its sitemap from the app:
+    python -m benchmarks.fake_site --port 8765 --pages 200 --latency 0.05
+"""
+import argparse
+import threading
+import time
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+VALIDATORS = ("both", "etag", "last_modified")
+
+
+def page_html(index, version):
+    return (
+        f"<html lang=\"en\"><head><title>Page {index}</title></head><body>"
+        f"<h1>Page {index}</h1><p>Version {version} of page {index} about topic {index % 17}.</p>"
+        f"<h2>Details</h2><p>More words about topic {index % 17} and error E{index:04d}.</p>"
+        "</body></html>"
+    )
+
+
+class FakeSiteHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b"", content_type="text/html", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        start = time.perf_counter()
+        try:
+            time.sleep(server.latency)
+            self.handle_get()
+        finally:
+            server.record_span(start, time.perf_counter())
+
+    def handle_get(self):
+        server = self.server
+        if self.path == "/sitemap.xml":
+            locs = [f"{server.url}/sitemap-{part}.xml" for part in (0, 1)]
+            body = "".join(f"<sitemap><loc>{loc}</loc></sitemap>" for loc in locs)
+            self._send(200, f"<sitemapindex>{body}</sitemapindex>".encode(), "application/xml")
+        elif self.path in ("/sitemap-0.xml", "/sitemap-1.xml"):
+            half = server.pages // 2
+            indexes = range(half) if self.path == "/sitemap-0.xml" else range(half, server.pages)
+            body = "".join(f"<url><loc>{server.url}/page/{index}</loc></url>" for index in indexes)
+            self._send(200, f"<urlset>{body}</urlset>".encode(), "application/xml")
+        elif self.path.startswith("/page/"):
+            self.handle_page(int(self.path.rsplit("/", 1)[1]))
+        else:
+            self._send(404)
+
+    def handle_page(self, index):
+        server = self.server
+        if server.count_attempt(self.path) <= server.fail_first:
+            server.record("failures_sent")
+            self._send(503)
+            return
+        etag = f'"v{server.version}-{index}"'
+        last_modified = formatdate(server.modified_at, usegmt=True)
+        headers = {}
+        if server.validators in ("both", "etag"):
+            headers["ETag"] = etag
+        if server.validators in ("both", "last_modified"):
+            headers["Last-Modified"] = last_modified
+        if (
+            ("ETag" in headers and self.headers.get("If-None-Match") == etag)
+            or ("Last-Modified" in headers and self.headers.get("If-Modified-Since") == last_modified)
+        ):
+            server.record("not_modified")
+            self._send(304, headers=headers)
+            return
+        server.record("pages_sent")
+        self._send(200, page_html(index, server.version).encode(), headers=headers)
+
+
+class FakeSite(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, pages=100, latency=0.0, fail_first=0, validators="both"):
+        super().__init__(("127.0.0.1", port), FakeSiteHandler)
+        self.pages = pages
+        self.latency = latency
+        self.fail_first = fail_first
+        self.validators = validators
+        # Bumped to change every page, like a redeployed site
+        self.version = 1
+        self.modified_at = time.time() - 3600
+        self.attempts = {}
+        self.spans = []
+        self.counters = {"pages_sent": 0, "not_modified": 0, "failures_sent": 0}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def page_urls(self):
+        return [f"{self.url}/page/{index}" for index in range(self.pages)]
+
+    def change_pages(self):
+        with self.lock:
+            self.version += 1
+            self.modified_at += 60
+
+    def count_attempt(self, path):
+        with self.lock:
+            self.attempts[path] = self.attempts.get(path, 0) + 1
+            return self.attempts[path]
+
+    def record(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def record_span(self, start, end):
+        with self.lock:
+            self.spans.append((start, end))
+
+    def reset(self):
+        with self.lock:
+            self.attempts.clear()
+            self.spans.clear()
+            self.counters = dict.fromkeys(self.counters, 0)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def peak_concurrency(*servers):
+    """Most requests the servers were handling at the same moment, together."""
+    events = sorted(
+        (moment, change)
+        for server in servers
+        for start, end in server.spans
+        for moment, change in ((start, 1), (end, -1))
+    )
+    peak = current = 0
+    for _, change in events:
+        current += change
+        peak = max(peak, current)
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per request")
+    parser.add_argument("--fail-first", type=int, default=0, help="Requests of every page answered with a 503 before it is served")
+    parser.add_argument("--validators", choices=VALIDATORS, default="both")
+    args = parser.parse_args()
+    server = FakeSite(port=args.port, pages=args.pages, latency=args.latency, fail_first=args.fail_first, validators=args.validators)
+    print(f"Fake site listening on {server.url}, sitemap at {server.url}/sitemap.xml")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
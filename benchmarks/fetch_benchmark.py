@@ -0,0 +1,115 @@
+"""Check and benchmark the web fetcher against local fake sites.
+
+Fetches pages with per-host and total connection limits, through transient 503s, and again from
+the ETag/Last-Modified cache, then checks the limits held, the retries succeeded or gave up as
+configured, and unchanged pages came back as 304s. Exits with status 1 if a check fails.
+
+Run from the repository root:
+    python -m benchmarks.fetch_benchmark --pages 200 --latency 0.02
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from benchmarks.fake_site import VALIDATORS, FakeSite, peak_concurrency
+from pages.backend.fetcher import WebFetcher, fetch_sitemap_pages
+
+checks = []
+
+
+def check(name, passed, detail):
+    checks.append(passed)
+    print(f"{'ok' if passed else 'FAILED':<7} {name}: {detail}")
+
+
+def bench_concurrency(args):
+    site = FakeSite(pages=args.pages, latency=args.latency).start()
+    other = FakeSite(pages=args.pages, latency=args.latency).start()
+    try:
+        # One host: the per-host limit applies
+        fetcher = WebFetcher(max_concurrency=16, per_host_concurrency=4, retries=0)
+        start = time.perf_counter()
+        bodies = fetcher.fetch_all(site.page_urls())
+        elapsed = time.perf_counter() - start
+        check("per-host limit", peak_concurrency(site) <= 4 and all(bodies.values()),
+              f"peak {peak_concurrency(site)} of 4 requests, {len(bodies) / elapsed:.0f} pages/sec")
+        # Two hosts (ports count as hosts): the total limit applies across them
+        site.reset()
+        fetcher = WebFetcher(max_concurrency=6, per_host_concurrency=16, retries=0)
+        start = time.perf_counter()
+        bodies = fetcher.fetch_all(site.page_urls() + other.page_urls())
+        elapsed = time.perf_counter() - start
+        peak = peak_concurrency(site, other)
+        check("total limit", peak <= 6 and all(bodies.values()), f"peak {peak} of 6 requests over two hosts, {len(bodies) / elapsed:.0f} pages/sec")
+        # Sitemap index with two nested sitemaps
+        site.reset()
+        pages = fetch_sitemap_pages(f"{site.url}/sitemap.xml", WebFetcher(retries=0))
+        check("sitemap index", len(pages) == args.pages, f"{len(pages)} of {args.pages} pages")
+    finally:
+        site.shutdown()
+        other.shutdown()
+
+
+def bench_retries(args):
+    site = FakeSite(pages=args.pages, fail_first=2).start()
+    try:
+        fetcher = WebFetcher(retries=3, backoff=0.01)
+        bodies = fetcher.fetch_all(site.page_urls())
+        check("retries", all(bodies.values()) and not fetcher.stats.failures,
+              f"{site.counters['failures_sent']} 503s retried, {len(bodies)} pages fetched")
+        # More failures than retries: every page gives up after retries + 1 requests
+        site.reset()
+        site.fail_first = 5
+        fetcher = WebFetcher(retries=3, backoff=0.01)
+        bodies = fetcher.fetch_all(site.page_urls())
+        requests = site.counters["failures_sent"]
+        check("give up", len(fetcher.stats.failures) == args.pages and requests == 4 * args.pages,
+              f"{len(fetcher.stats.failures)} pages failed after {requests} requests")
+    finally:
+        site.shutdown()
+
+
+def bench_cache(args, work_dir):
+    for validators in VALIDATORS:
+        site = FakeSite(pages=args.pages, latency=args.latency, validators=validators).start()
+        cache_dir = os.path.join(work_dir, f"http_cache_{validators}")
+        try:
+            first = WebFetcher(cache_dir=cache_dir, retries=0).fetch_all(site.page_urls())
+            # A new fetcher, like the next ingestion job, only has the disk cache
+            fetcher = WebFetcher(cache_dir=cache_dir, retries=0)
+            second = fetcher.fetch_all(site.page_urls())
+            check(f"cache hits ({validators})",
+                  fetcher.stats.cache_hits == args.pages and site.counters["not_modified"] == args.pages and second == first,
+                  f"{fetcher.stats.cache_hits} of {args.pages} pages were 304s, {fetcher.stats.pages_per_sec:.0f} pages/sec")
+            site.change_pages()
+            fetcher = WebFetcher(cache_dir=cache_dir, retries=0)
+            third = fetcher.fetch_all(site.page_urls())
+            check(f"changed pages ({validators})",
+                  fetcher.stats.downloaded == args.pages and all(third[url] != first[url] for url in first),
+                  f"{fetcher.stats.downloaded} of {args.pages} pages downloaded again")
+            leftovers = [name for name in os.listdir(cache_dir) if name.endswith(".tmp")]
+            check(f"cache writes ({validators})", not leftovers, f"{len(leftovers)} temporary files left")
+        finally:
+            site.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds per request")
+    args = parser.parse_args()
+    work_dir = tempfile.mkdtemp(prefix="easy_rag_fetch_")
+    try:
+        bench_concurrency(args)
+        bench_retries(args)
+        bench_cache(args, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if not all(checks):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
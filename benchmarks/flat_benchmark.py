@@ -0,0 +1,97 @@
+"""Compare Chroma's HNSW index with the flat engine's float32, float16 and int8 matrices.
+
+Reports build time, size on disk, query latency and recall@k against exact float32 search
+on synthetic clustered embeddings. Everything is written to a temporary directory.
+
+Run from the repository root:
+    python -m benchmarks.flat_benchmark --rows 20000 --dim 1024 --k 10
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+import chromadb
+from pages.backend.flat import FlatIndex, normalize_rows
+
+BATCH_SIZE = 1000
+
+
+def clustered_vectors(rng, rows, dim, clusters=64):
+    # Real embeddings cluster by topic, uniform random vectors would make every method look alike
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    assignment = rng.integers(0, clusters, rows)
+    return centers[assignment] + 0.5 * rng.standard_normal((rows, dim)).astype(np.float32)
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def percentile_ms(timings, percentile):
+    return float(np.percentile(timings, percentile)) * 1000
+
+
+def recall(found, exact):
+    return np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found, exact)])
+
+
+def build_chroma(path, ids, vectors):
+    client = chromadb.PersistentClient(path=path)
+    collection = client.create_collection("bench")
+    for start in range(0, len(ids), BATCH_SIZE):
+        collection.add(ids=ids[start:start + BATCH_SIZE], embeddings=vectors[start:start + BATCH_SIZE])
+    return lambda query, k: collection.query(query_embeddings=[query], n_results=k, include=[])["ids"][0]
+
+
+def build_flat(path, ids, vectors, dtype):
+    index = FlatIndex(path, dtype)
+    for start in range(0, len(ids), BATCH_SIZE):
+        index.upsert(ids[start:start + BATCH_SIZE], vectors[start:start + BATCH_SIZE])
+    index.warm()
+    return lambda query, k: index.search([query], k)[0]["ids"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1024, help="Embedding dimension (mxbai-embed-large is 1024)")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = normalize_rows(clustered_vectors(rng, args.rows, args.dim))
+    queries = normalize_rows(clustered_vectors(rng, args.queries, args.dim))
+    ids = [f"chunk-{row}" for row in range(args.rows)]
+    exact_rows = np.argsort(-(queries @ vectors.T), axis=1)[:, :args.k]
+    exact = [[ids[row] for row in rows] for rows in exact_rows]
+
+    work = tempfile.mkdtemp()
+    engines = [("chroma hnsw", lambda path: build_chroma(path, ids, vectors))]
+    for dtype in ("float32", "float16", "int8"):
+        engines.append((f"flat {dtype}", lambda path, dtype=dtype: build_flat(path, ids, vectors, dtype)))
+    print(f"{args.rows} vectors of dimension {args.dim}, {args.queries} queries, k={args.k}")
+    print(f"{'engine':<14} {'build s':>8} {'disk MB':>8} {'p50 ms':>8} {'p95 ms':>8} {'recall':>7}")
+    try:
+        for name, build in engines:
+            path = os.path.join(work, name.replace(" ", "_"))
+            start = time.perf_counter()
+            search = build(path)
+            build_time = time.perf_counter() - start
+            timings, found = [], []
+            for query in queries:
+                start = time.perf_counter()
+                found.append(search(query, args.k))
+                timings.append(time.perf_counter() - start)
+            print(
+                f"{name:<14} {build_time:>8.2f} {directory_size(path) / 2**20:>8.1f} "
+                f"{percentile_ms(timings, 50):>8.2f} {percentile_ms(timings, 95):>8.2f} {recall(found, exact):>7.3f}"
+            )
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
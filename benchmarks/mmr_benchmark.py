@@ -0,0 +1,51 @@
+"""Compare the vectorized MMR selection with LangChain's implementation.
+
+Run from the repository root:
+    python -m benchmarks.mmr_benchmark --dim 1024 --k 10
+"""
+import argparse
+import time
+import numpy as np
+from langchain_chroma.vectorstores import maximal_marginal_relevance as langchain_mmr
+from pages.backend.retrieval import maximal_marginal_relevance
+
+
+def best_of(function, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dim", type=int, default=1024, help="Embedding dimension (mxbai-embed-large is 1024)")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--lambda-mult", type=float, default=0.5)
+    parser.add_argument("--fetch-k", type=int, nargs="+", default=[20, 100, 250, 500, 1000])
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'fetch_k':>8} {'langchain ms':>13} {'vectorized ms':>14} {'speedup':>8} same")
+    for fetch_k in args.fetch_k:
+        query = rng.standard_normal(args.dim).astype(np.float32)
+        candidates = rng.standard_normal((fetch_k, args.dim)).astype(np.float32)
+        # LangChain receives the embeddings as Chroma returns them, a list of arrays
+        candidate_list = list(candidates)
+        langchain_time, langchain_result = best_of(
+            lambda: langchain_mmr(query, candidate_list, lambda_mult=args.lambda_mult, k=args.k), args.repeats
+        )
+        vectorized_time, vectorized_result = best_of(
+            lambda: maximal_marginal_relevance(query, candidates, k=args.k, lambda_mult=args.lambda_mult), args.repeats
+        )
+        print(
+            f"{fetch_k:>8} {langchain_time * 1000:>13.2f} {vectorized_time * 1000:>14.2f} "
+            f"{langchain_time / vectorized_time:>7.1f}x {langchain_result == vectorized_result}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Benchmark the shared Ollama client against the local fake Ollama server.
+
+Measures embedding throughput for several /api/embed batch sizes, then the latency of interactive
+query embeddings while bulk ingestion keeps the server busy: with the interactive lane, with
+queries queued on the bulk lane like any other request, and on an idle server.
+
+Run from the repository root:
+    python -m benchmarks.ollama_benchmark --texts 2000 --parallel 2 --embed-latency 0.02 --embed-item-latency 0.001
+"""
+import argparse
+import threading
+import time
+import numpy as np
+from benchmarks.fake_ollama import add_latency_arguments, server_from_arguments
+from pages.backend.ollama_client import BULK, INTERACTIVE, OllamaClient
+
+MODEL = "all-minilm"
+
+
+def percentile_ms(samples, percentile):
+    return float(np.percentile(samples, percentile)) * 1000
+
+
+def bench_batch_sizes(server, texts, batch_sizes, parallel):
+    print(f"{'batch size':>10} {'requests':>9} {'seconds':>8} {'texts/sec':>10}")
+    for batch_size in batch_sizes:
+        client = OllamaClient(host=server.url, max_in_flight=parallel, bulk_in_flight=parallel, embed_batch_size=batch_size)
+        requests_before = server.counters["embed_requests"]
+        start = time.perf_counter()
+        client.embed(MODEL, texts, lane=BULK)
+        elapsed = time.perf_counter() - start
+        print(f"{batch_size:>10} {server.counters['embed_requests'] - requests_before:>9} {elapsed:>8.2f} {len(texts) / elapsed:>10.0f}")
+
+
+def query_latencies(client, queries, lane):
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        client.embed(MODEL, [query], lane=lane)
+        samples.append(time.perf_counter() - start)
+        # A user types between questions
+        time.sleep(0.01)
+    return samples
+
+
+def bench_lanes(server, texts, queries, args):
+    print(f"\n{'queries':<28} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    scenarios = [
+        ("idle server", None, INTERACTIVE),
+        ("under ingestion, interactive", args.parallel - 1, INTERACTIVE),
+        ("under ingestion, bulk lane", args.parallel, BULK),
+    ]
+    for name, bulk_in_flight, lane in scenarios:
+        client = OllamaClient(
+            host=server.url,
+            max_in_flight=args.parallel,
+            bulk_in_flight=max(bulk_in_flight or args.parallel, 1),
+            embed_batch_size=args.batch_size,
+        )
+        stop = threading.Event()
+
+        def ingest():
+            while not stop.is_set():
+                client.embed(MODEL, texts, lane=BULK)
+
+        workers = [threading.Thread(target=ingest, daemon=True) for _ in range(args.ingest_threads if bulk_in_flight is not None else 0)]
+        for worker in workers:
+            worker.start()
+        time.sleep(0.2)
+        samples = query_latencies(client, queries, lane)
+        stop.set()
+        for worker in workers:
+            worker.join()
+        print(f"{name:<28} {percentile_ms(samples, 50):>8.1f} {percentile_ms(samples, 95):>8.1f} {max(samples) * 1000:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=2000, help="Texts embedded per ingestion")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--batch-sizes", default="1,16,64,256", help="Comma separated /api/embed batch sizes to compare")
+    parser.add_argument("--batch-size", type=int, default=64, help="Batch size of the ingestion in the lane comparison")
+    parser.add_argument("--ingest-threads", type=int, default=2, help="Concurrent ingestions in the lane comparison")
+    add_latency_arguments(parser)
+    parser.set_defaults(parallel=2, embed_latency=0.02, embed_item_latency=0.001)
+    args = parser.parse_args()
+    if args.parallel < 2:
+        parser.error("--parallel must be at least 2, one slot is kept for interactive requests")
+
+    server = server_from_arguments(args).start()
+    texts = [f"chunk {index} of a document about topic {index % 17}" for index in range(args.texts)]
+    queries = [f"question {index} about topic {index % 17}" for index in range(args.queries)]
+    print(f"Fake Ollama serving {args.parallel} requests at once, {args.embed_latency * 1000:.0f} ms per request "
+          f"and {args.embed_item_latency * 1000:.1f} ms per text\n")
+    try:
+        bench_batch_sizes(server, texts, [int(size) for size in args.batch_sizes.split(",")], args.parallel)
+        bench_lanes(server, texts, queries, args)
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
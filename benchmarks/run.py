@@ -0,0 +1,337 @@
+"""Benchmark ingestion, retrieval and a full chat turn against a local fake Ollama server.
+
+Everything runs through the app's own code paths on a throwaway database. Results are written
+as JSON so runs can be compared between commits.
+
+Run from the repository root:
+    python -m benchmarks.run --documents 2000 --output before.json
+    python -m benchmarks.run --documents 2000 --compare before.json
+    python -m benchmarks.run --stages split search --embed-latency 0.01
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from benchmarks.corpus import make_corpus, make_queries
+from benchmarks.fake_ollama import add_latency_arguments, server_from_arguments
+
+STAGES = ["split", "ingest_from_documents", "ingest", "search", "chat", "startup"]
+EMBEDDING_MODEL = "all-minilm"
+COLLECTION = "bench"
+PROMPT_TEMPLATE = """
+Answer the question based only on the following context:
+
+{context}
+
+---
+
+Answer the question based on the above context: {question}
+"""
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def latency_summary(samples):
+    samples_ms = np.asarray(samples) * 1000
+    return {
+        "count": len(samples),
+        "mean_ms": float(samples_ms.mean()),
+        "p50_ms": float(np.percentile(samples_ms, 50)),
+        "p95_ms": float(np.percentile(samples_ms, 95)),
+        "p99_ms": float(np.percentile(samples_ms, 99)),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_split(docs, args):
+    from concurrent.futures import ProcessPoolExecutor
+    from pages.backend.chunking import chunk_all, split_documents
+    chunking = {"method": args.chunking, "chunk_size": args.chunk_size, "chunk_overlap": args.chunk_overlap}
+    start = time.perf_counter()
+    chunks = split_documents(docs, chunking)
+    elapsed = time.perf_counter() - start
+    result = {
+        "documents": len(docs),
+        "chunks": len(chunks),
+        "seconds": elapsed,
+        "docs_per_sec": len(docs) / elapsed,
+        "chunks_per_sec": len(chunks) / elapsed,
+    }
+    if args.split_workers > 1:
+        with ProcessPoolExecutor(max_workers=args.split_workers) as executor:
+            # Workers started before timing, the app's pool lives as long as the server
+            list(executor.map(abs, range(args.split_workers)))
+            start = time.perf_counter()
+            parallel_chunks = chunk_all(docs, chunking, executor=executor)
+            parallel_elapsed = time.perf_counter() - start
+        result["parallel"] = {
+            "workers": args.split_workers,
+            "seconds": parallel_elapsed,
+            "chunks_per_sec": len(parallel_chunks) / parallel_elapsed,
+            "speedup": elapsed / parallel_elapsed,
+            "same_chunks": [chunk.page_content for chunk in parallel_chunks] == [chunk.page_content for chunk in chunks],
+        }
+    return chunks, result
+
+
+def bench_ingest_from_documents(chunks, work_dir):
+    # The original ingestion path: one Chroma.from_documents call per collection
+    from langchain_chroma import Chroma
+    from langchain_ollama import OllamaEmbeddings
+    start = time.perf_counter()
+    Chroma.from_documents(
+        chunks,
+        OllamaEmbeddings(model=EMBEDDING_MODEL),
+        persist_directory=os.path.join(work_dir, "data_from_documents"),
+        collection_name=COLLECTION,
+    )
+    elapsed = time.perf_counter() - start
+    return {"chunks": len(chunks), "seconds": elapsed, "chunks_per_sec": len(chunks) / elapsed}
+
+
+def bench_ingest(chunks, db_path):
+    from pages.backend.ingest import ingest_documents
+    results = {}
+    # The second run measures the unchanged-content path, every source is skipped
+    for label in ("first", "unchanged"):
+        start = time.perf_counter()
+        summary = ingest_documents(chunks, db_path, [COLLECTION], {COLLECTION: EMBEDDING_MODEL})
+        elapsed = time.perf_counter() - start
+        results[label] = {
+            "chunks": len(chunks),
+            "seconds": elapsed,
+            "chunks_per_sec": len(chunks) / elapsed,
+            "embedded": summary["embedding_calls"],
+            "skipped_sources": summary["skipped_sources"],
+        }
+    return results
+
+
+def search_arguments(search_type, args):
+    if search_type == "similarity_score_threshold":
+        return args.score_threshold
+    return args.k
+
+
+def bench_search(docs, db_path, args):
+    from pages.backend.resources import get_vector_store
+    from pages.backend.retrieval import SEARCH_TYPES, retrieve
+    vector_store = get_vector_store(db_path, COLLECTION, EMBEDDING_MODEL)
+    results = {}
+    for index, search_type in enumerate(SEARCH_TYPES):
+        number = search_arguments(search_type, args)
+        # Separate queries per search type, otherwise later types would only hit the query embedding cache
+        queries = make_queries(docs, args.queries + 1, seed=args.seed + 1 + index)
+        # First query pays for one-off work such as building the BM25 index, reported on its own
+        start = time.perf_counter()
+        retrieve(vector_store, queries[0], search_type, number, db_path=db_path, collection_name=COLLECTION, fetch_k=args.fetch_k)
+        warmup = time.perf_counter() - start
+        samples, hits = [], []
+        for query in queries[1:]:
+            start = time.perf_counter()
+            found = retrieve(vector_store, query, search_type, number, db_path=db_path, collection_name=COLLECTION, fetch_k=args.fetch_k)
+            samples.append(time.perf_counter() - start)
+            hits.append(len(found))
+        results[search_type] = dict(
+            latency_summary(samples),
+            warmup_ms=warmup * 1000,
+            queries_per_sec=len(samples) / sum(samples),
+            mean_hits=float(np.mean(hits)),
+        )
+    return results
+
+
+def bench_chat(queries, db_path, args):
+    from pages.backend.ollama_client import get_chat_model
+    from pages.backend.resources import get_vector_store
+    from pages.backend.retrieval import retrieve
+    from pages.backend.streaming import TokenStream
+    from pages.backend.context import pack_context
+    vector_store = get_vector_store(db_path, COLLECTION, EMBEDDING_MODEL)
+    model = get_chat_model(args.llm)
+    turn_samples, retrieval_samples, first_token_samples = [], [], []
+    for query in queries[:args.chat_turns]:
+        start = time.perf_counter()
+        docs = retrieve(vector_store, query, "top_k", args.k)
+        retrieval_samples.append(time.perf_counter() - start)
+        prompt_text = PROMPT_TEMPLATE.format(context=pack_context(docs)[0], question=query)
+        stream = TokenStream(model, prompt_text)
+        for _ in stream:
+            pass
+        turn_samples.append(time.perf_counter() - start)
+        # Time to first token as the user sees it, retrieval included
+        first_token_samples.append(retrieval_samples[-1] + stream.time_to_first_token)
+    return {
+        "turn": latency_summary(turn_samples),
+        "retrieval": latency_summary(retrieval_samples),
+        "first_token": latency_summary(first_token_samples),
+    }
+
+
+def bench_startup(queries, db_path, args):
+    # Fresh processes, so imports, opening the database and loading the HNSW index are all cold
+    with open(os.path.join(db_path, "collection_embedding_map.json"), "w") as f:
+        json.dump({COLLECTION: EMBEDDING_MODEL}, f)
+    results = {}
+    for label, extra in (("cold", []), ("warm_up", ["--warm-up"])):
+        runs = []
+        for query in queries[:args.startup_runs]:
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.startup", db_path, COLLECTION, EMBEDDING_MODEL, query] + extra,
+                capture_output=True, text=True, check=True,
+            ).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        results[label] = {
+            key: float(np.median([run[key] for run in runs]))
+            for key in runs[0] if key.endswith("_seconds")
+        }
+    return results
+
+
+def compare(previous, current, path=()):
+    """Print numbers that exist in both runs with their relative change."""
+    for key, value in current.items():
+        if key not in previous:
+            continue
+        if isinstance(value, dict):
+            compare(previous[key], value, path + (key,))
+        elif isinstance(value, (int, float)) and isinstance(previous[key], (int, float)) and previous[key]:
+            change = (value - previous[key]) / previous[key]
+            print(f"{'.'.join(path + (key,)):<60} {previous[key]:>12.2f} {value:>12.2f} {change:>+8.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--documents", type=int, default=1000)
+    parser.add_argument("--words-per-document", type=int, default=400)
+    parser.add_argument("--vocabulary-size", type=int, default=20000)
+    parser.add_argument("--sources", type=int, default=None, help="Number of distinct sources, defaults to one per document")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunking", choices=["characters", "tokens"], default="characters")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--chunk-overlap", type=int, default=50)
+    parser.add_argument("--split-workers", type=int, default=os.cpu_count(), help="Processes for the parallel split measurement, 1 skips it")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--score-threshold", type=float, default=0.2)
+    parser.add_argument("--chat-turns", type=int, default=20)
+    parser.add_argument("--llm", default="llama3.1")
+    parser.add_argument("--startup-runs", type=int, default=3, help="Fresh processes per startup measurement, the median is reported")
+    parser.add_argument("--ollama-host", default=None, help="Benchmark a real Ollama server instead of the fake one")
+    parser.add_argument("--output", default=None, help="Results file, defaults to easy_rag_benchmarks/<commit>.json in the temp directory")
+    parser.add_argument("--compare", default=None, help="Earlier results file to compare against")
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark database directory")
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+
+    if args.ollama_host:
+        os.environ["OLLAMA_HOST"] = args.ollama_host
+    else:
+        server = server_from_arguments(args).start()
+        os.environ["OLLAMA_HOST"] = server.url
+
+    work_dir = tempfile.mkdtemp(prefix="easy_rag_bench_")
+    db_path = os.path.join(work_dir, "data_bench")
+    os.makedirs(db_path)
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "arguments": vars(args),
+        },
+        "results": {},
+    }
+    results = report["results"]
+    try:
+        docs = make_corpus(args.documents, args.words_per_document, args.vocabulary_size, args.sources, args.seed)
+        chunks, results["split"] = bench_split(docs, args)
+        results["split"]["peak_rss_mb"] = peak_rss_mb()
+        print(f"split: {results['split']['docs_per_sec']:.0f} docs/sec, {results['split']['chunks_per_sec']:.0f} chunks/sec, {results['split']['chunks']} chunks")
+        if "parallel" in results["split"]:
+            parallel = results["split"]["parallel"]
+            print(f"split with {parallel['workers']} processes: {parallel['chunks_per_sec']:.0f} chunks/sec, {parallel['speedup']:.1f}x")
+
+        if "ingest_from_documents" in args.stages:
+            results["ingest_from_documents"] = bench_ingest_from_documents(chunks, work_dir)
+            results["ingest_from_documents"]["peak_rss_mb"] = peak_rss_mb()
+            print(f"Chroma.from_documents: {results['ingest_from_documents']['chunks_per_sec']:.0f} chunks/sec")
+
+        # Search, chat and startup need the collection, so it is ingested whenever they run
+        if {"ingest", "search", "chat", "startup"} & set(args.stages):
+            results["ingest"] = bench_ingest(chunks, db_path)
+            results["ingest"]["peak_rss_mb"] = peak_rss_mb()
+            print(
+                f"ingest: {results['ingest']['first']['chunks_per_sec']:.0f} chunks/sec, "
+                f"unchanged re-ingest {results['ingest']['unchanged']['seconds']:.2f}s"
+            )
+
+        if "search" in args.stages:
+            results["search"] = bench_search(docs, db_path, args)
+            results["search"]["peak_rss_mb"] = peak_rss_mb()
+            for search_type, stats in results["search"].items():
+                if isinstance(stats, dict):
+                    print(f"search {search_type}: p50 {stats['p50_ms']:.1f} ms, p95 {stats['p95_ms']:.1f} ms, p99 {stats['p99_ms']:.1f} ms")
+
+        if "chat" in args.stages:
+            results["chat"] = bench_chat(make_queries(docs, args.chat_turns, seed=args.seed + 100), db_path, args)
+            results["chat"]["peak_rss_mb"] = peak_rss_mb()
+            print(
+                f"chat turn: p50 {results['chat']['turn']['p50_ms']:.1f} ms, "
+                f"first token p50 {results['chat']['first_token']['p50_ms']:.1f} ms"
+            )
+
+        if "startup" in args.stages:
+            results["startup"] = bench_startup(make_queries(docs, args.startup_runs, seed=args.seed + 200), db_path, args)
+            print(
+                f"startup: imports {results['startup']['cold']['import_seconds']:.2f}s, "
+                f"first query {results['startup']['cold']['first_query_seconds']:.2f}s cold, "
+                f"{results['startup']['warm_up']['first_query_seconds']:.2f}s after a "
+                f"{results['startup']['warm_up']['warm_up_seconds']:.2f}s warm-up"
+            )
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        else:
+            print(f"Benchmark database kept in {db_path}")
+
+    if not args.ollama_host:
+        report["meta"]["fake_ollama"] = server.counters
+    report["meta"]["peak_rss_mb"] = peak_rss_mb()
+    # Outside the repository by default, so a run never leaves files to commit
+    output = args.output or os.path.join(tempfile.gettempdir(), "easy_rag_benchmarks", f"{report['meta']['commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}, peak RSS {report['meta']['peak_rss_mb']:.0f} MB")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            previous = json.load(f)
+        print(f"\n{'metric':<60} {'before':>12} {'after':>12} {'change':>8}")
+        compare(previous["results"], results)
+
+
+if __name__ == "__main__":
+    main()
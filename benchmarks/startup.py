@@ -0,0 +1,47 @@
+"""Cold start of one fresh process: the app's startup imports, an optional warm-up, then the first query.
+
+Run by benchmarks.run in a subprocess, prints its results as JSON:
+    python -m benchmarks.startup data_bench bench all-minilm "some query" --warm-up
+"""
+import argparse
+import json
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("database")
+    parser.add_argument("collection")
+    parser.add_argument("embedding_model")
+    parser.add_argument("query")
+    parser.add_argument("--warm-up", action="store_true")
+    args = parser.parse_args()
+
+    results = {}
+    start = time.perf_counter()
+    import streamlit
+    import streamlit_option_menu
+    # The Streamlit server has imported streamlit before the script runs, reported on its own
+    results["streamlit_import_seconds"] = time.perf_counter() - start
+    start = time.perf_counter()
+    # Same modules as the top of main.py, keep the two in step
+    from pages.backend import manifest, metrics, jobs, startup, migrate, collection_map, chunking
+    results["import_seconds"] = time.perf_counter() - start
+
+    if args.warm_up:
+        start = time.perf_counter()
+        warm_up = startup.WarmUp([args.database], [])
+        startup.run_warm_up(warm_up)
+        results["warm_up_seconds"] = time.perf_counter() - start
+        results["warm_up_errors"] = warm_up.errors
+
+    start = time.perf_counter()
+    from pages.backend.resources import get_vector_store
+    from pages.backend.retrieval import retrieve
+    retrieve(get_vector_store(args.database, args.collection, args.embedding_model), args.query, "top_k", 4)
+    results["first_query_seconds"] = time.perf_counter() - start
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
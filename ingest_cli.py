@@ -0,0 +1,231 @@
+"""Bulk-ingest a directory tree, a URL list or a sitemap into a collection without the UI.
+
+Documents are parsed and split in a process pool, then embedded and upserted in batches,
+so memory stays bounded by the batch size and the number of files in flight.
+
+Run from the repository root:
+    python ingest_cli.py data_docs manuals --dir ./pdfs
+    python ingest_cli.py data_docs web --urls urls.txt --sitemap https://example.com/sitemap.xml
+    python ingest_cli.py data_docs manuals --dir ./pdfs --dry-run
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from langchain_core.documents import Document
+from pages.backend.chunking import CHUNKING_METHODS, chunking_from_settings, chunking_settings, split_batch, token_limit
+from pages.backend.fetcher import WebFetcher, sitemap_page_urls
+from pages.backend.ingest import ingest_documents, group_chunks_by_source, plan_collection_changes
+from pages.backend.manifest import IngestManifest
+from pages.backend.pdf import load_pdf
+from pages.backend.resources import get_client
+from pages.backend.collection_map import get_collection_map
+
+PDF_EXTENSIONS = {".pdf"}
+HTML_EXTENSIONS = {".html", ".htm"}
+TEXT_EXTENSIONS = {".txt", ".md"}
+
+
+def parse_file(path, chunking):
+    """Runs in a worker process. Returns (source, chunks, error) so one bad file does not stop the run."""
+    try:
+        extension = os.path.splitext(path)[1].lower()
+        if extension in PDF_EXTENSIONS:
+            with open(path, "rb") as f:
+                return path, load_pdf(f.read(), path, chunking), None
+        if extension in HTML_EXTENSIONS:
+            with open(path, "rb") as f:
+                # Same chunking as the Update Database page, HTML is parsed once by the splitter
+                return path, split_batch([(path, f.read())], chunking), None
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return path, split_batch([Document(page_content=f.read(), metadata={"source": path})], chunking), None
+    except Exception as e:
+        return path, [], str(e)
+
+
+def parse_page(url, body, chunking):
+    try:
+        return url, split_batch([(url, body)], chunking), None
+    except Exception as e:
+        return url, [], str(e)
+
+
+def walk_files(directories):
+    extensions = PDF_EXTENSIONS | HTML_EXTENSIONS | TEXT_EXTENSIONS
+    for directory in directories:
+        for root, _, filenames in os.walk(directory):
+            for filename in sorted(filenames):
+                if os.path.splitext(filename)[1].lower() in extensions:
+                    yield os.path.join(root, filename)
+
+
+def fetch_pages(urls, fetcher, url_batch):
+    # Pages are fetched a group at a time so bodies never pile up in memory
+    for start in range(0, len(urls), url_batch):
+        for url, body in fetcher.fetch_all(urls[start:start + url_batch]).items():
+            if body is not None:
+                yield url, body
+
+
+def bounded_map(executor, tasks, max_in_flight):
+    """Submit (function, *args) tasks lazily, keeping at most max_in_flight running, yield results as they finish."""
+    pending = set()
+    for function, *arguments in tasks:
+        pending.add(executor.submit(function, *arguments))
+        if len(pending) >= max_in_flight:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+
+class Progress:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sources = 0
+        self.failed = 0
+        self.chunks = 0
+        self.totals = {"embedding_calls": 0, "added_chunks": 0, "deleted_chunks": 0, "skipped_sources": 0}
+
+    def add(self, summary):
+        for key in self.totals:
+            self.totals[key] += summary.get(key, 0)
+
+    def line(self):
+        elapsed = time.perf_counter() - self.started
+        return (
+            f"[{elapsed:7.1f}s] {self.sources} sources, {self.chunks} chunks "
+            f"({self.sources / elapsed:.1f} sources/sec, {self.chunks / elapsed:.1f} chunks/sec), "
+            f"embedded {self.totals['embedding_calls']}, added {self.totals['added_chunks']}, "
+            f"deleted {self.totals['deleted_chunks']}, skipped {self.totals['skipped_sources']} sources, "
+            f"{self.failed} failed"
+        )
+
+
+def plan_batch(db_path, collection_names, docs):
+    """What ingesting the batch would do, without embedding or writing anything."""
+    client = get_client(db_path)
+    existing = {col.name for col in client.list_collections()}
+    sources = group_chunks_by_source(docs)
+    summary = {"embedding_calls": 0, "added_chunks": 0, "deleted_chunks": 0, "skipped_sources": 0}
+    needed = set()
+    manifest = IngestManifest(db_path)
+    try:
+        for name in collection_names:
+            if name not in existing:
+                plan = {"add": [chunk_id for _, chunks in sources.values() for chunk_id, _ in chunks], "delete": [], "skipped": 0}
+            else:
+                plan = plan_collection_changes(client.get_collection(name), manifest, sources)
+            needed.update(plan["add"])
+            summary["added_chunks"] += len(plan["add"])
+            summary["deleted_chunks"] += len(plan["delete"])
+            summary["skipped_sources"] += plan["skipped"]
+    finally:
+        manifest.close()
+    summary["embedding_calls"] = len(needed)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("database", help="Database directory, e.g. data_docs")
+    parser.add_argument("collections", nargs="+", help="Collections to ingest into, each must have an embedding model")
+    parser.add_argument("--dir", action="append", default=[], help="Directory tree of .pdf, .html, .txt and .md files (repeatable)")
+    parser.add_argument("--urls", action="append", default=[], help="File with one URL per line (repeatable)")
+    parser.add_argument("--sitemap", action="append", default=[], help="Sitemap URL (repeatable)")
+    parser.add_argument("--chunking", choices=list(CHUNKING_METHODS), help="Chunking method, defaults to the last one used on the first collection, else characters")
+    parser.add_argument("--chunk-size", type=int, help="In tokens for --chunking tokens, else characters. Defaults to the last chunk size used on the first collection, else 500")
+    parser.add_argument("--chunk-overlap", type=int, help="Defaults to the last chunk overlap used on the first collection, else 50")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Parser processes")
+    parser.add_argument("--batch-size", type=int, default=512, help="Chunks embedded and upserted per batch")
+    parser.add_argument("--url-batch", type=int, default=200, help="Pages fetched per group")
+    parser.add_argument("--max-concurrency", type=int, default=16)
+    parser.add_argument("--per-host-concurrency", type=int, default=4)
+    parser.add_argument("--no-http-cache", action="store_true")
+    parser.add_argument("--dry-run", action="store_true", help="Parse and split, report what would change, leave the collections untouched")
+    args = parser.parse_args()
+
+    db_path = os.path.abspath(args.database)
+    if not os.path.isdir(db_path):
+        parser.error(f"database {args.database} does not exist")
+    collection_map = get_collection_map(db_path)
+    collection_embedding_map = collection_map.embedding_models()
+    missing = [name for name in args.collections if not collection_embedding_map.get(name)]
+    if missing:
+        parser.error(f"no embedding model found for {', '.join(missing)} in collection_embedding_map.json")
+    chunking = chunking_from_settings(collection_map.settings(args.collections[0]))
+    for key, value in (("method", args.chunking), ("chunk_size", args.chunk_size), ("chunk_overlap", args.chunk_overlap)):
+        if value is not None:
+            chunking[key] = value
+    if chunking["method"] == "tokens":
+        max_tokens = token_limit([collection_embedding_map[name] for name in args.collections])
+        if chunking["chunk_size"] > max_tokens:
+            print(f"chunk size lowered to {max_tokens} tokens, the embedding model limit", file=sys.stderr)
+            chunking["chunk_size"] = max_tokens
+    if not (args.dir or args.urls or args.sitemap):
+        parser.error("nothing to ingest, pass --dir, --urls or --sitemap")
+
+    def tasks():
+        for path in walk_files(args.dir):
+            yield parse_file, path, chunking
+        urls = []
+        for url_file in args.urls:
+            with open(url_file, "r") as f:
+                urls.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+        if urls or args.sitemap:
+            fetcher = WebFetcher(
+                cache_dir=None if args.no_http_cache else os.path.join(db_path, 'http_cache'),
+                max_concurrency=args.max_concurrency,
+                per_host_concurrency=args.per_host_concurrency,
+            )
+            for sitemap_url in args.sitemap:
+                urls.extend(sitemap_page_urls(sitemap_url, fetcher))
+            for url, body in fetch_pages(list(dict.fromkeys(urls)), fetcher, args.url_batch):
+                yield parse_page, url, body, chunking
+            print(fetcher.stats.summary())
+            for url, error in fetcher.stats.failures.items():
+                print(f"failed: {url}: {error}", file=sys.stderr)
+
+    progress = Progress()
+    batch = []
+
+    def flush():
+        if args.dry_run:
+            progress.add(plan_batch(db_path, args.collections, batch))
+        else:
+            progress.add(ingest_documents(
+                batch,
+                persist_directory=db_path,
+                collections=args.collections,
+                collection_embedding_map=collection_embedding_map,
+            ))
+        batch.clear()
+        print(progress.line(), flush=True)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for source, chunks, error in bounded_map(executor, tasks(), max_in_flight=args.workers * 4):
+            if error:
+                progress.failed += 1
+                print(f"failed: {source}: {error}", file=sys.stderr)
+                continue
+            progress.sources += 1
+            progress.chunks += len(chunks)
+            # Whole sources per batch, the manifest replaces a source's chunks as a unit
+            batch.extend(chunks)
+            if len(batch) >= args.batch_size:
+                flush()
+        if batch:
+            flush()
+    if not args.dry_run:
+        # Saved per collection, so the next ingestion from the app or the CLI splits the same way
+        for name in args.collections:
+            collection_map.update_settings(name, **chunking_settings(chunking))
+    print(("Dry run: " if args.dry_run else "Done: ") + progress.line())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,84 @@
+import time
+script_started = time.perf_counter()
 import streamlit as st
 import os
-import chromadb
-import json
-from langchain_chroma import Chroma
-from langchain_ollama import OllamaEmbeddings
 from streamlit_option_menu import option_menu
-from langchain_community.document_loaders import WebBaseLoader, SitemapLoader
-import time
-from langchain_community.document_loaders import PyPDFLoader
-import tempfile
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from pages.backend.manifest import IngestManifest
+from pages.backend.metrics import span, traced, prometheus_text, traces_jsonl
+from pages.backend.jobs import JobStore, submit_job, resume_jobs, cancel_job, retry_job, job_progress
+from pages.backend.startup import startup_times, warm_up_settings, start_warm_up
+from pages.backend.migrate import is_migration_collection
+from pages.backend.collection_map import STORAGE_OPTIONS, get_collection_map, storage_label
+from pages.backend.chunking import CHUNKING_METHODS, chunking_from_settings, chunking_settings, token_limit
+# chromadb, langchain and the document loaders are imported where they are first needed,
+# so the page renders before they are loaded
+startup_times.mark_imports(script_started)
+
+SOURCES_PER_PAGE = 50
+STORAGE_HELP = "Flat engines search every vector exactly from a memory-mapped matrix, fast and small for collections up to a few hundred thousand chunks. float16 halves and int8 quarters the memory of float32."
 
-def get_collection_embedding_map(db_path):
-    mapping_path = os.path.join(db_path, 'collection_embedding_map.json')
-    if os.path.exists(mapping_path):
-        with open(mapping_path, 'r') as f:
-            return json.load(f)
-    return {}
+def collection_stats_caption(collection_map, names):
+    parts = []
+    for name in names:
+        stats = collection_map.stats(name)
+        if stats:
+            updated = time.strftime("%Y-%m-%d %H:%M", time.localtime(stats["updated_at"]))
+            parts.append(f"{name}: {stats['chunks']} chunks from {stats['sources']} sources, updated {updated}")
+    return " · ".join(parts)
 
-def save_collection_embedding_map(db_path, mapping):
-    mapping_path = os.path.join(db_path, 'collection_embedding_map.json')
-    with open(mapping_path, 'w') as f:
-        json.dump(mapping, f)
+def remember_chunking(collection_map, collections, chunking):
+    # Saved per collection, so the next ingestion splits the same way
+    for name in collections:
+        collection_map.update_settings(name, **chunking_settings(chunking))
 
+def report_ingestion(summary):
+    for missing_collection in summary["missing"]:
+        st.error(f"No embedding model found for collection {missing_collection}.")
+    if summary["models"]:
+        st.info(
+            f"Embedded {summary['embedding_calls']} chunks with {len(summary['models'])} model(s), "
+            f"saved {summary['saved_calls']} embedding calls. "
+            f"Added {summary['added_chunks']} and deleted {summary['deleted_chunks']} chunks, "
+            f"skipped {summary['skipped_sources']} unchanged sources."
+        )
+
+def show_performance(trace):
+    st.caption(f"Total {trace.duration * 1000:.1f} ms. {startup_times.summary()}")
+    st.dataframe(trace.rows(), hide_index=True)
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("Prometheus metrics", prometheus_text(), file_name="easy_rag_metrics.prom", mime="text/plain", key=f"prometheus_{id(trace)}")
+    with col2:
+        st.download_button("Traces (JSONL)", traces_jsonl(), file_name="easy_rag_traces.jsonl", mime="application/jsonl", key=f"traces_{id(trace)}")
+
+@st.fragment(run_every=2)
+def show_ingestion_jobs(db_path):
+    store = JobStore(db_path)
+    jobs = store.list(limit=10)
+    store.close()
+    if not jobs:
+        st.caption("No ingestion jobs yet.")
+    for job in jobs:
+        fraction, rate, eta = job_progress(job)
+        target = job["params"].get("url") or job["params"].get("filename") or f"{job['params'].get('collection')} to {job['params'].get('embedding_model')}"
+        with st.container(border = True):
+            col1, col2 = st.columns([4,1])
+            with col1:
+                st.write(f"**#{job['id']}** {job['kind']} {target} ({job['status']})")
+                st.progress(fraction, text=f"{job['phase']}: {job['done_chunks']}/{job['total_chunks']} chunks, batch {job['done_batches']}/{job['total_batches']}")
+                if job["status"] == "running" and rate:
+                    st.caption(f"{rate:.1f} chunks/sec, ETA {eta:.0f} s")
+                if job["error"]:
+                    st.error(job["error"])
+                if job["status"] == "done":
+                    report_ingestion(job["summary"])
+            with col2:
+                if job["status"] in ("queued", "running"):
+                    if st.button("Cancel", key=f"cancel_job_{job['id']}"):
+                        cancel_job(db_path, job["id"])
+                elif job["status"] in ("failed", "cancelled"):
+                    if st.button("Retry", key=f"retry_job_{job['id']}", help="Resumes from the last committed batch."):
+                        retry_job(db_path, job["id"])
 
 st.set_page_config(layout="wide", initial_sidebar_state="collapsed")
 
@@ -32,6 +88,10 @@ if st.button("❓ Help", help="Go to help page"):
 current_dir = os.path.dirname(os.path.abspath(__file__))
 Databases = [name for name in os.listdir(current_dir) if os.path.isdir(os.path.join(current_dir, name)) and 'data_' in name]
 
+warm_up_databases = warm_up_settings(current_dir, Databases)
+if warm_up_databases is not None:
+    st.caption(start_warm_up(*warm_up_databases).summary())
+
 
 with st.expander("**Create a new database**"):
     with st.form("make_database_form"):
@@ -41,6 +101,7 @@ with st.expander("**Create a new database**"):
         submitted = st.form_submit_button("Create database")
         if submitted:
             st.write("Creating database...")
+            import chromadb
             client = chromadb.Client()
             # Use a default embedding model for path, but this is not used for collection anymore
             client =  chromadb.PersistentClient(path=f'./data_{database_name}')
@@ -58,16 +119,22 @@ with st.container(border = True):
     )
 
 if database_option is not None:
-    client = chromadb.PersistentClient(path=f'{database_option}')
+    from pages.backend.resources import get_client, get_vector_store, invalidate_collection
+    client = get_client(database_option)
     db_path = os.path.abspath(database_option)
-    collection_embedding_map = get_collection_embedding_map(db_path)
-    invoke_or_update =  option_menu("Choose to invoke or update your database", ["Invoke Database", 'Update Database'], 
-    icons=['robot', 'database-add'], menu_icon="clipboard2-check", default_index=1, orientation="horizontal",)
+    collection_map = get_collection_map(db_path)
+    collection_embedding_map = collection_map.embedding_models()
+    # Jobs interrupted by a server restart continue where they stopped
+    resume_jobs(db_path)
+    invoke_or_update =  option_menu("Choose to invoke or update your database", ["Invoke Database", "Search Everywhere", 'Update Database'], 
+    icons=['robot', 'search', 'database-add'], menu_icon="clipboard2-check", default_index=2, orientation="horizontal",)
 
     if invoke_or_update == 'Invoke Database':
+        from pages.backend.retrieval import SEARCH_TYPES, retrieve
+        from pages.backend.embedding_cache import query_cache, format_query_cache_stats
         results = []
         # Show embedding model next to collection name
-        collection_names = [col.name for col in client.list_collections()]
+        collection_names = [col.name for col in client.list_collections() if not is_migration_collection(col.name)]
         collection_labels = [
             f"{name} ({collection_embedding_map.get(name, 'No embedding')})" for name in collection_names
         ]
@@ -80,11 +147,14 @@ if database_option is not None:
         )
 
         if collection_option is not None:
+            st.caption(collection_stats_caption(collection_map, [collection_option]))
             # Get embedding model for this collection
             embedding_model = collection_embedding_map.get(collection_option)
             if not embedding_model:
                 st.error("No embedding model found for this collection. Please update the collection to set an embedding model.")
             else:
+                # The search settings last used on this collection
+                search_settings = collection_map.settings(collection_option)
                 with st.form("invoke_database_form"):
                     col1,col2 = st.columns([3,1])
 
@@ -94,41 +164,53 @@ if database_option is not None:
 
                     with col2:
                         st.write("Number of results")
-                        number_of_results = st.number_input("Number of results or Similarity Score", min_value=0, max_value=100, value=None)
+                        number_of_results = st.number_input("Number of results or Similarity Score", min_value=0, max_value=100, value=search_settings.get("number_of_results"))
                         
                         search_type = st.selectbox(
                             "Select search type",
-                            options=["similarity_score_threshold", "mmr", "top_k"],
-                            index=0,
+                            options=SEARCH_TYPES,
+                            index=SEARCH_TYPES.index(search_settings.get("search_type", SEARCH_TYPES[0])),
                             help="Choose the search type for your query.",
                         )
+                        with st.expander("MMR / hybrid options"):
+                            fetch_k = st.number_input("Candidates (fetch_k)", min_value=1, max_value=1000, value=search_settings.get("fetch_k", 20), help="Number of nearest chunks considered before MMR selection or rank fusion.")
+                            lambda_mult = st.slider("Diversity (lambda)", min_value=0.0, max_value=1.0, value=search_settings.get("lambda_mult", 0.5), step=0.05, help="1 favours relevance only, 0 favours diversity only.")
                         submitted = st.form_submit_button("Invoke")
 
                     if submitted:
                         if query:
-                            print(f'collection_name = {collection_option}\nembedding_function = {embedding_model}\npersist_directory = {database_option}')
-                            vector_store = Chroma(
-                                collection_name=collection_option,
-                                embedding_function=OllamaEmbeddings(model=embedding_model),
-                                persist_directory=f'./{database_option}'
+                            collection_map.update_settings(
+                                collection_option,
+                                search_type=search_type,
+                                number_of_results=number_of_results,
+                                fetch_k=fetch_k,
+                                lambda_mult=lambda_mult,
                             )
-                            if search_type == "similarity_score_threshold":
-                                retriever = vector_store.as_retriever(
-                                    search_type="similarity_score_threshold",
-                                    search_kwargs={"score_threshold": float(number_of_results)}
-                                )
-                            elif search_type == "mmr":
-                                retriever = vector_store.as_retriever(search_type="mmr")
-                            elif search_type == "top_k":
-                                retriever = vector_store.as_retriever(search_kwargs={"k": number_of_results})
-                            else:
-                                st.error("Invalid search type selected.")
-                                retriever = None
-                            if retriever:
-                                results = retriever.invoke(query)
-                                st.success('query succesful!')
+                            with traced("query", database=database_option, collection=collection_option, model=embedding_model) as query_trace:
+                                with span("vector_store"):
+                                    vector_store = get_vector_store(database_option, collection_option, embedding_model)
+                                try:
+                                    results = retrieve(
+                                        vector_store,
+                                        query,
+                                        search_type,
+                                        number_of_results,
+                                        db_path=db_path,
+                                        collection_name=collection_option,
+                                        fetch_k=fetch_k,
+                                        lambda_mult=lambda_mult,
+                                    )
+                                    st.success('query succesful!')
+                                    startup_times.mark_first_query()
+                                    st.caption(format_query_cache_stats(query_cache.stats()))
+                                except ValueError:
+                                    st.error("Invalid search type selected.")
+                            st.session_state.last_query_trace = query_trace
                         else:
                             st.error('Collection not found')
+            if st.session_state.get("last_query_trace") is not None:
+                with st.expander("Performance"):
+                    show_performance(st.session_state.last_query_trace)
             for result in results:
                 with st.container(border = True):
                     st.header("Metadata")
@@ -137,7 +219,58 @@ if database_option is not None:
                     st.divider()
                     st.write(result.page_content)
 
+    elif invoke_or_update == 'Search Everywhere':
+        from pages.backend.federated import federated_search
+        results = []
+        # Every collection with an embedding model, across all databases. Read from the collection
+        # maps, which are cached until they change, so reruns do not open every database.
+        search_targets = []
+        for database in Databases:
+            for name, model in get_collection_map(os.path.abspath(database)).embedding_models().items():
+                if model and not is_migration_collection(name):
+                    search_targets.append((database, name, model))
+        chosen_targets = st.multiselect(
+            "Select the collections to search",
+            options=search_targets,
+            format_func=lambda target: f"{target[0]} / {target[1]} ({target[2]})",
+            placeholder="xxxx...",
+        )
+        with st.form("federated_search_form"):
+            col1, col2 = st.columns([3,1])
+            with col1:
+                st.write("Type in your query")
+                query = st.text_input("Query")
+            with col2:
+                number_of_results = st.number_input("Number of results", min_value=1, max_value=100, value=4)
+                timeout = st.number_input("Timeout (seconds)", min_value=0.5, max_value=120.0, value=10.0, step=0.5, help="Collections that do not answer in time are skipped.")
+            submitted = st.form_submit_button("Search")
+
+        if submitted:
+            if not chosen_targets:
+                st.error("Select at least one collection.")
+            elif query:
+                search_start = time.perf_counter()
+                results, report = federated_search(chosen_targets, query, k=number_of_results, timeout=timeout)
+                startup_times.mark_first_query()
+                st.caption(f"Searched {len(chosen_targets)} collections in {(time.perf_counter() - search_start) * 1000:.1f} ms")
+                for (database, collection_name, _), status in report.items():
+                    latency = f"{status['latency'] * 1000:.1f} ms" if status["latency"] is not None else "-"
+                    message = f"{database} / {collection_name}: {status['status']}, {status['hits']} hits, {latency}"
+                    if status["status"] == "ok":
+                        st.caption(message)
+                    else:
+                        st.warning(message)
+        for result in results:
+            with st.container(border = True):
+                st.header("Metadata")
+                for key in result.metadata:
+                    st.write(f"{key}: {result.metadata[key]}")
+                st.divider()
+                st.write(result.page_content)
+
     elif invoke_or_update == 'Update Database':
+        from pages.backend.ingest import ingest_documents, remove_source, rebuild_source_index
+        from pages.backend.flat import create_collection
         existing_collections = client.list_collections()
         if existing_collections == []:
             st.write("Lets make your first collection for this database")
@@ -148,15 +281,16 @@ if database_option is not None:
                 index=0,
                 placeholder="xxxx...",
             )
+            new_collection_storage = st.selectbox("Storage engine", list(STORAGE_OPTIONS), index=0, help=STORAGE_HELP)
             if new_collection_name and new_collection_embedding:
-                client.create_collection(name=new_collection_name)
-                collection_embedding_map = get_collection_embedding_map(db_path)
-                collection_embedding_map[new_collection_name] = new_collection_embedding
-                save_collection_embedding_map(db_path, collection_embedding_map)
+                create_collection(client, new_collection_name, STORAGE_OPTIONS[new_collection_storage])
+                invalidate_collection(db_path, new_collection_name)
+                collection_map.set_collection(new_collection_name, new_collection_embedding, STORAGE_OPTIONS[new_collection_storage])
                 st.rerun()
         else:
             col1, col2 = st.columns([2,1])
-            existing_collections = [col.name for col in client.list_collections()]
+            existing_collections = [col.name for col in client.list_collections() if not is_migration_collection(col.name)]
+            collection_storage = {name: collection_map.storage(name) for name in existing_collections}
             # Show embedding model next to collection name in multiselect
             collection_labels = [
                 f"{name} ({collection_embedding_map.get(name, 'No embedding')})" for name in existing_collections
@@ -180,14 +314,14 @@ if database_option is not None:
                             index=0,
                             placeholder="xxxx...",
                         )
+                        new_collection_storage = st.selectbox("Storage engine", list(STORAGE_OPTIONS), index=0, help=STORAGE_HELP)
                         submitted = st.form_submit_button("Create collection")
                         if submitted:
                             new_collection = new_collection.replace(" ","_")
                             if new_collection and new_collection_embedding and new_collection not in existing_collections:
-                                client.create_collection(name=new_collection)
-                                collection_embedding_map = get_collection_embedding_map(db_path)
-                                collection_embedding_map[new_collection] = new_collection_embedding
-                                save_collection_embedding_map(db_path, collection_embedding_map)
+                                create_collection(client, new_collection, STORAGE_OPTIONS[new_collection_storage])
+                                invalidate_collection(db_path, new_collection)
+                                collection_map.set_collection(new_collection, new_collection_embedding, STORAGE_OPTIONS[new_collection_storage])
                                 st.success('Collection created successfully!')
                                 st.rerun()
                             else:
@@ -201,154 +335,250 @@ if database_option is not None:
                         index=0 if selected_collections else None,
                         placeholder="Select collection...",
                     )
-                    unique_sources = []
+                    source_page = []
                     if remove_collection:
                         try:
-                            collection = client.get_collection(remove_collection)
-                            # Get all sources in the collection
-                            results = collection.get(include=["metadatas"], limit=10000)
-                            metadatas = results.get("metadatas", [])
-                            sources = [meta.get("source") for meta in metadatas if meta and meta.get("source")]
-                            unique_sources = sorted(list(set(sources)))
+                            manifest = IngestManifest(db_path)
+                            untracked_chunks = client.get_collection(remove_collection).count() - manifest.tracked_chunk_count(remove_collection)
+                            source_search = st.text_input("Search sources", help="Filter sources containing this text.")
+                            source_count = manifest.count_sources(remove_collection, source_search)
+                            page_count = max(1, -(-source_count // SOURCES_PER_PAGE))
+                            source_page_number = st.number_input(f"Page (of {page_count}, {source_count} sources)", min_value=1, max_value=page_count, value=1)
+                            source_page = manifest.list_sources(
+                                remove_collection,
+                                source_search,
+                                limit=SOURCES_PER_PAGE,
+                                offset=(source_page_number - 1) * SOURCES_PER_PAGE,
+                            )
+                            manifest.close()
+                            if untracked_chunks > 0:
+                                st.warning(f"{untracked_chunks} chunks were ingested before the source index existed.")
+                                if st.button("Rebuild source index"):
+                                    indexed = rebuild_source_index(db_path, remove_collection)
+                                    st.success(f"Indexed {indexed} chunks.")
+                                    st.rerun()
                         except Exception as e:
                             st.error(f"Error fetching sources: {e}")
+                    source_details = {entry["source"]: entry for entry in source_page}
                     source_to_remove = st.selectbox(
                         "Select source to remove:",
-                        options=unique_sources,
-                        index=0 if unique_sources else None,
+                        options=list(source_details),
+                        format_func=lambda source: (
+                            f"{source} ({source_details[source]['chunk_count']} chunks, "
+                            f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(source_details[source]['ingested_at']))})"
+                        ),
+                        index=0 if source_details else None,
                         placeholder="Select source...",
                     )
                     if st.button("Remove Data by Source"):
-                        if remove_collection and source_to_remove:
+                        if remove_collection and source_to_remove is not None:
                             try:
-                                collection = client.get_collection(remove_collection)
-                                results = collection.get(where={"source": {"$eq": source_to_remove}}, include=["ids"])
-                                ids_to_delete = results.get("ids", [])
-                                if ids_to_delete:
-                                    collection.delete(ids=ids_to_delete)
-                                    st.success(f"Removed {len(ids_to_delete)} documents from '{remove_collection}' with source '{source_to_remove}'.")
+                                removed = remove_source(db_path, remove_collection, source_to_remove)
+                                if removed:
+                                    st.success(f"Removed {removed} documents from '{remove_collection}' with source '{source_to_remove}'.")
                                 else:
                                     st.info(f"No documents found in '{remove_collection}' with source '{source_to_remove}'.")
                             except Exception as e:
                                 st.error(f"Error removing data: {e}")
                         else:
                             st.error("Please select a collection and a source to remove.")
+                with st.popover("Change Embedding Model", help="Re-embed the stored chunks of a collection with another model or storage engine"):
+                    with st.form("migrate_collection_form"):
+                        st.write("Queries keep using the current embeddings until the new ones are complete.")
+                        migrate_collection = st.selectbox(
+                            "Collection to re-embed",
+                            options=existing_collections,
+                            format_func=lambda name: f"{name} ({collection_embedding_map.get(name, 'No embedding')}, {storage_label(collection_storage[name])})",
+                            index=None,
+                            placeholder="Select collection...",
+                        )
+                        migrate_embedding = st.selectbox(
+                            "New embedding model",
+                            ["mxbai-embed-large", "all-minilm", "nomic-embed-text", "granite-embedding", "paraphrase-multilingual"],
+                            index=0,
+                        )
+                        migrate_storage = st.selectbox("Storage engine", list(STORAGE_OPTIONS), index=0, help=STORAGE_HELP)
+                        submitted = st.form_submit_button("Re-embed collection")
+                        if submitted:
+                            if not migrate_collection:
+                                st.error("Please select a collection.")
+                            elif collection_embedding_map.get(migrate_collection) == migrate_embedding and collection_storage[migrate_collection] == STORAGE_OPTIONS[migrate_storage]:
+                                st.error(f"'{migrate_collection}' already uses {migrate_embedding} with {migrate_storage}.")
+                            else:
+                                job_id = submit_job(db_path, 'migrate', {"collection": migrate_collection, "embedding_model": migrate_embedding, "storage": STORAGE_OPTIONS[migrate_storage]})
+                                st.success(f"Migration job #{job_id} queued, progress is shown under Ingestion jobs.")
 
             if len(selected_collections) > 0:
+                st.caption(collection_stats_caption(collection_map, selected_collections))
                 with st.container(border = True):
                     col1, col2 = st.columns([2,1])
                     with col1:
                         upload_option = st.radio("Data Uploading Options",['Sitemap','Page','PDF'], horizontal=True)
+                        Run_in_background = st.checkbox("Run as background job", value=False, help="Ingest in the background with progress, cancel and resume. The page stays usable and reloading it does not stop the job.")
                     with col2:
                         with st.popover('Chunking And Splitting Options'):
-                            Chunk_size = st.number_input("Chunk size", min_value=0, max_value=10000, value=500, help="Size of each text chunk in characters.")
-                            Chunk_overlap = st.number_input("Chunk overlap", min_value=0, max_value=10000, value=50, help="Number of characters to overlap between chunks.")
+                            # Defaults from the last ingestion into the first selected collection
+                            chunking_defaults = chunking_from_settings(collection_map.settings(selected_collections[0]))
+                            Chunk_method = st.selectbox(
+                                "Chunking method",
+                                list(CHUNKING_METHODS),
+                                index=list(CHUNKING_METHODS).index(chunking_defaults["method"]),
+                                format_func=CHUNKING_METHODS.get,
+                                help="Tokens keeps every chunk within the embedding model's input limit. HTML sections splits pages at their headings and keeps the heading path as metadata.",
+                            )
+                            Chunk_size = st.number_input("Chunk size", min_value=0, max_value=10000, value=chunking_defaults["chunk_size"], help="Size of each text chunk, in tokens for the token method and in characters otherwise.")
+                            Chunk_overlap = st.number_input("Chunk overlap", min_value=0, max_value=10000, value=chunking_defaults["chunk_overlap"], help="Overlap between chunks, in the same unit as the chunk size.")
+                            if Chunk_method == "tokens":
+                                max_tokens = token_limit([collection_embedding_map.get(name) for name in selected_collections])
+                                st.caption(f"The selected collections' embedding models take up to {max_tokens} tokens per chunk.")
+                                Chunk_size = min(Chunk_size, max_tokens)
+                        with st.popover('Fetching Options'):
+                            Max_concurrency = st.number_input("Max concurrent requests", min_value=1, max_value=256, value=16, help="Total number of pooled connections used to fetch pages.")
+                            Per_host_concurrency = st.number_input("Max concurrent requests per host", min_value=1, max_value=64, value=4, help="Number of connections opened to a single host at once.")
+                            Fetch_retries = st.number_input("Retries", min_value=0, max_value=10, value=3, help="Retries with exponential backoff for failed requests.")
+                            Use_http_cache = st.checkbox("Use HTTP cache", value=True, help="Reuse unchanged pages from disk using ETag/Last-Modified.")
+                    chunking = {"method": Chunk_method, "chunk_size": Chunk_size, "chunk_overlap": Chunk_overlap}
+                    ingestion_job_params = {
+                        "collections": selected_collections,
+                        "chunk_method": Chunk_method,
+                        "chunk_size": Chunk_size,
+                        "chunk_overlap": Chunk_overlap,
+                        "max_concurrency": Max_concurrency,
+                        "per_host_concurrency": Per_host_concurrency,
+                        "retries": Fetch_retries,
+                        "use_http_cache": Use_http_cache,
+                    }
                     
                     if upload_option == 'Sitemap':
+                        from pages.backend.chunking import ChunkingStats, chunk_all
+                        from pages.backend.fetcher import WebFetcher, fetch_sitemap_pages
                         with st.form("database_sitemap_form"):
                             sitemap_url = st.text_input("Sitemap URL")
                             submitted = st.form_submit_button("Submit")
                             if submitted:
                                 if sitemap_url:
-                                    sitemap_loader = SitemapLoader(web_path=sitemap_url)
-                                    Chosen_Parameter = RecursiveCharacterTextSplitter(
-                                        chunk_size=Chunk_size,
-                                        chunk_overlap=Chunk_overlap
-                                    )
-                                    docs = sitemap_loader.load_and_split(text_splitter=Chosen_Parameter)
-                                    if not docs:
-                                        st.error("No documents found in the sitemap.")
-                                    else:
-                                        for selected_collection in selected_collections:
-                                            collection_embedding_map = get_collection_embedding_map(db_path)
-                                            embedding_model = collection_embedding_map.get(selected_collection)
-                                            if not embedding_model:
-                                                st.error(f"No embedding model found for collection {selected_collection}.")
-                                                continue
-                                            vectore_store = Chroma.from_documents(
-                                                documents=docs, 
-                                                embedding=OllamaEmbeddings(model=embedding_model), 
-                                                persist_directory=f'./{database_option}', 
-                                                collection_name=selected_collection
+                                    remember_chunking(collection_map, selected_collections, chunking)
+                                if sitemap_url and Run_in_background:
+                                    job_id = submit_job(db_path, 'sitemap', dict(ingestion_job_params, url=sitemap_url))
+                                    st.success(f"Ingestion job #{job_id} queued.")
+                                elif sitemap_url:
+                                    with traced("ingest_sitemap", url=sitemap_url) as ingest_trace:
+                                        fetcher = WebFetcher(
+                                            cache_dir=os.path.join(db_path, 'http_cache') if Use_http_cache else None,
+                                            max_concurrency=Max_concurrency,
+                                            per_host_concurrency=Per_host_concurrency,
+                                            retries=Fetch_retries,
+                                        )
+                                        with span("load") as load_span:
+                                            # Left unparsed, the chunking workers parse every page once
+                                            pages = fetch_sitemap_pages(sitemap_url, fetcher)
+                                            load_span["items"] = len(pages)
+                                        chunking_stats = ChunkingStats()
+                                        docs = chunk_all(pages, chunking, stats=chunking_stats)
+                                        st.caption(fetcher.stats.summary())
+                                        st.caption(chunking_stats.summary())
+                                        if not docs:
+                                            st.error("No documents found in the sitemap.")
+                                        else:
+                                            summary = ingest_documents(
+                                                docs,
+                                                persist_directory=f'./{database_option}',
+                                                collections=selected_collections,
+                                                collection_embedding_map=collection_embedding_map,
                                             )
+                                            report_ingestion(summary)
+                                    st.session_state.last_ingest_trace = ingest_trace
                                 else:
                                     st.error("Please enter a valid Page URL.")
                     elif upload_option == 'Page':
+                        from pages.backend.chunking import ChunkingStats, chunk_all
+                        from pages.backend.fetcher import WebFetcher, fetch_html_pages
                         with st.form("database_page_form"):
                             page_url = st.text_input("Page URL")
                             submitted = st.form_submit_button("Submit")
                             if submitted:
                                 if page_url:
-                                    page_loader = WebBaseLoader(web_path=page_url)
-                                    Chosen_Parameter = RecursiveCharacterTextSplitter(
-                                        chunk_size=Chunk_size,
-                                        chunk_overlap=Chunk_overlap
-                                    )
-                                    docs = page_loader.load_and_split(text_splitter=Chosen_Parameter)
-                                    if not docs:
-                                        st.error("Error with page loader.")
-                                    else:
-                                        for selected_collection in selected_collections:
-                                            collection_embedding_map = get_collection_embedding_map(db_path)
-                                            embedding_model = collection_embedding_map.get(selected_collection)
-                                            if not embedding_model:
-                                                st.error(f"No embedding model found for collection {selected_collection}.")
-                                                continue
-                                            vectore_store = Chroma.from_documents(
-                                                documents=docs, 
-                                                embedding=OllamaEmbeddings(model=embedding_model), 
-                                                persist_directory=f'./{database_option}', 
-                                                collection_name=selected_collection
+                                    remember_chunking(collection_map, selected_collections, chunking)
+                                if page_url and Run_in_background:
+                                    job_id = submit_job(db_path, 'page', dict(ingestion_job_params, url=page_url))
+                                    st.success(f"Ingestion job #{job_id} queued.")
+                                elif page_url:
+                                    with traced("ingest_page", url=page_url) as ingest_trace:
+                                        fetcher = WebFetcher(
+                                            cache_dir=os.path.join(db_path, 'http_cache') if Use_http_cache else None,
+                                            max_concurrency=Max_concurrency,
+                                            per_host_concurrency=Per_host_concurrency,
+                                            retries=Fetch_retries,
+                                        )
+                                        with span("load") as load_span:
+                                            # Left unparsed, the chunking workers parse every page once
+                                            pages = fetch_html_pages([page_url], fetcher)
+                                            load_span["items"] = len(pages)
+                                        chunking_stats = ChunkingStats()
+                                        docs = chunk_all(pages, chunking, stats=chunking_stats)
+                                        st.caption(fetcher.stats.summary())
+                                        st.caption(chunking_stats.summary())
+                                        if not docs:
+                                            st.error("Error with page loader.")
+                                        else:
+                                            summary = ingest_documents(
+                                                docs,
+                                                persist_directory=f'./{database_option}',
+                                                collections=selected_collections,
+                                                collection_embedding_map=collection_embedding_map,
                                             )
+                                            report_ingestion(summary)
+                                    st.session_state.last_ingest_trace = ingest_trace
                                 else:
                                     st.error("Please enter a valid Page URL.")
                     elif upload_option == 'PDF':
+                        from pages.backend.pdf import parse_pdfs
+                        from pages.backend.chunking import ChunkingStats
                         with st.form("database_pdf_form"):
-                            pdf_file = st.file_uploader("Upload PDF", type=["pdf"])
+                            pdf_files = st.file_uploader("Upload PDF", type=["pdf"], accept_multiple_files=True)
                             submitted = st.form_submit_button("Submit")
                             if submitted:
-                                if pdf_file:
-                                    # Save uploaded PDF to a temporary file
-                                    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-                                        tmp_file.write(pdf_file.read())
-                                        tmp_pdf_path = tmp_file.name
-
-                                    try:
-                                        pdf_loader = PyPDFLoader(tmp_pdf_path)
-                                        
-                                        Chosen_Parameter = RecursiveCharacterTextSplitter(
-                                            chunk_size=Chunk_size,
-                                            chunk_overlap=Chunk_overlap
-                                        )
-                                        docs = pdf_loader.load_and_split(text_splitter=Chosen_Parameter)
-                                        if not docs:
-                                            st.error("No documents found in the PDF.")
-                                        else:
-                                            # Optionally add source metadata for each doc
-                                            for doc in docs:
-                                                if not doc.metadata:
-                                                    doc.metadata = {}
-                                                doc.metadata["source"] = pdf_file.name
-                                            for selected_collection in selected_collections:
-                                                embedding_model = collection_embedding_map.get(selected_collection)
-                                                if not embedding_model:
-                                                    st.error(f"No embedding model found for collection {selected_collection}.")
-                                                    continue
-                                                vector_store = Chroma.from_documents(
-                                                    documents=docs,
-                                                    embedding=OllamaEmbeddings(model=embedding_model),
+                                if pdf_files:
+                                    remember_chunking(collection_map, selected_collections, chunking)
+                                if pdf_files and Run_in_background:
+                                    for pdf_file in pdf_files:
+                                        job_id = submit_job(db_path, 'pdf', dict(ingestion_job_params, filename=pdf_file.name), file_bytes=pdf_file.getvalue())
+                                        st.success(f"Ingestion job #{job_id} queued for {pdf_file.name}.")
+                                elif pdf_files:
+                                    # Parsed from the upload buffers, page ranges in parallel, each file embedded as soon as it is parsed
+                                    with traced("ingest_pdf", files=len(pdf_files)) as ingest_trace:
+                                        pdf_progress = st.progress(0.0, text="Parsing PDFs...")
+                                        chunking_stats = ChunkingStats()
+                                        for processed, (pdf_name, docs, error) in enumerate(parse_pdfs(
+                                            [(pdf_file.name, pdf_file.getvalue()) for pdf_file in pdf_files],
+                                            chunking=chunking,
+                                        ), 1):
+                                            chunking_stats.add(1, docs)
+                                            if error:
+                                                st.error(f"Error processing {pdf_name}: {error}")
+                                            elif not docs:
+                                                st.error(f"No documents found in {pdf_name}.")
+                                            else:
+                                                summary = ingest_documents(
+                                                    docs,
                                                     persist_directory=f'./{database_option}',
-                                                    collection_name=selected_collection
+                                                    collections=selected_collections,
+                                                    collection_embedding_map=collection_embedding_map,
                                                 )
-                                            st.success("PDF uploaded and processed successfully!")
-                                    except Exception as e:
-                                        st.error(f"Error processing PDF: {e}")
-                                    finally:
-                                        try:
-                                            os.remove(tmp_pdf_path)
-                                        except Exception:
-                                            pass
+                                                report_ingestion(summary)
+                                                st.success(f"{pdf_name} uploaded and processed successfully!")
+                                            pdf_progress.progress(processed / len(pdf_files), text=f"Processed {processed}/{len(pdf_files)} PDFs")
+                                        # Includes embedding, files are split in the workers while earlier ones are ingested
+                                        st.caption(chunking_stats.summary())
+                                    st.session_state.last_ingest_trace = ingest_trace
                                 else:
                                     st.error("Please upload a PDF file.")
                     else:
-                        st.write("I have no idea how you got here, but hey you made it!")
\ No newline at end of file
+                        st.write("I have no idea how you got here, but hey you made it!")
+
+            if st.session_state.get("last_ingest_trace") is not None:
+                with st.expander("Performance"):
+                    show_performance(st.session_state.last_ingest_trace)
+
+            with st.expander("Ingestion jobs"):
+                show_ingestion_jobs(db_path)
\ No newline at end of file
@@ -1,20 +1,77 @@
+from pages.backend.chunking import CHUNKING_METHODS
+from pages.backend.ollama_client import CHAT_MODELS
+from pages.backend.retrieval import SEARCH_TYPES
+
+
 class Block:
     def __init__(self, name, description):
         self.name = name
         self.description = description
         self.inputs = []
         self.outputs = []
-    
+
     def add_input(self, input_name, input_type):
         self.inputs.append({'name': input_name, 'type': input_type})
 
 block_array = [
     Block("Input", "Input block for user data")]
 
-# Example block definitions in Python
+
+# Block definitions, injected into the canvas and compiled by pages/backend/pipeline.py.
+# Inputs are the node's input ports in order, fields are stored in the node's data by Drawflow.
 blocks = [
-    {"type": "TextInput", "label": "Text Input", "color": "#2de0fc"},
-    {"type": "Retriever", "label": "Retriever", "color": "#ffb347"},
-    {"type": "LLM", "label": "LLM", "color": "#a259ff"},
-    # Add more as needed
-]
\ No newline at end of file
+    {
+        "type": "TextInput", "label": "Text Input", "color": "#2de0fc",
+        "inputs": [],
+        "fields": [{"name": "text", "label": "Text", "type": "textarea", "default": ""}],
+    },
+    {
+        "type": "SitemapLoader", "label": "Sitemap Loader", "color": "#7bd88f",
+        "inputs": [],
+        "fields": [{"name": "url", "label": "Sitemap URL", "type": "text", "default": ""}],
+    },
+    {
+        "type": "PageLoader", "label": "Web Page Loader", "color": "#7bd88f",
+        "inputs": [],
+        "fields": [{"name": "urls", "label": "URLs, comma separated", "type": "text", "default": ""}],
+    },
+    {
+        "type": "PDFLoader", "label": "PDF Loader", "color": "#7bd88f",
+        "inputs": [],
+        "fields": [{"name": "path", "label": "PDF path", "type": "text", "default": ""}],
+    },
+    {
+        "type": "Splitter", "label": "Splitter", "color": "#f4e285",
+        "inputs": [{"name": "documents", "label": "Documents"}],
+        "fields": [
+            {"name": "chunk_method", "label": "Method", "type": "select", "options": list(CHUNKING_METHODS), "default": "characters"},
+            {"name": "chunk_size", "label": "Chunk size", "type": "int", "default": 500},
+            {"name": "chunk_overlap", "label": "Chunk overlap", "type": "int", "default": 50},
+        ],
+    },
+    {
+        "type": "Retriever", "label": "Retriever", "color": "#ffb347",
+        "inputs": [{"name": "question", "label": "Question"}],
+        "fields": [
+            {"name": "database", "label": "Database", "type": "text", "default": ""},
+            {"name": "collection", "label": "Collection", "type": "text", "default": ""},
+            {"name": "search_type", "label": "Search type", "type": "select", "options": SEARCH_TYPES, "default": "mmr"},
+            {"name": "number", "label": "Results (score threshold for similarity_score_threshold)", "type": "float", "default": 4},
+            {"name": "fetch_k", "label": "Candidates (fetch_k)", "type": "int", "default": 20},
+            {"name": "lambda_mult", "label": "Diversity (lambda)", "type": "float", "default": 0.5},
+        ],
+    },
+    {
+        "type": "Prompt", "label": "Prompt", "color": "#ff6f91",
+        "inputs": [{"name": "question", "label": "Question"}, {"name": "context", "label": "Context", "optional": True}],
+        "fields": [
+            {"name": "template", "label": "Template with {context} and {question}, empty for the chatbot's", "type": "textarea", "default": ""},
+            {"name": "context_tokens", "label": "Context token budget", "type": "int", "default": 1536},
+        ],
+    },
+    {
+        "type": "LLM", "label": "LLM", "color": "#a259ff",
+        "inputs": [{"name": "prompt", "label": "Prompt"}],
+        "fields": [{"name": "model", "label": "Model", "type": "select", "options": CHAT_MODELS, "default": "llama3.1"}],
+    },
+]
@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from pages.backend.resources import on_collection_invalidated
+
+
+class AnswerCache:
+    """Answers keyed by (database, collection, LLM), reused when a new query is close enough and sees the same chunks."""
+
+    def __init__(self, max_entries=256, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _expire(self, now):
+        for entry_id in [entry_id for entry_id, entry in self.entries.items() if now - entry["created_at"] > self.ttl]:
+            del self.entries[entry_id]
+
+    def lookup(self, db_path, collection_name, llm, query_embedding, chunk_ids, threshold, max_age=None):
+        scope = (os.path.abspath(db_path), collection_name, llm)
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        now = time.time()
+        with self.lock:
+            self._expire(now)
+            # Only answers generated from exactly the same retrieved chunks are candidates
+            candidates = [
+                (entry_id, entry) for entry_id, entry in self.entries.items()
+                if entry["scope"] == scope
+                and entry["chunk_ids"] == tuple(chunk_ids)
+                and (max_age is None or now - entry["created_at"] <= max_age)
+            ]
+            if candidates:
+                similarities = np.stack([entry["embedding"] for _, entry in candidates]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= threshold:
+                    entry_id, entry = candidates[best]
+                    self.entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return entry["answer"], float(similarities[best])
+            self.misses += 1
+        return None, None
+
+    def store(self, db_path, collection_name, llm, query_embedding, chunk_ids, answer):
+        embedding = np.asarray(query_embedding, dtype=np.float32)
+        with self.lock:
+            self.entries[self.next_id] = {
+                "scope": (os.path.abspath(db_path), collection_name, llm),
+                "embedding": embedding / (np.linalg.norm(embedding) or 1.0),
+                "chunk_ids": tuple(chunk_ids),
+                "answer": answer,
+                "created_at": time.time(),
+            }
+            self.next_id += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, db_path, collection_name):
+        db_path = os.path.abspath(db_path)
+        with self.lock:
+            for entry_id in [
+                entry_id for entry_id, entry in self.entries.items()
+                if entry["scope"][0] == db_path and entry["scope"][1] == collection_name
+            ]:
+                del self.entries[entry_id]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self.entries),
+        }
+
+
+answer_cache = AnswerCache()
+on_collection_invalidated(answer_cache.invalidate)
+
+
+def retrieved_chunk_ids(results):
+    return [getattr(doc, "id", None) or str(hash(doc.page_content)) for doc in results]
@@ -0,0 +1,515 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+from pages.backend.collection_map import get_collection_map, storage_label
+from pages.backend.context import DEFAULT_CONTEXT_TOKENS, estimate_tokens, pack_context
+from pages.backend.embedding_cache import normalize_query, query_cache
+from pages.backend.metrics import add_collector, prometheus_text, record
+from pages.backend.migrate import is_migration_collection
+from pages.backend.ollama_client import INTERACTIVE, get_chat_model, get_ollama_client
+from pages.backend.pipeline import DEFAULT_PROMPT_TEMPLATE
+from pages.backend.retrieval import SEARCH_TYPES
+
+DEFAULT_LLM = "llama3.1"
+# Latencies kept per endpoint for the percentiles in /stats
+RECENT_REQUESTS = 10000
+THROUGHPUT_WINDOW = 60.0
+
+
+class RequestError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class Overloaded(RequestError):
+    def __init__(self, message):
+        super().__init__(message, status_code=503)
+
+
+def upstream_error(error):
+    """The RequestError to answer with when Ollama or Chroma failed, None for any other error."""
+    import httpx
+    from chromadb.errors import ChromaError
+    from ollama import ResponseError
+    if isinstance(error, ResponseError):
+        # Ollama answers 429 or 503 when it is busy, the client can retry later
+        return RequestError(f"Ollama error: {error.error}", status_code=503 if error.status_code in (429, 503) else 502)
+    # The ollama client turns connection failures into the builtin ConnectionError
+    if isinstance(error, (ConnectionError, httpx.TransportError)):
+        return RequestError(f"Ollama is unreachable: {error}", status_code=503)
+    if isinstance(error, ChromaError):
+        return RequestError(f"Search failed: {error}", status_code=502)
+    return None
+
+
+class QueryBatcher:
+    """Coalesces concurrent query embeddings into one /api/embed request per model and time window.
+
+    The first query for a model opens a window of `window` seconds, every query arriving in it
+    joins the same request, and a full batch goes out at once. Vectors go through the shared
+    query cache, so retrieval afterwards finds them there instead of embedding again.
+    """
+
+    def __init__(self, executor, window=0.005, max_batch=64):
+        self.executor = executor
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = {}
+        self.timers = {}
+        self.batches = 0
+        self.queries = 0
+
+    async def embed(self, model, text, db_path):
+        # Only the memory tier is checked on the event loop, the SQLite tier is read in embed_and_cache
+        vector = query_cache.peek(model, text)
+        if vector is not None:
+            return vector
+        future = asyncio.get_running_loop().create_future()
+        batch = self.pending.setdefault(model, [])
+        batch.append((normalize_query(text), db_path, future))
+        if len(batch) >= self.max_batch or self.window <= 0:
+            self.flush(model)
+        elif len(batch) == 1:
+            self.timers[model] = asyncio.get_running_loop().call_later(self.window, self.flush, model)
+        return await future
+
+    def flush(self, model):
+        timer = self.timers.pop(model, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self.pending.pop(model, None)
+        if batch:
+            asyncio.get_running_loop().create_task(self.embed_batch(model, batch))
+
+    def embed_and_cache(self, model, batch):
+        vectors = {}
+        for text, db_path, _ in batch:
+            if text not in vectors:
+                vector = query_cache.get(model, text, db_path)
+                if vector is not None:
+                    vectors[text] = vector
+        texts = list(dict.fromkeys(text for text, _, _ in batch if text not in vectors))
+        if texts:
+            embedded = dict(zip(texts, get_ollama_client().embed(model, texts, lane=INTERACTIVE)))
+            for text, db_path, _ in batch:
+                if text in embedded:
+                    query_cache.put(model, text, embedded[text], db_path)
+            vectors.update(embedded)
+        return vectors
+
+    async def embed_batch(self, model, batch):
+        start = time.perf_counter()
+        try:
+            vectors = await asyncio.get_running_loop().run_in_executor(self.executor, self.embed_and_cache, model, batch)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        record("query_embed_batch", time.perf_counter() - start, start=start, model=model, items=len(batch))
+        self.batches += 1
+        self.queries += len(batch)
+        for text, _, future in batch:
+            if not future.done():
+                future.set_result(vectors[text])
+
+
+class AdmissionControl:
+    """At most max_active requests of a kind at once and max_queued waiting, the rest are turned away.
+
+    A request that waits longer than queue_timeout is turned away too, so clients see a quick 503
+    they can retry instead of a timeout under overload.
+    """
+
+    def __init__(self, name, max_active, max_queued, queue_timeout):
+        self.name = name
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.semaphore = asyncio.Semaphore(max_active)
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    async def acquire(self):
+        if self.semaphore.locked() and self.queued >= self.max_queued:
+            self.rejected += 1
+            raise Overloaded(f"Too many {self.name} requests, retry later.")
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Overloaded(f"No {self.name} slot within {self.queue_timeout:.0f} s, retry later.") from None
+        finally:
+            self.queued -= 1
+        self.active += 1
+        self.admitted += 1
+
+    def release(self):
+        self.active -= 1
+        self.semaphore.release()
+
+
+class EndpointStats:
+    def __init__(self):
+        self.recent = deque(maxlen=RECENT_REQUESTS)
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds, ok=True):
+        with self.lock:
+            self.recent.append((time.time(), seconds))
+            self.requests += 1
+            self.errors += 0 if ok else 1
+
+    def summary(self):
+        with self.lock:
+            recent = list(self.recent)
+            requests, errors = self.requests, self.errors
+        now = time.time()
+        latencies = np.array([seconds for _, seconds in recent]) * 1000
+        summary = {
+            "requests": requests,
+            "errors": errors,
+            "per_second": sum(1 for finished_at, _ in recent if now - finished_at <= THROUGHPUT_WINDOW) / THROUGHPUT_WINDOW,
+        }
+        if len(latencies):
+            summary.update({f"p{percentile}_ms": float(np.percentile(latencies, percentile)) for percentile in (50, 95, 99)})
+        return summary
+
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def document_payload(doc):
+    return {"id": getattr(doc, "id", None), "text": doc.page_content, "metadata": doc.metadata}
+
+
+class RagService:
+    """Retrieval and RAG chat over the data_* databases under root, for many concurrent clients."""
+
+    def __init__(self, root=".", batch_window=0.005, max_batch=64, max_retrievals=32, max_chats=8, max_queued=128, queue_timeout=10.0):
+        self.root = os.path.abspath(root)
+        # Retrieval, Chroma and the Ollama streams are blocking calls, each holds a thread while it runs
+        self.executor = ThreadPoolExecutor(max_workers=max_retrievals + max_chats + 4, thread_name_prefix="api")
+        self.batcher = QueryBatcher(self.executor, window=batch_window, max_batch=max_batch)
+        self.admission = {
+            "retrieve": AdmissionControl("retrieve", max_retrievals, max_queued, queue_timeout),
+            "chat": AdmissionControl("chat", max_chats, max_queued, queue_timeout),
+        }
+        self.stats = {"retrieve": EndpointStats(), "chat": EndpointStats()}
+
+    def databases(self):
+        return sorted(
+            entry for entry in os.listdir(self.root)
+            if 'data_' in entry and os.path.isdir(os.path.join(self.root, entry))
+        )
+
+    def resolve(self, database, collection):
+        if not isinstance(database, str) or not isinstance(collection, str):
+            raise RequestError("Send \"database\" and \"collection\" names.")
+        # Only directories the pages would list, never a path from the request
+        if database not in self.databases():
+            raise RequestError(f"Unknown database {database!r}.", status_code=404)
+        db_path = os.path.join(self.root, database)
+        embedding_model = get_collection_map(db_path).embedding_model(collection)
+        if not embedding_model or is_migration_collection(collection):
+            raise RequestError(f"Unknown collection {collection!r} in {database}.", status_code=404)
+        return db_path, embedding_model
+
+    def catalog(self):
+        catalog = {}
+        for database in self.databases():
+            collection_map = get_collection_map(os.path.join(self.root, database))
+            catalog[database] = {
+                name: {
+                    "embedding_model": model,
+                    "storage": storage_label(collection_map.storage(name)),
+                    "stats": collection_map.stats(name),
+                }
+                for name, model in collection_map.embedding_models().items()
+                if model and not is_migration_collection(name)
+            }
+        return catalog
+
+    async def search(self, params):
+        """Embed the query through the batcher, then run the search in a worker thread."""
+        from pages.backend.resources import get_vector_store
+        from pages.backend.retrieval import retrieve
+        query = params.get("query") or params.get("question")
+        if not isinstance(query, str) or not query.strip():
+            raise RequestError("Send a non-empty \"query\".")
+        db_path, embedding_model = self.resolve(params.get("database"), params.get("collection"))
+        search_type = params.get("search_type", "mmr")
+        if search_type not in SEARCH_TYPES:
+            raise RequestError(f"search_type must be one of {', '.join(SEARCH_TYPES)}.")
+        try:
+            if search_type == "similarity_score_threshold":
+                number = float(params.get("score_threshold", 0.0))
+            else:
+                number = int(params.get("k", 4))
+            fetch_k = int(params.get("fetch_k", 20))
+            lambda_mult = float(params.get("lambda_mult", 0.5))
+        except (TypeError, ValueError) as e:
+            raise RequestError(f"Bad search parameter: {e}") from e
+        if (search_type != "similarity_score_threshold" and number < 1) or fetch_k < 1:
+            raise RequestError("k and fetch_k must be at least 1.")
+        collection_name = params["collection"]
+        try:
+            # The search finds the vector in the query cache
+            await self.batcher.embed(embedding_model, query, db_path)
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor,
+                lambda: retrieve(
+                    get_vector_store(db_path, collection_name, embedding_model), query, search_type, number,
+                    db_path=db_path, collection_name=collection_name, fetch_k=fetch_k, lambda_mult=lambda_mult,
+                ),
+            )
+        except Exception as e:
+            error = upstream_error(e)
+            if error is None:
+                raise
+            raise error from e
+
+    async def retrieve(self, params):
+        start = time.perf_counter()
+        admission = self.admission["retrieve"]
+        await admission.acquire()
+        ok = False
+        try:
+            docs = await self.search(params)
+            ok = True
+        finally:
+            admission.release()
+            self.stats["retrieve"].observe(time.perf_counter() - start, ok)
+        record("api_retrieve", time.perf_counter() - start, start=start, items=len(docs))
+        return {"results": [document_payload(doc) for doc in docs], "seconds": time.perf_counter() - start}
+
+    async def prepare_chat(self, params):
+        question = params.get("question") or params.get("query")
+        docs = await self.search(dict(params, query=question))
+        try:
+            context_tokens = int(params.get("context_tokens", DEFAULT_CONTEXT_TOKENS))
+        except (TypeError, ValueError) as e:
+            raise RequestError(f"Bad context_tokens: {e}") from e
+        context_text, _ = pack_context(docs, max_tokens=context_tokens)
+        return docs, DEFAULT_PROMPT_TEMPLATE.format(context=context_text, question=question)
+
+    async def stream_tokens(self, stream, cancelled):
+        """Tokens of a TokenStream, read in a worker thread and handed to the event loop."""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        finished = object()
+
+        def produce():
+            try:
+                for token in stream:
+                    if cancelled.is_set():
+                        # Leaving the loop closes the stream, which ends the request to Ollama and frees the model's slot
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, token)
+                loop.call_soon_threadsafe(queue.put_nowait, finished)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+
+        loop.run_in_executor(self.executor, produce)
+        while True:
+            item = await queue.get()
+            if item is finished:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    async def chat(self, params):
+        """Start a chat turn: admission, retrieval and the prompt happen before the response starts.
+
+        Returns the sources, an async generator of (event, payload) pairs that ends with a "done" or
+        an "error" event, and a finish callback. The chat slot is held until finish is called, which
+        the generator does when it ends and the caller must do too, in case the generator never starts.
+        """
+        from pages.backend.streaming import TokenStream
+        start = time.perf_counter()
+        admission = self.admission["chat"]
+        await admission.acquire()
+        try:
+            docs, prompt_text = await self.prepare_chat(params)
+        except BaseException:
+            admission.release()
+            self.stats["chat"].observe(time.perf_counter() - start, ok=False)
+            raise
+        stream = TokenStream(get_chat_model(params.get("llm") or DEFAULT_LLM), prompt_text)
+        sources = [dict(document_payload(doc), text=doc.page_content[:200]) for doc in docs]
+        cancelled = threading.Event()
+        finished = []
+
+        def finish(ok=False):
+            if finished:
+                return
+            finished.append(ok)
+            cancelled.set()
+            admission.release()
+            self.stats["chat"].observe(time.perf_counter() - start, ok)
+            record("api_chat", time.perf_counter() - start, start=start, tokens=stream.tokens)
+
+        async def events():
+            ok = False
+            try:
+                yield "sources", {"sources": sources, "prompt_tokens": estimate_tokens(prompt_text)}
+                async for token in self.stream_tokens(stream, cancelled):
+                    yield "token", {"text": token}
+                yield "done", dict(stream.metrics(), seconds=time.perf_counter() - start)
+                ok = True
+            except Exception as e:
+                error = upstream_error(e) or e
+                yield "error", {"error": str(error), "status": getattr(error, "status_code", 500)}
+            finally:
+                # Also reached when the client disconnects and the response stops iterating
+                finish(ok)
+
+        return sources, events(), finish
+
+    def summary(self):
+        return {
+            "endpoints": {name: stats.summary() for name, stats in self.stats.items()},
+            "admission": {
+                name: {"active": control.active, "queued": control.queued, "admitted": control.admitted, "rejected": control.rejected}
+                for name, control in self.admission.items()
+            },
+            "query_batches": {
+                "batches": self.batcher.batches,
+                "queries": self.batcher.queries,
+                "mean_batch_size": self.batcher.queries / self.batcher.batches if self.batcher.batches else 0.0,
+                "window_ms": self.batcher.window * 1000,
+            },
+            "query_cache": query_cache.stats(),
+        }
+
+    def prometheus_lines(self):
+        lines = []
+        for metric, help_text, kind, attribute in (
+            ("api_active", "Requests being served, per endpoint.", "gauge", "active"),
+            ("api_queued", "Requests waiting for admission, per endpoint.", "gauge", "queued"),
+            ("api_admitted_total", "Requests admitted, per endpoint.", "counter", "admitted"),
+            ("api_rejected_total", "Requests turned away with a 503, per endpoint.", "counter", "rejected"),
+        ):
+            lines.append(f"# HELP easy_rag_{metric} {help_text}")
+            lines.append(f"# TYPE easy_rag_{metric} {kind}")
+            lines += [f'easy_rag_{metric}{{endpoint="{name}"}} {getattr(control, attribute)}' for name, control in self.admission.items()]
+        lines += [
+            "# HELP easy_rag_api_query_batches_total Embedding requests sent for batched queries.",
+            "# TYPE easy_rag_api_query_batches_total counter",
+            f"easy_rag_api_query_batches_total {self.batcher.batches}",
+            "# HELP easy_rag_api_batched_queries_total Queries embedded in those requests.",
+            "# TYPE easy_rag_api_batched_queries_total counter",
+            f"easy_rag_api_batched_queries_total {self.batcher.queries}",
+        ]
+        return lines
+
+
+async def read_json(request):
+    try:
+        params = await request.json()
+    except ValueError:
+        raise RequestError("The body must be a JSON object.") from None
+    if not isinstance(params, dict):
+        raise RequestError("The body must be a JSON object.")
+    return params
+
+
+class ChatStreamResponse(StreamingResponse):
+    """Streams chat events and frees the chat slot however the response ends.
+
+    A client that disconnects before the body starts leaves the event generator unstarted, and
+    Starlette skips background tasks on a disconnect, so the slot is released here.
+    """
+
+    def __init__(self, content, finish, **kwargs):
+        super().__init__(content, **kwargs)
+        self.finish = finish
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.finish()
+
+
+def error_response(error):
+    headers = {"Retry-After": "1"} if error.status_code == 503 else None
+    return JSONResponse({"error": str(error)}, status_code=error.status_code, headers=headers)
+
+
+def create_app(**settings):
+    """ASGI app serving /retrieve, /chat (server-sent events), /databases, /stats and /metrics."""
+    service = RagService(**settings)
+    add_collector(service.prometheus_lines)
+
+    async def health(request):
+        return JSONResponse({"status": "ok"})
+
+    async def databases(request):
+        return JSONResponse(await asyncio.get_running_loop().run_in_executor(service.executor, service.catalog))
+
+    async def retrieve(request):
+        try:
+            return JSONResponse(await service.retrieve(await read_json(request)))
+        except RequestError as e:
+            return error_response(e)
+
+    async def chat(request):
+        try:
+            params = await read_json(request)
+            sources, events, finish = await service.chat(params)
+        except RequestError as e:
+            return error_response(e)
+        if params.get("stream", True):
+            return ChatStreamResponse(
+                (sse_event(event, payload) async for event, payload in events),
+                finish,
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache"},
+            )
+        answer, metrics = [], {}
+        try:
+            async for event, payload in events:
+                if event == "token":
+                    answer.append(payload["text"])
+                elif event == "error":
+                    return error_response(RequestError(payload["error"], status_code=payload["status"]))
+                elif event == "done":
+                    metrics = payload
+        finally:
+            await events.aclose()
+            finish()
+        return JSONResponse({"answer": "".join(answer), "sources": sources, "metrics": metrics})
+
+    async def stats(request):
+        return JSONResponse(service.summary())
+
+    async def metrics(request):
+        return PlainTextResponse(prometheus_text(), media_type="text/plain; version=0.0.4")
+
+    app = Starlette(routes=[
+        Route("/health", health),
+        Route("/databases", databases),
+        Route("/retrieve", retrieve, methods=["POST"]),
+        Route("/chat", chat, methods=["POST"]),
+        Route("/stats", stats),
+        Route("/metrics", metrics),
+    ])
+    app.state.service = service
+    return app
@@ -0,0 +1,228 @@
+import itertools
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pages.backend.metrics import record
+
+CHUNKING_METHODS = {
+    "characters": "Characters",
+    "tokens": "Tokens, sized for the embedding model",
+    "html": "HTML sections, split at headings",
+}
+DEFAULT_CHUNKING = {"method": "characters", "chunk_size": 500, "chunk_overlap": 50}
+# Input limits of the embedding models offered in the app, in tokens of their own tokenizers
+EMBEDDING_TOKEN_LIMITS = {
+    "mxbai-embed-large": 512,
+    "all-minilm": 256,
+    "nomic-embed-text": 8192,
+    "granite-embedding": 512,
+    "paraphrase-multilingual": 128,
+}
+DEFAULT_TOKEN_LIMIT = 512
+# Room for the special tokens the model adds and for the estimate being low
+TOKEN_MARGIN = 8
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+# The title is already in the metadata
+SKIPPED_TAGS = {"script", "style", "noscript", "template", "title"}
+# Start on a new line, so a heading and the paragraph after it do not run together
+BLOCK_TAGS = {"p", "div", "li", "tr", "br", "pre", "blockquote", "section", "article", "table", "dt", "dd"}
+NEWLINES_PATTERN = re.compile(r"\n\s*\n\s*")
+# Text per task sent to a worker, large enough that pickling is cheap next to splitting
+BATCH_CHARS = 1_000_000
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_parser_executor():
+    """Process pool shared by PDF parsing and chunking."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Spawned rather than forked, the Streamlit server process runs many threads
+            _executor = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def count_tokens(text):
+    # WordPiece-like estimate without the model's vocabulary: punctuation and words up to 6 characters
+    # are one token, longer words one per 6 characters. Slightly high for English, as a limit should be.
+    return sum(-(-len(token) // 6) for token in TOKEN_PATTERN.findall(text))
+
+
+def token_limit(embedding_models):
+    """Largest chunk in tokens that every one of the models embeds without truncating it."""
+    limits = [EMBEDDING_TOKEN_LIMITS.get(model, DEFAULT_TOKEN_LIMIT) for model in embedding_models if model]
+    return min(limits or [DEFAULT_TOKEN_LIMIT]) - TOKEN_MARGIN
+
+
+def chunking_from_settings(settings):
+    """The chunking stored in a collection's settings, filled in with the defaults."""
+    return {
+        "method": settings.get("chunk_method", DEFAULT_CHUNKING["method"]),
+        "chunk_size": settings.get("chunk_size", DEFAULT_CHUNKING["chunk_size"]),
+        "chunk_overlap": settings.get("chunk_overlap", DEFAULT_CHUNKING["chunk_overlap"]),
+    }
+
+
+def chunking_settings(chunking):
+    return {"chunk_method": chunking["method"], "chunk_size": chunking["chunk_size"], "chunk_overlap": chunking["chunk_overlap"]}
+
+
+def make_splitter(chunking):
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    if chunking["method"] == "tokens":
+        return RecursiveCharacterTextSplitter(
+            chunk_size=chunking["chunk_size"],
+            chunk_overlap=chunking["chunk_overlap"],
+            length_function=count_tokens,
+        )
+    # HTML sections are sized in characters, as are documents without headings under the html method
+    return RecursiveCharacterTextSplitter(chunk_size=chunking["chunk_size"], chunk_overlap=chunking["chunk_overlap"])
+
+
+def html_sections(url, body):
+    """One document per heading section of an HTML page, from a single parse.
+
+    Each section starts with its heading and carries the heading path as "section" metadata,
+    next to the page metadata html_to_document gives the whole page.
+    """
+    from bs4 import BeautifulSoup, CData, NavigableString, Tag
+    from langchain_core.documents import Document
+    from pages.backend.fetcher import page_metadata
+    soup = BeautifulSoup(body, "html.parser")
+    metadata = page_metadata(url, soup)
+    sections = []
+    headings = []
+    parts = []
+
+    def flush():
+        text = NEWLINES_PATTERN.sub("\n\n", "".join(parts)).strip()
+        if text:
+            section_metadata = dict(metadata)
+            if headings:
+                section_metadata["section"] = " > ".join(heading for _, heading in headings)
+            sections.append(Document(page_content=text, metadata=section_metadata))
+        parts.clear()
+
+    for element in soup.descendants:
+        if isinstance(element, Tag):
+            if element.name in HEADING_TAGS:
+                flush()
+                level = int(element.name[1])
+                headings = [(other, heading) for other, heading in headings if other < level]
+                headings.append((level, element.get_text(" ", strip=True)))
+            if element.name in BLOCK_TAGS:
+                parts.append("\n")
+        elif type(element) in (NavigableString, CData) and element.parent.name not in SKIPPED_TAGS:
+            parts.append(str(element))
+    flush()
+    return sections
+
+
+def split_batch(items, chunking):
+    """Chunks of a batch of documents and (url, html) pages. Runs in a worker process.
+
+    Pages are parsed once here, into sections for the html method or into one document otherwise.
+    """
+    from pages.backend.fetcher import html_to_document
+    splitter = make_splitter(chunking)
+    chunks = []
+    for item in items:
+        # Pages are (url, html) tuples, everything else is already a Document
+        if not isinstance(item, tuple):
+            docs = [item]
+        elif chunking["method"] == "html":
+            docs = html_sections(*item)
+        else:
+            docs = [html_to_document(*item)]
+        chunks.extend(splitter.split_documents(docs))
+    return chunks
+
+
+def split_documents(docs, chunking):
+    return split_batch(docs, chunking)
+
+
+def item_chars(item):
+    return len(item[1]) if isinstance(item, tuple) else len(item.page_content)
+
+
+def batches_by_size(items, batch_chars=BATCH_CHARS):
+    batch, size = [], 0
+    for item in items:
+        batch.append(item)
+        size += item_chars(item)
+        if size >= batch_chars:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+class ChunkingStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.documents = 0
+        self.chunks = 0
+        self.batches = 0
+
+    def add(self, documents, chunks):
+        self.documents += documents
+        self.chunks += len(chunks)
+        self.batches += 1
+        return chunks
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def chunks_per_sec(self):
+        return self.chunks / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return (
+            f"Split {self.documents} documents into {self.chunks} chunks in {self.elapsed:.2f}s "
+            f"({self.chunks_per_sec:.0f} chunks/sec, {self.batches} batches)"
+        )
+
+
+def chunk_stream(items, chunking, executor=None, stats=None, batch_chars=BATCH_CHARS):
+    """Yield the chunks of documents and (url, html) pages batch by batch, in input order.
+
+    Batches are split in the parser process pool, a few at a time ahead of the consumer, so memory
+    stays bounded and the caller can embed one batch while the next ones are split. A single batch,
+    or a single CPU without an explicit executor, is split in the calling process.
+    """
+    stats = stats or ChunkingStats()
+    batches = batches_by_size(items, batch_chars)
+    head = list(itertools.islice(batches, 2))
+    batches = itertools.chain(head, batches)
+    if executor is None and (len(head) < 2 or (os.cpu_count() or 1) < 2):
+        for batch in batches:
+            chunks = split_batch(batch, chunking)
+            stats.add(len(batch), chunks)
+            yield chunks
+    else:
+        executor = executor or get_parser_executor()
+        max_in_flight = 2 * (getattr(executor, "_max_workers", None) or os.cpu_count() or 1)
+        in_flight = []
+        for batch in batches:
+            in_flight.append((len(batch), executor.submit(split_batch, batch, chunking)))
+            if len(in_flight) >= max_in_flight:
+                documents, future = in_flight.pop(0)
+                yield stats.add(documents, future.result())
+        for documents, future in in_flight:
+            yield stats.add(documents, future.result())
+    stats.finished = time.perf_counter()
+    record("split", stats.elapsed, start=stats.started, items=stats.chunks, method=chunking["method"])
+
+
+def chunk_all(items, chunking, executor=None, stats=None):
+    return [chunk for chunks in chunk_stream(items, chunking, executor=executor, stats=stats) for chunk in chunks]
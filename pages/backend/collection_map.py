@@ -0,0 +1,178 @@
+import copy
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, writes from other processes are not serialized, the rename still keeps the file whole
+    fcntl = None
+
+MAP_FILE = 'collection_embedding_map.json'
+LOCK_FILE = 'collection_embedding_map.lock'
+# Entries are the embedding model name, or a dict with "model" and any of "engine"/"dtype" for collections
+# whose vectors live in a flat index instead of Chroma's HNSW index, "settings" and "stats"
+DEFAULT_STORAGE = {"engine": "chroma"}
+STORAGE_OPTIONS = {
+    "Chroma HNSW": DEFAULT_STORAGE,
+    "Flat float32": {"engine": "flat", "dtype": "float32"},
+    "Flat float16": {"engine": "flat", "dtype": "float16"},
+    "Flat int8": {"engine": "flat", "dtype": "int8"},
+}
+
+
+def embedding_model_of(entry):
+    return entry.get("model") if isinstance(entry, dict) else entry
+
+
+def storage_of(entry):
+    if isinstance(entry, dict) and entry.get("engine", "chroma") != "chroma":
+        return {"engine": entry["engine"], "dtype": entry.get("dtype", "float32")}
+    return DEFAULT_STORAGE
+
+
+def storage_label(storage):
+    for label, option in STORAGE_OPTIONS.items():
+        if option == storage:
+            return label
+    return storage.get("engine", "chroma")
+
+
+def compact_entry(entry):
+    # Plain model names when nothing else is set, so maps stay readable by older versions
+    if set(entry) == {"model"}:
+        return entry["model"]
+    return entry
+
+
+@contextmanager
+def file_lock(path):
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class CollectionMap:
+    """Embedding model, storage engine, settings and statistics of every collection of a database.
+
+    Reads are served from memory until the file changes on disk. Writes re-read the file under a lock
+    and replace it with a renamed temporary file, so sessions and processes writing at the same time
+    do not lose each other's entries and readers never see a partial file.
+    """
+
+    def __init__(self, db_path):
+        self.path = os.path.join(db_path, MAP_FILE)
+        self.lock_path = os.path.join(db_path, LOCK_FILE)
+        self.lock = threading.RLock()
+        self.entries = {}
+        self.loaded_key = None
+
+    def reload(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.entries, self.loaded_key = {}, None
+            return
+        # A write replaces the file, the inode changes even when the mtime resolution is coarse
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if key == self.loaded_key:
+            return
+        with open(self.path, 'r') as f:
+            self.entries = json.load(f)
+        self.loaded_key = key
+
+    def _entry(self, collection_name):
+        with self.lock:
+            self.reload()
+            return self.entries.get(collection_name)
+
+    def names(self):
+        with self.lock:
+            self.reload()
+            return list(self.entries)
+
+    def embedding_models(self):
+        with self.lock:
+            self.reload()
+            return {name: embedding_model_of(entry) for name, entry in self.entries.items()}
+
+    def embedding_model(self, collection_name):
+        return embedding_model_of(self._entry(collection_name))
+
+    def storage(self, collection_name):
+        return storage_of(self._entry(collection_name))
+
+    def settings(self, collection_name):
+        entry = self._entry(collection_name)
+        return dict(entry.get("settings", {})) if isinstance(entry, dict) else {}
+
+    def stats(self, collection_name):
+        entry = self._entry(collection_name)
+        return dict(entry.get("stats", {})) if isinstance(entry, dict) else {}
+
+    @contextmanager
+    def editing(self, collection_name):
+        """Yield the collection's entry as a dict, then write it back with the rest of the map."""
+        with self.lock, file_lock(self.lock_path):
+            # Another process may have written within the mtime resolution, always read before changing
+            self.loaded_key = None
+            self.reload()
+            entries = copy.deepcopy(self.entries)
+            entry = entries.get(collection_name)
+            entry = dict(entry) if isinstance(entry, dict) else {"model": entry}
+            yield entry
+            entries[collection_name] = compact_entry({key: value for key, value in entry.items() if value is not None})
+            temporary_path = f"{self.path}.tmp"
+            with open(temporary_path, 'w') as f:
+                json.dump(entries, f)
+            os.replace(temporary_path, self.path)
+            self.entries = entries
+            stat = os.stat(self.path)
+            self.loaded_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def set_collection(self, collection_name, embedding_model, storage=None):
+        # Settings and statistics are kept, a migration changes the model and engine only
+        with self.editing(collection_name) as entry:
+            entry["model"] = embedding_model
+            entry.pop("engine", None)
+            entry.pop("dtype", None)
+            if storage and storage.get("engine", "chroma") != "chroma":
+                entry.update(engine=storage["engine"], dtype=storage.get("dtype", "float32"))
+
+    def update_settings(self, collection_name, **settings):
+        if settings == {key: value for key, value in self.settings(collection_name).items() if key in settings}:
+            return
+        with self.editing(collection_name) as entry:
+            entry["settings"] = dict(entry.get("settings", {}), **settings)
+
+    def record_stats(self, collection_name, **stats):
+        with self.editing(collection_name) as entry:
+            entry["stats"] = dict(entry.get("stats", {}), **stats)
+
+
+_maps = {}
+_maps_lock = threading.Lock()
+
+
+def get_collection_map(db_path):
+    key = os.path.abspath(db_path)
+    with _maps_lock:
+        if key not in _maps:
+            _maps[key] = CollectionMap(key)
+        return _maps[key]
+
+
+def collection_embedding_map(db_path):
+    return get_collection_map(db_path).embedding_models()
+
+
+def collection_storage(db_path, collection_name):
+    return get_collection_map(db_path).storage(collection_name)
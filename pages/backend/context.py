@@ -0,0 +1,134 @@
+import re
+from pages.backend.metrics import span
+
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+DEFAULT_CONTEXT_TOKENS = 1536
+# Shortest shared text treated as chunk overlap rather than a coincidence
+MIN_OVERLAP_CHARS = 20
+NEAR_DUPLICATE_SIMILARITY = 0.9
+SHINGLE_WORDS = 3
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def estimate_tokens(text):
+    # About 4 characters per token for English text with the Llama and BERT family tokenizers
+    return -(-len(text) // 4)
+
+
+def overlap_merge(left, right, min_overlap=MIN_OVERLAP_CHARS):
+    """`left` followed by `right` when the end of `left` is repeated at the start of `right`, else None.
+
+    That is what the splitter's chunk_overlap produces between neighbouring chunks.
+    """
+    if len(left) < min_overlap or len(right) < min_overlap:
+        return None
+    head = right[:min_overlap]
+    start = left.find(head, max(len(left) - len(right), 0))
+    while start != -1:
+        if right.startswith(left[start:]):
+            return left + right[len(left) - start:]
+        start = left.find(head, start + 1)
+    return None
+
+
+def merge_passages(first, second):
+    # Containment first, a chunk retrieved twice or fully covered by a merged passage adds nothing
+    if second in first:
+        return first
+    if first in second:
+        return second
+    return overlap_merge(first, second) or overlap_merge(second, first)
+
+
+def shingles(text):
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) <= SHINGLE_WORDS:
+        return {" ".join(words)}
+    return {" ".join(words[index:index + SHINGLE_WORDS]) for index in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def similarity(first, second):
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def truncate_to_tokens(text, max_tokens):
+    text = text[:max_tokens * 4]
+    # Cut at the last whitespace so no word is split
+    cut = text.rfind(" ")
+    return text[:cut] if cut > len(text) // 2 else text
+
+
+def pack_context(docs, max_tokens=DEFAULT_CONTEXT_TOKENS, separator=CONTEXT_SEPARATOR):
+    """Join retrieved chunks into a prompt context of at most `max_tokens` estimated tokens.
+
+    `docs` are in relevance order. Overlapping chunks of the same source are merged into one passage,
+    exact and near-duplicate passages are dropped, and passages are added in relevance order while
+    they fit the budget. Returns the context text and a report of what was done.
+    """
+    with span("context_pack", items=len(docs)) as pack_span:
+        report = {"chunks": len(docs), "merged": 0, "duplicates": 0, "over_budget": 0}
+        # [rank, source, text], rank is the best rank among the merged chunks
+        passages = []
+        seen = set()
+        for rank, doc in enumerate(docs):
+            text = doc.page_content.strip()
+            normalized = " ".join(text.lower().split())
+            if not text or normalized in seen:
+                report["duplicates"] += 1
+                continue
+            seen.add(normalized)
+            source = (doc.metadata or {}).get("source")
+            passage = [rank, source, text]
+            # A merged passage can in turn continue another one of the same source
+            merged = True
+            while merged:
+                merged = False
+                for other in passages:
+                    if other[1] != source or source is None:
+                        continue
+                    combined = merge_passages(other[2], passage[2])
+                    if combined is not None:
+                        passages.remove(other)
+                        passage = [min(other[0], passage[0]), source, combined]
+                        report["merged"] += 1
+                        merged = True
+                        break
+            passages.append(passage)
+        passages.sort(key=lambda passage: passage[0])
+
+        kept = []
+        for passage in passages:
+            passage_shingles = shingles(passage[2])
+            if any(similarity(passage_shingles, other_shingles) >= NEAR_DUPLICATE_SIMILARITY for _, other_shingles in kept):
+                report["duplicates"] += 1
+                continue
+            kept.append((passage[2], passage_shingles))
+
+        selected, used_tokens = [], 0
+        separator_tokens = estimate_tokens(separator)
+        for text, _ in kept:
+            tokens = estimate_tokens(text) + (separator_tokens if selected else 0)
+            if used_tokens + tokens > max_tokens:
+                if not selected:
+                    # The best passage alone is over budget, its beginning is better than no context
+                    text = truncate_to_tokens(text, max_tokens)
+                    selected.append(text)
+                    used_tokens = estimate_tokens(text)
+                else:
+                    report["over_budget"] += 1
+                continue
+            selected.append(text)
+            used_tokens += tokens
+        report["passages"] = len(selected)
+        report["tokens"] = used_tokens
+        pack_span.update(passages=len(selected), tokens=used_tokens)
+        return separator.join(selected), report
+
+
+def format_pack_report(report):
+    return (
+        f"Context: {report['chunks']} chunks packed into {report['passages']} passages (~{report['tokens']} tokens), "
+        f"{report['merged']} merged, {report['duplicates']} duplicates dropped, {report['over_budget']} over budget"
+    )
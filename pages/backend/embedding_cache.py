@@ -0,0 +1,159 @@
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from langchain_core.embeddings import Embeddings
+from pages.backend.metrics import span
+
+QUERY_CACHE_FILE = 'query_embedding_cache.sqlite3'
+QUERY_CACHE_DISK_ENV = "EASY_RAG_QUERY_CACHE_DISK"
+QUERY_CACHE_DISK_ENTRIES_ENV = "EASY_RAG_QUERY_CACHE_DISK_ENTRIES"
+# Rows beyond the limit are dropped, oldest first, once every this many writes
+PRUNE_EVERY = 64
+
+
+def normalize_query(text):
+    return " ".join(text.split())
+
+
+class QueryEmbeddingCache:
+    """Query vectors keyed by (model, normalized text): an in-memory LRU tier plus optional SQLite tiers.
+
+    The SQLite tier of each database keeps at most max_disk_entries vectors. It is turned off with
+    EASY_RAG_QUERY_CACHE_DISK=0, and its size is set with EASY_RAG_QUERY_CACHE_DISK_ENTRIES.
+    """
+
+    def __init__(self, max_entries=2048, use_disk=None, max_disk_entries=None):
+        self.max_entries = max_entries
+        if use_disk is None:
+            use_disk = os.environ.get(QUERY_CACHE_DISK_ENV, "1").lower() not in ("0", "false", "no")
+        self.use_disk = use_disk
+        self.max_disk_entries = max_disk_entries or int(os.environ.get(QUERY_CACHE_DISK_ENTRIES_ENV, 10000))
+        self.disk_writes = 0
+        self.memory = OrderedDict()
+        # The memory lock is never held during SQLite I/O, so event loops can check the memory tier
+        self.lock = threading.Lock()
+        self.disk_lock = threading.Lock()
+        self.disk = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _disk(self, db_path):
+        db_path = os.path.abspath(db_path)
+        if db_path not in self.disk:
+            conn = sqlite3.connect(os.path.join(db_path, QUERY_CACHE_FILE), check_same_thread=False)
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                    "model TEXT, query TEXT, vector BLOB, created_at REAL, PRIMARY KEY (model, query))"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS query_embeddings_age ON query_embeddings (created_at)")
+                # Caches left by earlier runs, or with a larger limit, are cut down when first opened
+                self._prune(conn)
+            self.disk[db_path] = conn
+        return self.disk[db_path]
+
+    def _prune(self, conn):
+        conn.execute(
+            "DELETE FROM query_embeddings WHERE rowid IN ("
+            "SELECT rowid FROM query_embeddings ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,),
+        )
+
+    def _remember(self, key, vector):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def peek(self, model, text):
+        """The vector from the memory tier only, None without counting a miss. Safe on an event loop."""
+        key = (model, normalize_query(text))
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key]
+        return None
+
+    def get(self, model, text, db_path=None):
+        key = (model, normalize_query(text))
+        vector = self.peek(model, text)
+        if vector is not None:
+            return vector
+        if db_path and self.use_disk:
+            with self.disk_lock:
+                row = self._disk(db_path).execute(
+                    "SELECT vector FROM query_embeddings WHERE model = ? AND query = ?", key
+                ).fetchone()
+            if row:
+                vector = array("f", row[0]).tolist()
+                with self.lock:
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                return vector
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, model, text, vector, db_path=None):
+        key = (model, normalize_query(text))
+        with self.lock:
+            self._remember(key, vector)
+        if db_path and self.use_disk:
+            with self.disk_lock:
+                conn = self._disk(db_path)
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO query_embeddings (model, query, vector, created_at) VALUES (?, ?, ?, ?)",
+                        (*key, array("f", vector).tobytes(), time.time()),
+                    )
+                    self.disk_writes += 1
+                    if self.disk_writes % PRUNE_EVERY == 0:
+                        self._prune(conn)
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "size": len(self.memory),
+        }
+
+
+query_cache = QueryEmbeddingCache()
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """Wraps an embeddings object so embed_query goes through the shared query cache."""
+
+    def __init__(self, embeddings, model, db_path=None, cache=query_cache):
+        self.embeddings = embeddings
+        self.model = model
+        self.db_path = db_path
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        with span("query_embed", model=self.model) as attributes:
+            vector = self.cache.get(self.model, text, self.db_path)
+            attributes["cache"] = "hit" if vector is not None else "miss"
+            if vector is None:
+                # Embed the normalized text so the cached vector does not depend on which variant came first
+                vector = self.embeddings.embed_query(normalize_query(text))
+                self.cache.put(self.model, text, vector, self.db_path)
+        return vector
+
+
+def format_query_cache_stats(stats):
+    return (
+        f"Query embedding cache: {stats['hits']} memory hits, {stats['disk_hits']} disk hits, "
+        f"{stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)"
+    )
@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from langchain_core.documents import Document
+from pages.backend.resources import get_query_embeddings, get_vector_store
+
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="federated")
+# Calls that missed their deadline and still hold a worker, by target or ("embed", model).
+# Running calls cannot be cancelled, so nothing new is sent to a key until its call ends.
+_stalled = {}
+_stalled_lock = threading.Lock()
+
+
+def _is_stalled(key):
+    with _stalled_lock:
+        return key in _stalled
+
+
+def _clear_stalled(key, future):
+    with _stalled_lock:
+        if _stalled.get(key) is future:
+            del _stalled[key]
+
+
+def _abandon(key, future):
+    # Calls still queued are dropped, running ones are remembered until they end
+    if future.cancel():
+        return
+    with _stalled_lock:
+        _stalled[key] = future
+    future.add_done_callback(lambda done: _clear_stalled(key, done))
+
+
+def _search_target(target, query_embedding, k):
+    db_path, collection_name, embedding_model = target
+    start = time.perf_counter()
+    vector_store = get_vector_store(db_path, collection_name, embedding_model)
+    result = vector_store._collection.query(
+        query_embeddings=[query_embedding],
+        n_results=k,
+        include=["documents", "metadatas", "distances"],
+    )
+    # Distances become relevance scores with the collection's own metric, higher is better
+    relevance = vector_store._select_relevance_score_fn()
+    hits = [
+        (chunk_id, text, metadata, relevance(distance))
+        for chunk_id, text, metadata, distance in zip(
+            result["ids"][0], result["documents"][0], result["metadatas"][0], result["distances"][0]
+        )
+    ]
+    return hits, time.perf_counter() - start
+
+
+def normalize_scores(scores):
+    low, high = min(scores), max(scores)
+    # A single hit or equal scores say nothing about rank, so they land mid-range instead of on top
+    if high == low:
+        return [0.5 for _ in scores]
+    return [(score - low) / (high - low) for score in scores]
+
+
+def federated_search(targets, query, k=4, timeout=10.0):
+    """Query several (database, collection, embedding model) targets at once and merge the results.
+
+    The query is embedded once per distinct model, targets are searched concurrently, and
+    targets that miss the deadline are reported instead of holding up the merged result. Chunks
+    found in several collections are returned once. A target or model whose timed-out call is still
+    running is skipped until that call ends, so slow targets cannot fill the shared workers.
+    """
+    deadline = time.perf_counter() + timeout
+    report = {target: {"status": "pending", "latency": None, "hits": 0} for target in targets}
+
+    models = {}
+    for db_path, _, embedding_model in targets:
+        models.setdefault(embedding_model, db_path)
+    embedding_futures = {
+        model: _executor.submit(get_query_embeddings(db_path, model).embed_query, query)
+        for model, db_path in models.items()
+        if not _is_stalled(("embed", model))
+    }
+    wait(embedding_futures.values(), timeout=max(deadline - time.perf_counter(), 0))
+    timed_out_models = {model for model, future in embedding_futures.items() if not future.done()}
+    for model in timed_out_models:
+        _abandon(("embed", model), embedding_futures[model])
+
+    search_futures = {}
+    for target in targets:
+        embedding_future = embedding_futures.get(target[2])
+        if embedding_future is None:
+            report[target]["status"] = "skipped (embedding model busy with an earlier timed-out query)"
+        elif target[2] in timed_out_models:
+            report[target]["status"] = "timeout (embedding)"
+        elif _is_stalled(target):
+            report[target]["status"] = "skipped (still busy with an earlier timed-out search)"
+        elif embedding_future.exception():
+            report[target]["status"] = f"error: {embedding_future.exception()}"
+        else:
+            search_futures[target] = _executor.submit(_search_target, target, embedding_future.result(), k)
+    wait(search_futures.values(), timeout=max(deadline - time.perf_counter(), 0))
+
+    hits_by_model = {}
+    for target, future in search_futures.items():
+        if not future.done():
+            report[target]["status"] = "timeout"
+            _abandon(target, future)
+            continue
+        if future.exception():
+            report[target]["status"] = f"error: {future.exception()}"
+            continue
+        hits, latency = future.result()
+        report[target].update(status="ok", latency=latency, hits=len(hits))
+        hits_by_model.setdefault(target[2], []).extend((target, hit) for hit in hits)
+
+    # Scores are only comparable within one embedding model, so each model's scores are min-max normalized
+    merged = []
+    for model_hits in hits_by_model.values():
+        normalized = normalize_scores([hit[3] for _, hit in model_hits])
+        for (target, (chunk_id, text, metadata, _)), score in zip(model_hits, normalized):
+            metadata = dict(metadata or {}, database=os.path.basename(os.path.normpath(target[0])), collection=target[1])
+            merged.append((Document(id=chunk_id, page_content=text or "", metadata=metadata), score))
+    merged.sort(key=lambda item: -item[1])
+    # Collections that ingested the same source hold the same chunks, only the best-scoring copy is kept
+    results, seen = [], set()
+    for doc, _ in merged:
+        keys = {("id", doc.id), ("text", doc.metadata.get("source"), doc.page_content)}
+        if keys & seen:
+            continue
+        seen |= keys
+        results.append(doc)
+        if len(results) == k:
+            break
+    return results, report
@@ -0,0 +1,214 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import time
+import warnings
+import aiohttp
+from bs4 import BeautifulSoup, XMLParsedAsHTMLWarning
+from langchain_core.documents import Document
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ResponseCache:
+    """On-disk cache of response bodies with their ETag/Last-Modified validators."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.body"), os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, url):
+        body_path, meta_path = self._paths(url)
+        if not (os.path.exists(body_path) and os.path.exists(meta_path)):
+            return None
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        with open(body_path, "rb") as f:
+            meta["body"] = f.read()
+        return meta
+
+    def _write(self, path, data):
+        # A temporary file renamed over the entry, an interrupted write never leaves a truncated one.
+        # Named per writer, the app and ingest_cli.py may store the same page at once.
+        fd, temporary_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+    def put(self, url, body, etag=None, last_modified=None):
+        body_path, meta_path = self._paths(url)
+        # Body first: validators never describe a body that is not on disk yet
+        self._write(body_path, body)
+        meta = {"url": url, "etag": etag, "last_modified": last_modified, "stored_at": time.time()}
+        self._write(meta_path, json.dumps(meta).encode("utf-8"))
+
+
+class FetchStats:
+    def __init__(self):
+        self.requested = 0
+        self.downloaded = 0
+        self.cache_hits = 0
+        self.failures = {}
+        self.started = None
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def pages_per_sec(self):
+        fetched = self.downloaded + self.cache_hits
+        return fetched / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def cache_hit_rate(self):
+        fetched = self.downloaded + self.cache_hits
+        return self.cache_hits / fetched if fetched else 0.0
+
+    def summary(self):
+        return (
+            f"Fetched {self.downloaded + self.cache_hits}/{self.requested} pages in {self.elapsed:.1f}s "
+            f"({self.pages_per_sec:.1f} pages/sec), cache hit rate {self.cache_hit_rate:.0%}, "
+            f"{len(self.failures)} failed"
+        )
+
+
+class WebFetcher:
+    """Concurrent page fetcher over a pooled aiohttp session with retries and a conditional-request cache."""
+
+    def __init__(self, cache_dir=None, max_concurrency=16, per_host_concurrency=4, retries=3, backoff=0.5, timeout=30):
+        self.cache = ResponseCache(cache_dir) if cache_dir else None
+        self.max_concurrency = max_concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.stats = FetchStats()
+
+    async def _fetch_one(self, session, url):
+        cached = self.cache.get(url) if self.cache else None
+        headers = {}
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        for attempt in range(self.retries + 1):
+            try:
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 304 and cached:
+                        self.stats.cache_hits += 1
+                        return cached["body"]
+                    if response.status in RETRY_STATUSES and attempt < self.retries:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, response.history, status=response.status
+                        )
+                    response.raise_for_status()
+                    body = await response.read()
+                    if self.cache:
+                        self.cache.put(
+                            url,
+                            body,
+                            etag=response.headers.get("ETag"),
+                            last_modified=response.headers.get("Last-Modified"),
+                        )
+                    self.stats.downloaded += 1
+                    return body
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.retries:
+                    self.stats.failures[url] = str(e)
+                    return None
+                await asyncio.sleep(self.backoff * (2 ** attempt))
+
+    async def fetch_all_async(self, urls):
+        # The connector limits are the concurrency limits: each request holds one pooled connection
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=self.per_host_concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            bodies = await asyncio.gather(*(self._fetch_one(session, url) for url in urls))
+        return dict(zip(urls, bodies))
+
+    def fetch_all(self, urls):
+        urls = list(dict.fromkeys(urls))
+        self.stats.requested += len(urls)
+        if self.stats.started is None:
+            self.stats.started = time.perf_counter()
+        bodies = asyncio.run(self.fetch_all_async(urls))
+        self.stats.finished = time.perf_counter()
+        return bodies
+
+
+def parse_sitemap(body):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", XMLParsedAsHTMLWarning)
+        soup = BeautifulSoup(body, "html.parser")
+    page_urls = [url.find("loc").get_text(strip=True) for url in soup.find_all("url") if url.find("loc")]
+    sitemap_urls = [sitemap.find("loc").get_text(strip=True) for sitemap in soup.find_all("sitemap") if sitemap.find("loc")]
+    return page_urls, sitemap_urls
+
+
+def page_metadata(url, soup):
+    # Same metadata as WebBaseLoader so "source" keeps working for removal
+    metadata = {"source": url}
+    if title := soup.find("title"):
+        metadata["title"] = title.get_text()
+    if description := soup.find("meta", attrs={"name": "description"}):
+        metadata["description"] = description.get("content", "No description found.")
+    if html := soup.find("html"):
+        metadata["language"] = html.get("lang", "No language found.")
+    return metadata
+
+
+def html_to_document(url, body):
+    soup = BeautifulSoup(body, "html.parser")
+    return Document(page_content=soup.get_text(), metadata=page_metadata(url, soup))
+
+
+def fetch_html_pages(urls, fetcher):
+    """(url, html) of every page fetched, left unparsed for the chunking workers."""
+    return [(url, body) for url, body in fetcher.fetch_all(urls).items() if body is not None]
+
+
+def load_pages(urls, fetcher):
+    return [html_to_document(url, body) for url, body in fetch_html_pages(urls, fetcher)]
+
+
+def sitemap_page_urls(sitemap_url, fetcher):
+    page_urls = []
+    pending = [sitemap_url]
+    seen = set()
+    # Sitemap indexes can nest, walk them level by level
+    while pending:
+        pending = [url for url in pending if url not in seen]
+        seen.update(pending)
+        next_level = []
+        for body in fetcher.fetch_all(pending).values():
+            if body is None:
+                continue
+            pages, sitemaps = parse_sitemap(body)
+            page_urls.extend(pages)
+            next_level.extend(sitemaps)
+        pending = next_level
+    return page_urls
+
+
+def load_sitemap(sitemap_url, fetcher):
+    return load_pages(sitemap_page_urls(sitemap_url, fetcher), fetcher)
+
+
+def fetch_sitemap_pages(sitemap_url, fetcher):
+    return fetch_html_pages(sitemap_page_urls(sitemap_url, fetcher), fetcher)
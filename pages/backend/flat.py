@@ -0,0 +1,366 @@
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+import numpy as np
+from pages.backend.collection_map import collection_storage, file_lock
+
+FLAT_DIR = 'flat'
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+# Size of the float32 copy of one block of rows while scoring
+SEARCH_BLOCK_BYTES = 32 * 1024 * 1024
+COMPACT_DEAD_FRACTION = 0.25
+# Chroma still stores the texts and metadata of flat collections. Their Chroma vectors are a
+# one-dimensional constant, so its HNSW index stays tiny and is never used for search.
+PLACEHOLDER_EMBEDDING = [0.0]
+PLACEHOLDER_CONFIGURATION = {"hnsw": {"ef_construction": 4, "max_neighbors": 2, "ef_search": 4}}
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def quantize(vectors, dtype):
+    if dtype == "int8":
+        # Symmetric per-row scale, the largest component of each vector maps to 127
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return vectors.astype(DTYPES[dtype]), None
+
+
+class FlatIndex:
+    """Exact nearest neighbour search over L2-normalized vectors kept in memory-mapped files.
+
+    Rows are only ever appended: upserting or deleting an id marks its old row dead, and the files
+    are rewritten without dead rows once those pass a quarter of the index. meta.json is replaced
+    last on every write, so readers in other processes never see a half-written batch. Writers hold
+    a lock file next to the index, so the app and ingest_cli.py can write the same collection.
+    """
+
+    def __init__(self, path, dtype="float32"):
+        self.path = path
+        self.lock = threading.RLock()
+        self.lock_path = f"{path}.lock"
+        self.meta_mtime = None
+        self.meta = {"dtype": dtype, "dim": None, "rows": 0, "dead": 0, "ids_bytes": 0, "generation": 0}
+        self.ids = []
+        self.rows_by_id = {}
+        self.alive = np.zeros(0, dtype=bool)
+        self._matrix = None
+        self._scales = None
+        self.refresh()
+
+    def _file(self, kind, generation=None):
+        generation = self.meta["generation"] if generation is None else generation
+        return os.path.join(self.path, f"{kind}.{generation}")
+
+    def refresh(self):
+        # Cheap when nothing changed, a stat of meta.json. Every commit replaces the file, so its inode changes too
+        meta_path = os.path.join(self.path, "meta.json")
+        try:
+            stat = os.stat(meta_path)
+        except FileNotFoundError:
+            return
+        mtime = (stat.st_ino, stat.st_mtime_ns)
+        if mtime == self.meta_mtime:
+            return
+        with open(meta_path, "r") as f:
+            self.meta = json.load(f)
+        rows = self.meta["rows"]
+        with open(self._file("ids"), "rb") as f:
+            self.ids = f.read(self.meta["ids_bytes"]).decode("utf-8").split("\n")[:rows]
+        self.alive = np.fromfile(self._file("alive"), dtype=np.uint8, count=rows).astype(bool)
+        self.rows_by_id = {chunk_id: row for row, chunk_id in enumerate(self.ids) if self.alive[row]}
+        self._matrix = None
+        self._scales = None
+        self.meta_mtime = mtime
+
+    @property
+    def dtype(self):
+        return self.meta["dtype"]
+
+    def matrix(self):
+        if self._matrix is None:
+            rows, dim = self.meta["rows"], self.meta["dim"] or 0
+            if rows:
+                self._matrix = np.memmap(self._file("vectors"), dtype=DTYPES[self.dtype], mode="r", shape=(rows, dim))
+                if self.dtype == "int8":
+                    self._scales = np.memmap(self._file("scales"), dtype=np.float32, mode="r", shape=(rows,))
+            else:
+                self._matrix = np.zeros((0, dim), dtype=DTYPES[self.dtype])
+        return self._matrix
+
+    def count(self):
+        with self.lock:
+            self.refresh()
+            return len(self.rows_by_id)
+
+    @contextmanager
+    def _writing(self):
+        """Serialize writers, in this process and in others, and start from their latest state."""
+        with self.lock:
+            os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+            with file_lock(self.lock_path):
+                # Another process may have committed within the mtime resolution, always read before changing
+                self.meta_mtime = None
+                self.refresh()
+                yield
+
+    def _commit(self):
+        meta_path = os.path.join(self.path, "meta.json")
+        with open(f"{meta_path}.tmp", "w") as f:
+            json.dump(self.meta, f)
+        os.replace(f"{meta_path}.tmp", meta_path)
+        stat = os.stat(meta_path)
+        self.meta_mtime = (stat.st_ino, stat.st_mtime_ns)
+        self._matrix = None
+        self._scales = None
+
+    def _mark_dead(self, chunk_ids):
+        rows = [self.rows_by_id.pop(chunk_id) for chunk_id in chunk_ids if chunk_id in self.rows_by_id]
+        if not rows:
+            return
+        alive = np.memmap(self._file("alive"), dtype=np.uint8, mode="r+", shape=(self.meta["rows"],))
+        alive[rows] = 0
+        alive.flush()
+        del alive
+        self.alive[rows] = False
+        self.meta["dead"] += len(rows)
+
+    def _append(self, chunk_ids, vectors):
+        os.makedirs(self.path, exist_ok=True)
+        rows = self.meta["rows"]
+        dim = self.meta["dim"]
+        encoded, scales = quantize(vectors, self.dtype)
+        id_bytes = "".join(f"{chunk_id}\n" for chunk_id in chunk_ids).encode("utf-8")
+        # Anything past the committed sizes is left over from an interrupted write
+        for kind, data, committed in (
+            ("vectors", encoded.tobytes(), rows * dim * encoded.itemsize),
+            ("scales", None if scales is None else scales.tobytes(), rows * 4),
+            ("alive", np.ones(len(chunk_ids), dtype=np.uint8).tobytes(), rows),
+            ("ids", id_bytes, self.meta["ids_bytes"]),
+        ):
+            if data is None:
+                continue
+            with open(self._file(kind), "ab") as f:
+                f.truncate(committed)
+                f.write(data)
+        for offset, chunk_id in enumerate(chunk_ids):
+            self.rows_by_id[chunk_id] = rows + offset
+        self.ids.extend(chunk_ids)
+        self.alive = np.concatenate([self.alive, np.ones(len(chunk_ids), dtype=bool)])
+        self.meta["rows"] = rows + len(chunk_ids)
+        self.meta["ids_bytes"] += len(id_bytes)
+
+    def upsert(self, chunk_ids, embeddings):
+        if not len(chunk_ids):
+            return
+        with self._writing():
+            # The last occurrence of an id in the batch wins, as with Chroma's upsert
+            latest = sorted({chunk_id: index for index, chunk_id in enumerate(chunk_ids)}.values())
+            chunk_ids = [chunk_ids[index] for index in latest]
+            vectors = normalize_rows(embeddings)[latest]
+            if self.meta["dim"] is None:
+                self.meta["dim"] = int(vectors.shape[1])
+            elif vectors.shape[1] != self.meta["dim"]:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the flat index ({self.meta['dim']})")
+            self._mark_dead(chunk_ids)
+            self._append(chunk_ids, vectors)
+            self._commit()
+            self._compact_if_needed()
+
+    def delete(self, chunk_ids):
+        with self._writing():
+            self._mark_dead(chunk_ids)
+            self._commit()
+            self._compact_if_needed()
+
+    def _compact_if_needed(self):
+        if self.meta["rows"] and self.meta["dead"] / self.meta["rows"] > COMPACT_DEAD_FRACTION:
+            self._compact()
+
+    def compact(self):
+        """Rewrite the files without dead rows, as a new generation so open memory maps stay valid."""
+        with self._writing():
+            self._compact()
+
+    def _compact(self):
+        # Callers hold the write lock
+        old_generation = self.meta["generation"]
+        live_rows = np.flatnonzero(self.alive)
+        matrix = self.matrix()
+        scales = self._scales
+        live_ids = [self.ids[row] for row in live_rows]
+        self.meta = dict(self.meta, generation=old_generation + 1, rows=0, dead=0, ids_bytes=0)
+        self.ids, self.rows_by_id, self.alive = [], {}, np.zeros(0, dtype=bool)
+        block_rows = self.block_rows()
+        for start in range(0, len(live_rows), block_rows):
+            rows = live_rows[start:start + block_rows]
+            vectors = np.asarray(matrix[rows], dtype=np.float32)
+            if scales is not None:
+                vectors = vectors * scales[rows][:, None]
+            self._append(live_ids[start:start + block_rows], vectors)
+        if not len(live_rows):
+            os.makedirs(self.path, exist_ok=True)
+            for kind in ("vectors", "alive", "ids"):
+                open(self._file(kind), "wb").close()
+        self._commit()
+        for kind in ("vectors", "scales", "alive", "ids"):
+            try:
+                os.remove(self._file(kind, old_generation))
+            except FileNotFoundError:
+                pass
+
+    def block_rows(self):
+        return max(1024, SEARCH_BLOCK_BYTES // (4 * max(self.meta["dim"] or 1, 1)))
+
+    def search(self, query_embeddings, k, allowed_ids=None, with_vectors=False):
+        """Top k (ids, cosine similarities[, vectors]) for every query, scored block by block with matrix products."""
+        with self.lock:
+            self.refresh()
+            matrix = self.matrix()
+            scales = self._scales
+            ids = self.ids
+            mask = self.alive.copy()
+            if allowed_ids is not None:
+                allowed = np.zeros(len(mask), dtype=bool)
+                allowed[[self.rows_by_id[chunk_id] for chunk_id in allowed_ids if chunk_id in self.rows_by_id]] = True
+                mask &= allowed
+            block_rows = self.block_rows()
+        queries = normalize_rows(query_embeddings)
+        best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(matrix), block_rows):
+            end = min(start + block_rows, len(matrix))
+            scores = queries @ np.asarray(matrix[start:end], dtype=np.float32).T
+            if scales is not None:
+                scores *= scales[start:end]
+            scores[:, ~mask[start:end]] = -np.inf
+            candidate_scores = np.concatenate([best_scores, scores], axis=1)
+            candidate_rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, end), scores.shape)], axis=1)
+            if candidate_scores.shape[1] > k:
+                top = np.argpartition(-candidate_scores, k - 1, axis=1)[:, :k]
+                candidate_scores = np.take_along_axis(candidate_scores, top, axis=1)
+                candidate_rows = np.take_along_axis(candidate_rows, top, axis=1)
+            best_scores, best_rows = candidate_scores, candidate_rows
+        results = []
+        for query_scores, query_rows in zip(best_scores, best_rows):
+            order = np.argsort(-query_scores)
+            order = order[np.isfinite(query_scores[order])]
+            rows = query_rows[order]
+            result = {"ids": [ids[row] for row in rows], "scores": query_scores[order].tolist()}
+            if with_vectors:
+                vectors = np.asarray(matrix[rows], dtype=np.float32)
+                result["vectors"] = vectors * scales[rows][:, None] if scales is not None else vectors
+            results.append(result)
+        return results
+
+    def warm(self):
+        # Reads every page of the matrix once, so the first query does not fault them in
+        with self.lock:
+            self.refresh()
+            matrix = self.matrix()
+        for start in range(0, len(matrix), self.block_rows()):
+            np.asarray(matrix[start:start + self.block_rows()]).sum()
+
+    def nbytes(self):
+        return sum(
+            os.path.getsize(self._file(kind)) for kind in ("vectors", "scales", "alive", "ids")
+            if os.path.exists(self._file(kind))
+        )
+
+
+class FlatCollection:
+    """A Chroma collection whose vector queries are answered by a FlatIndex.
+
+    Texts and metadata stay in Chroma, so get, count and filters pass through, and the app's search
+    types and federated search work on flat collections unchanged.
+    """
+
+    # Similarities are reported as the squared L2 distance of unit vectors, Chroma's default space,
+    # so relevance scores and thresholds mean the same as for HNSW collections
+    configuration = {"hnsw": {"space": "l2"}}
+
+    def __init__(self, collection, index):
+        self.collection = collection
+        self.index = index
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def query(self, query_embeddings=None, n_results=10, where=None, where_document=None,
+              include=("metadatas", "documents", "distances"), **kwargs):
+        if query_embeddings is None:
+            raise ValueError("Flat collections can only be queried with embeddings")
+        allowed_ids = None
+        if where or where_document:
+            allowed_ids = self.collection.get(where=where, where_document=where_document, include=[])["ids"]
+        hits = self.index.search(query_embeddings, n_results, allowed_ids=allowed_ids, with_vectors="embeddings" in include)
+        result = {key: [] for key in ("ids", "distances", "documents", "metadatas", "embeddings")}
+        for hit in hits:
+            positions = range(len(hit["ids"]))
+            documents = metadatas = None
+            if "documents" in include or "metadatas" in include:
+                stored = self.collection.get(ids=hit["ids"], include=["documents", "metadatas"])
+                by_id = dict(zip(stored["ids"], zip(stored["documents"], stored["metadatas"])))
+                # An id without a Chroma row is left over from an interrupted write
+                positions = [position for position in positions if hit["ids"][position] in by_id]
+                documents = [by_id[hit["ids"][position]][0] for position in positions]
+                metadatas = [by_id[hit["ids"][position]][1] for position in positions]
+            result["ids"].append([hit["ids"][position] for position in positions])
+            result["distances"].append([2.0 - 2.0 * hit["scores"][position] for position in positions])
+            result["documents"].append(documents)
+            result["metadatas"].append(metadatas)
+            result["embeddings"].append(hit["vectors"][list(positions)] if "vectors" in hit else None)
+        return {key: value if key == "ids" or key in include else None for key, value in result.items()}
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def flat_index_path(db_path, collection_name):
+    return os.path.join(os.path.abspath(db_path), FLAT_DIR, collection_name)
+
+
+def get_flat_index(db_path, collection_name, storage=None):
+    """The collection's flat index, or None when its vectors are kept by Chroma."""
+    storage = storage or collection_storage(db_path, collection_name)
+    if storage.get("engine") != "flat":
+        return None
+    path = flat_index_path(db_path, collection_name)
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = FlatIndex(path, storage.get("dtype", "float32"))
+        return _indexes[path]
+
+
+def forget_flat_index(db_path, collection_name):
+    with _indexes_lock:
+        _indexes.pop(flat_index_path(db_path, collection_name), None)
+
+
+def replace_flat_index(db_path, source_name, target_name):
+    """Move the flat index of `source_name` to `target_name`, dropping the target's own index."""
+    source_path = flat_index_path(db_path, source_name)
+    target_path = flat_index_path(db_path, target_name)
+    forget_flat_index(db_path, source_name)
+    forget_flat_index(db_path, target_name)
+    if os.path.isdir(source_path):
+        shutil.rmtree(target_path, ignore_errors=True)
+        os.replace(source_path, target_path)
+
+
+def delete_flat_index(db_path, collection_name):
+    forget_flat_index(db_path, collection_name)
+    shutil.rmtree(flat_index_path(db_path, collection_name), ignore_errors=True)
+
+
+def create_collection(client, collection_name, storage=None, metadata=None):
+    if storage and storage.get("engine") == "flat":
+        return client.get_or_create_collection(name=collection_name, metadata=metadata, configuration=PLACEHOLDER_CONFIGURATION)
+    return client.get_or_create_collection(name=collection_name, metadata=metadata)
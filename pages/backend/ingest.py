@@ -0,0 +1,221 @@
+import time
+from pages.backend.manifest import IngestManifest, content_hash, chunk_ids_for
+from pages.backend.resources import get_client, get_embeddings, invalidate_collection
+from pages.backend.lexical import get_lexical_index
+from pages.backend.metrics import span
+from pages.backend.flat import PLACEHOLDER_EMBEDDING, get_flat_index
+from pages.backend.collection_map import get_collection_map
+
+
+def group_collections_by_model(collections, collection_embedding_map):
+    # Collections that share an embedding model can share the same vectors
+    groups = {}
+    missing = []
+    for name in collections:
+        embedding_model = collection_embedding_map.get(name)
+        if not embedding_model:
+            missing.append(name)
+            continue
+        groups.setdefault(embedding_model, []).append(name)
+    return groups, missing
+
+
+def group_chunks_by_source(docs):
+    # source -> (content hash, [(chunk id, doc), ...])
+    by_source = {}
+    for doc in docs:
+        by_source.setdefault((doc.metadata or {}).get("source", ""), []).append(doc)
+    sources = {}
+    for source, source_docs in by_source.items():
+        texts = [doc.page_content for doc in source_docs]
+        sources[source] = (content_hash(texts), list(zip(chunk_ids_for(source, texts), source_docs)))
+    return sources
+
+
+def plan_collection_changes(collection, manifest, sources):
+    """Work out which chunks a collection needs added or deleted, skipping sources whose hash is unchanged."""
+    plan = {"add": [], "delete": [], "sources": [], "skipped": 0}
+    # Chunks written before the manifest existed have random ids and must be replaced, not duplicated
+    has_untracked = collection.count() > manifest.tracked_chunk_count(collection.name)
+    for source, (source_hash, chunks) in sources.items():
+        if manifest.source_hash(collection.name, source) == source_hash:
+            plan["skipped"] += 1
+            continue
+        existing = manifest.chunk_ids(collection.name, source)
+        if has_untracked and not existing:
+            existing = set(collection.get(where={"source": source}, include=[])["ids"])
+        new_ids = [chunk_id for chunk_id, _ in chunks]
+        plan["add"].extend(chunk_id for chunk_id in new_ids if chunk_id not in existing)
+        plan["delete"].extend(existing - set(new_ids))
+        plan["sources"].append(source)
+    return plan
+
+
+def upsert_embeddings(client, collection_name, ids, texts, metadatas, embeddings, flat_index=None):
+    collection = client.get_or_create_collection(name=collection_name)
+    if flat_index is not None:
+        # The flat index keeps the vectors, Chroma the texts and metadata next to a placeholder
+        flat_index.upsert(ids, embeddings)
+        embeddings = [PLACEHOLDER_EMBEDDING] * len(ids)
+    batch_size = client.get_max_batch_size()
+    for start in range(0, len(ids), batch_size):
+        end = start + batch_size
+        collection.upsert(
+            ids=ids[start:end],
+            embeddings=embeddings[start:end],
+            documents=texts[start:end],
+            metadatas=metadatas[start:end],
+        )
+
+
+def delete_chunks(client, collection_name, ids, flat_index=None):
+    collection = client.get_collection(name=collection_name)
+    batch_size = client.get_max_batch_size()
+    for start in range(0, len(ids), batch_size):
+        collection.delete(ids=ids[start:start + batch_size])
+    if flat_index is not None:
+        flat_index.delete(ids)
+
+
+def update_lexical_index(persist_directory, collection, added_ids, added_texts, deleted_ids):
+    lexical_index = get_lexical_index(persist_directory, collection.name)
+    # Another process such as ingest_cli.py may have built the index since it was loaded
+    with lexical_index.lock:
+        lexical_index.reload()
+    if not lexical_index.state["segments"]:
+        # No BM25 index yet, build it from everything the collection now holds
+        lexical_index.rebuild_from_collection(collection)
+        return
+    if deleted_ids:
+        lexical_index.delete(deleted_ids)
+    if added_ids:
+        lexical_index.add(added_ids, added_texts)
+
+
+def record_collection_stats(persist_directory, collection, manifest):
+    # Kept with the collection's settings, so pages can show sizes without opening every collection
+    get_collection_map(persist_directory).record_stats(
+        collection.name,
+        chunks=collection.count(),
+        sources=manifest.count_sources(collection.name),
+        updated_at=time.time(),
+    )
+
+
+def ingest_documents(docs, persist_directory, collections, collection_embedding_map):
+    """Upsert only new or changed chunks, embedding each of them once per distinct embedding model."""
+    client = get_client(persist_directory)
+    manifest = IngestManifest(persist_directory)
+    groups, missing = group_collections_by_model(collections, collection_embedding_map)
+    sources = group_chunks_by_source(docs)
+    chunks = {chunk_id: doc for _, source_chunks in sources.values() for chunk_id, doc in source_chunks}
+
+    summary = {
+        "models": groups,
+        "missing": missing,
+        "embedding_calls": 0,
+        "saved_calls": 0,
+        "skipped_sources": 0,
+        "added_chunks": 0,
+        "deleted_chunks": 0,
+    }
+    try:
+        for embedding_model, collection_names in groups.items():
+            plans = {
+                name: plan_collection_changes(client.get_or_create_collection(name=name), manifest, sources)
+                for name in collection_names
+            }
+            # One embedding per chunk for the whole group, whichever collections need it
+            needed_ids = list(dict.fromkeys(chunk_id for plan in plans.values() for chunk_id in plan["add"]))
+            needed_texts = [chunks[chunk_id].page_content for chunk_id in needed_ids]
+            vectors = {}
+            if needed_ids:
+                with span("embed", model=embedding_model, items=len(needed_ids)):
+                    embeddings = get_embeddings(embedding_model).embed_documents(needed_texts)
+                vectors = dict(zip(needed_ids, embeddings))
+            summary["embedding_calls"] += len(needed_ids)
+            # Only sharing saves calls here, unchanged chunks are counted in skipped_sources
+            summary["saved_calls"] += sum(len(plan["add"]) for plan in plans.values()) - len(needed_ids)
+
+            for name, plan in plans.items():
+                if plan["add"]:
+                    with span("upsert", collection=name, items=len(plan["add"])):
+                        upsert_embeddings(
+                            client,
+                            name,
+                            plan["add"],
+                            [chunks[chunk_id].page_content for chunk_id in plan["add"]],
+                            # Chroma rejects empty metadata dicts, None is stored as "no metadata"
+                            [chunks[chunk_id].metadata or None for chunk_id in plan["add"]],
+                            [vectors[chunk_id] for chunk_id in plan["add"]],
+                            flat_index=get_flat_index(persist_directory, name),
+                        )
+                if plan["delete"]:
+                    with span("delete", collection=name, items=len(plan["delete"])):
+                        delete_chunks(client, name, plan["delete"], flat_index=get_flat_index(persist_directory, name))
+                if plan["add"] or plan["delete"]:
+                    with span("lexical_index", collection=name):
+                        update_lexical_index(
+                            persist_directory,
+                            client.get_collection(name=name),
+                            plan["add"],
+                            [chunks[chunk_id].page_content for chunk_id in plan["add"]],
+                            plan["delete"],
+                        )
+                    invalidate_collection(persist_directory, name)
+                for source in plan["sources"]:
+                    source_hash, source_chunks = sources[source]
+                    manifest.record(name, source, source_hash, [chunk_id for chunk_id, _ in source_chunks])
+                if plan["add"] or plan["delete"] or plan["sources"]:
+                    record_collection_stats(persist_directory, client.get_collection(name=name), manifest)
+                summary["skipped_sources"] += plan["skipped"]
+                summary["added_chunks"] += len(plan["add"])
+                summary["deleted_chunks"] += len(plan["delete"])
+    finally:
+        manifest.close()
+    return summary
+
+
+def remove_source(persist_directory, collection_name, source):
+    """Bulk delete a source's chunks by the ids recorded in the manifest."""
+    client = get_client(persist_directory)
+    collection = client.get_collection(name=collection_name)
+    manifest = IngestManifest(persist_directory)
+    try:
+        has_untracked = collection.count() > manifest.tracked_chunk_count(collection_name)
+        ids_to_delete = set(manifest.remove_source(collection_name, source))
+        if has_untracked:
+            # Chunks from before the manifest existed can only be found by metadata
+            ids_to_delete.update(collection.get(where={"source": source}, include=[])["ids"])
+        if ids_to_delete:
+            delete_chunks(client, collection_name, list(ids_to_delete), flat_index=get_flat_index(persist_directory, collection_name))
+            update_lexical_index(persist_directory, collection, [], [], list(ids_to_delete))
+            invalidate_collection(persist_directory, collection_name)
+            record_collection_stats(persist_directory, collection, manifest)
+    finally:
+        manifest.close()
+    return len(ids_to_delete)
+
+
+def rebuild_source_index(persist_directory, collection_name, page_size=500):
+    """Add chunks the manifest does not know about (ingested before it existed) to the source catalog."""
+    collection = get_client(persist_directory).get_collection(name=collection_name)
+    manifest = IngestManifest(persist_directory)
+    untracked = {}
+    try:
+        offset = 0
+        while True:
+            page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            tracked = manifest.tracked_ids(collection_name, page["ids"])
+            for chunk_id, metadata in zip(page["ids"], page["metadatas"]):
+                if chunk_id not in tracked:
+                    untracked.setdefault((metadata or {}).get("source", ""), []).append(chunk_id)
+            offset += page_size
+        for source, chunk_ids in untracked.items():
+            # An empty hash never matches, so the next ingest of this source replaces these chunks
+            manifest.record(collection_name, source, "", manifest.chunk_ids(collection_name, source) | set(chunk_ids))
+    finally:
+        manifest.close()
+    return sum(len(chunk_ids) for chunk_ids in untracked.values())
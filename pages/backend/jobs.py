@@ -0,0 +1,296 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+JOBS_FILE = 'ingest_jobs.sqlite3'
+JOBS_DIR = 'ingest_jobs'
+BATCH_SIZE = 256
+ACTIVE_STATUSES = ("queued", "running", "cancelling")
+
+
+class JobStore:
+    """Ingestion jobs of one database, with their parameters and progress, kept next to the collections."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(os.path.join(db_path, JOBS_FILE), timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, params TEXT, status TEXT, phase TEXT, "
+                "total_chunks INTEGER DEFAULT 0, done_chunks INTEGER DEFAULT 0, "
+                "total_batches INTEGER DEFAULT 0, done_batches INTEGER DEFAULT 0, "
+                "run_started_at REAL, run_start_chunks INTEGER DEFAULT 0, "
+                "summary TEXT, error TEXT, created_at REAL, updated_at REAL, finished_at REAL)"
+            )
+
+    def close(self):
+        self.conn.close()
+
+    def create(self, kind, params):
+        now = time.time()
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO jobs (kind, params, status, phase, summary, created_at, updated_at) "
+                "VALUES (?, ?, 'queued', 'queued', ?, ?, ?)",
+                (kind, json.dumps(params), json.dumps(empty_summary()), now, now),
+            )
+        return cursor.lastrowid
+
+    def get(self, job_id):
+        row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return job_from_row(row) if row else None
+
+    def list(self, limit=20):
+        rows = self.conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,))
+        return [job_from_row(row) for row in rows]
+
+    def unfinished(self):
+        rows = self.conn.execute(
+            f"SELECT id FROM jobs WHERE status IN ({','.join('?' * len(ACTIVE_STATUSES))}) ORDER BY id",
+            ACTIVE_STATUSES,
+        )
+        return [row[0] for row in rows]
+
+    def update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        for key in ("params", "summary"):
+            if key in fields:
+                fields[key] = json.dumps(fields[key])
+        with self.conn:
+            self.conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{key} = ?' for key in fields)} WHERE id = ?",
+                (*fields.values(), job_id),
+            )
+
+    def request_cancel(self, job_id):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET status = CASE status WHEN 'queued' THEN 'cancelled' ELSE 'cancelling' END, "
+                "updated_at = ? WHERE id = ? AND status IN ('queued', 'running')",
+                (time.time(), job_id),
+            )
+
+    def requeue(self, job_id):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET status = 'queued', error = NULL, updated_at = ? "
+                "WHERE id = ? AND status IN ('failed', 'cancelled')",
+                (time.time(), job_id),
+            )
+
+
+def empty_summary():
+    return {"embedding_calls": 0, "saved_calls": 0, "skipped_sources": 0, "added_chunks": 0, "deleted_chunks": 0, "missing": [], "models": {}}
+
+
+def job_from_row(row):
+    job = dict(row)
+    job["params"] = json.loads(job["params"])
+    job["summary"] = json.loads(job["summary"]) if job["summary"] else empty_summary()
+    return job
+
+
+def job_file_path(db_path, job_id, filename):
+    # Uploaded files are kept with the job so it can be retried or resumed after a restart
+    return os.path.join(db_path, JOBS_DIR, str(job_id), filename)
+
+
+def load_job_documents(db_path, job):
+    # Loaders are imported by the worker thread, listing jobs from the page must stay cheap
+    from pages.backend.chunking import chunk_all, chunking_from_settings
+    from pages.backend.fetcher import WebFetcher, fetch_sitemap_pages, fetch_html_pages
+    from pages.backend.pdf import load_pdf
+    params = job["params"]
+    # Jobs queued before chunking methods existed have no chunk_method and split by characters
+    chunking = chunking_from_settings(params)
+    if job["kind"] == "pdf":
+        with open(job_file_path(db_path, job["id"], params["filename"]), "rb") as f:
+            return load_pdf(f.read(), params["filename"], chunking)
+    fetcher = WebFetcher(
+        cache_dir=os.path.join(db_path, 'http_cache') if params.get("use_http_cache", True) else None,
+        max_concurrency=params.get("max_concurrency", 16),
+        per_host_concurrency=params.get("per_host_concurrency", 4),
+        retries=params.get("retries", 3),
+    )
+    if job["kind"] == "sitemap":
+        return chunk_all(fetch_sitemap_pages(params["url"], fetcher), chunking)
+    if job["kind"] == "page":
+        return chunk_all(fetch_html_pages([params["url"]], fetcher), chunking)
+    raise ValueError(f"Unknown job kind: {job['kind']}")
+
+
+def batch_by_source(docs, batch_size=BATCH_SIZE):
+    # A source is never split across batches, the manifest replaces a source's chunks as a whole
+    by_source = {}
+    for doc in docs:
+        by_source.setdefault((doc.metadata or {}).get("source", ""), []).append(doc)
+    batches, batch = [], []
+    for source_docs in by_source.values():
+        if batch and len(batch) + len(source_docs) > batch_size:
+            batches.append(batch)
+            batch = []
+        batch.extend(source_docs)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def merge_summary(total, summary):
+    for key in ("embedding_calls", "saved_calls", "skipped_sources", "added_chunks", "deleted_chunks"):
+        total[key] += summary[key]
+    total["missing"] = sorted(set(total["missing"]) | set(summary["missing"]))
+    total["models"].update(summary["models"])
+    return total
+
+
+def run_job(db_path, job_id):
+    """Load, split, then embed and upsert batch by batch, committing progress after every batch.
+
+    Splitting is deterministic and chunk ids come from their content, so a resumed job skips the
+    batches it already committed and re-running a partly written batch only overwrites the same ids.
+    """
+    from pages.backend.collection_map import get_collection_map
+    from pages.backend.ingest import ingest_documents
+    store = JobStore(db_path)
+    try:
+        job = store.get(job_id)
+        if job is None or job["status"] not in ACTIVE_STATUSES:
+            return
+        if job["status"] == "cancelling":
+            store.update(job_id, status="cancelled", phase="cancelled", finished_at=time.time())
+            return
+        if job["kind"] == "migrate":
+            from pages.backend.migrate import run_migration
+            store.update(job_id, status="running", run_started_at=time.time(), run_start_chunks=job["done_chunks"])
+            run_migration(store, db_path, job)
+            return
+        store.update(job_id, status="running", phase="loading", run_started_at=time.time(), run_start_chunks=job["done_chunks"])
+        docs = load_job_documents(db_path, job)
+        batches = batch_by_source(docs, job["params"].get("batch_size", BATCH_SIZE))
+        done_batches = min(job["done_batches"], len(batches))
+        done_chunks = sum(len(batch) for batch in batches[:done_batches])
+        summary = job["summary"]
+        store.update(
+            job_id,
+            phase="embedding",
+            total_chunks=len(docs),
+            total_batches=len(batches),
+            done_batches=done_batches,
+            done_chunks=done_chunks,
+            run_started_at=time.time(),
+            run_start_chunks=done_chunks,
+        )
+        for batch_index in range(done_batches, len(batches)):
+            if store.get(job_id)["status"] == "cancelling":
+                store.update(job_id, status="cancelled", phase="cancelled", finished_at=time.time())
+                return
+            batch_summary = ingest_documents(
+                batches[batch_index],
+                persist_directory=db_path,
+                collections=job["params"]["collections"],
+                # Read at run time, a migration that ran before this job may have changed a collection's model
+                collection_embedding_map=get_collection_map(db_path).embedding_models(),
+            )
+            done_chunks += len(batches[batch_index])
+            store.update(
+                job_id,
+                done_batches=batch_index + 1,
+                done_chunks=done_chunks,
+                summary=merge_summary(summary, batch_summary),
+            )
+        store.update(job_id, status="done", phase="done", finished_at=time.time())
+        shutil.rmtree(os.path.join(db_path, JOBS_DIR, str(job_id)), ignore_errors=True)
+    except Exception as e:
+        store.update(job_id, status="failed", phase="failed", error=str(e), finished_at=time.time())
+    finally:
+        store.close()
+
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ingest-job")
+_database_locks = {}
+_scheduled = set()
+_scheduled_lock = threading.Lock()
+
+
+def _run_scheduled(db_path, job_id):
+    with _scheduled_lock:
+        database_lock = _database_locks.setdefault(db_path, threading.Lock())
+    try:
+        # Jobs of one database run one after another, different databases in parallel
+        with database_lock:
+            run_job(db_path, job_id)
+    finally:
+        with _scheduled_lock:
+            _scheduled.discard((db_path, job_id))
+
+
+def schedule_job(db_path, job_id):
+    key = (os.path.abspath(db_path), job_id)
+    with _scheduled_lock:
+        if key in _scheduled:
+            return
+        _scheduled.add(key)
+    _executor.submit(_run_scheduled, *key)
+
+
+def submit_job(db_path, kind, params, file_bytes=None):
+    store = JobStore(db_path)
+    try:
+        job_id = store.create(kind, params)
+    finally:
+        store.close()
+    if file_bytes is not None:
+        path = job_file_path(db_path, job_id, params["filename"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(file_bytes)
+    schedule_job(db_path, job_id)
+    return job_id
+
+
+def resume_jobs(db_path):
+    """Pick up jobs left queued or running by a previous server process."""
+    store = JobStore(db_path)
+    try:
+        job_ids = store.unfinished()
+    finally:
+        store.close()
+    for job_id in job_ids:
+        schedule_job(db_path, job_id)
+    return job_ids
+
+
+def cancel_job(db_path, job_id):
+    store = JobStore(db_path)
+    try:
+        store.request_cancel(job_id)
+    finally:
+        store.close()
+
+
+def retry_job(db_path, job_id):
+    store = JobStore(db_path)
+    try:
+        store.requeue(job_id)
+    finally:
+        store.close()
+    schedule_job(db_path, job_id)
+
+
+def job_progress(job):
+    """Fraction done, chunks per second over the current run and the estimated seconds left."""
+    fraction = job["done_chunks"] / job["total_chunks"] if job["total_chunks"] else 0.0
+    rate, eta = 0.0, None
+    if job["status"] in ("running", "cancelling") and job["run_started_at"]:
+        elapsed = time.time() - job["run_started_at"]
+        processed = job["done_chunks"] - job["run_start_chunks"]
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        if rate > 0:
+            eta = (job["total_chunks"] - job["done_chunks"]) / rate
+    return fraction, rate, eta
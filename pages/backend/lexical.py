@@ -0,0 +1,325 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+from collections import Counter
+from contextlib import contextmanager
+import numpy as np
+from pages.backend.collection_map import file_lock
+
+TOKEN_PATTERN = re.compile(r"\w+(?:[.\-/:]\w+)*")
+PART_SEPARATORS = re.compile(r"[.\-/:]")
+MAX_SEGMENTS = 8
+MAX_DELETED_FRACTION = 0.3
+
+
+def tokenize(text):
+    # Compound tokens such as error codes or versions are kept whole and also split into their parts
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    parts = []
+    for token in tokens:
+        if not token.isalnum() and PART_SEPARATORS.search(token):
+            parts.extend(PART_SEPARATORS.split(token))
+    return tokens + parts
+
+
+def term_hash(term):
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def hash_terms(terms):
+    return np.fromiter((term_hash(term) for term in terms), dtype=np.uint64, count=len(terms))
+
+
+class Segment:
+    """Immutable, array-backed postings for a batch of chunks, memory-mapped from disk.
+
+    terms: sorted uint64 term hashes, offsets: start of each term's postings,
+    docs/freqs: postings (segment-local doc index, term frequency), lengths: tokens per doc.
+    """
+
+    ARRAYS = ("terms", "offsets", "docs", "freqs", "lengths")
+
+    def __init__(self, path):
+        self.path = path
+        for name in self.ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        with open(os.path.join(path, "ids.json"), "r") as f:
+            self.ids = json.load(f)
+
+    def postings(self, hashed_term):
+        position = np.searchsorted(self.terms, hashed_term)
+        if position == len(self.terms) or self.terms[position] != hashed_term:
+            return None, None
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return self.docs[start:end], self.freqs[start:end]
+
+    @staticmethod
+    def write(path, term_hashes, docs, freqs, lengths, ids):
+        # Postings sorted by term then doc, offsets computed from the term boundaries
+        order = np.lexsort((docs, term_hashes))
+        term_hashes, docs, freqs = term_hashes[order], docs[order], freqs[order]
+        terms, starts = np.unique(term_hashes, return_index=True)
+        offsets = np.append(starts, len(term_hashes)).astype(np.int64)
+        os.makedirs(path, exist_ok=True)
+        arrays = {
+            "terms": terms,
+            "offsets": offsets,
+            "docs": docs.astype(np.int32),
+            "freqs": np.minimum(freqs, np.iinfo(np.uint16).max).astype(np.uint16),
+            "lengths": np.asarray(lengths, dtype=np.int32),
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), array)
+        with open(os.path.join(path, "ids.json"), "w") as f:
+            json.dump(list(ids), f)
+
+
+class LexicalIndex:
+    """BM25 index for one collection, kept next to it as append-only segments plus per-segment deletions."""
+
+    def __init__(self, db_path, collection_name, k1=1.2, b=0.75):
+        self.path = os.path.join(db_path, "bm25", collection_name)
+        # Next to the index directory, a rebuild removes the directory
+        self.lock_path = os.path.join(db_path, "bm25", f"{collection_name}.lock")
+        self.k1 = k1
+        self.b = b
+        self.lock = threading.Lock()
+        self.state = {"segments": [], "deleted": {}, "next_segment": 0}
+        self.segments = {}
+        self.deleted = {}
+        self.loaded_mtime = None
+        self.reload()
+
+    @property
+    def state_path(self):
+        return os.path.join(self.path, "segments.json")
+
+    def reload(self):
+        if not os.path.exists(self.state_path):
+            return
+        mtime = os.stat(self.state_path).st_mtime_ns
+        if mtime == self.loaded_mtime:
+            return
+        with open(self.state_path, "r") as f:
+            self.state = json.load(f)
+        self.segments = {
+            name: self.segments.get(name) or Segment(os.path.join(self.path, name)) for name in self.state["segments"]
+        }
+        self.deleted = {name: set(ids) for name, ids in self.state["deleted"].items()}
+        self.loaded_mtime = mtime
+
+    def _save_state(self):
+        os.makedirs(self.path, exist_ok=True)
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(temp_path, self.state_path)
+        self.deleted = {name: set(ids) for name, ids in self.state["deleted"].items()}
+        self.loaded_mtime = os.stat(self.state_path).st_mtime_ns
+
+    @contextmanager
+    def _writing(self):
+        """Serialize writers, in this process and in others such as ingest_cli.py, and start from their latest state."""
+        with self.lock:
+            os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+            with file_lock(self.lock_path):
+                # Another process may have saved within the mtime resolution, always read before changing
+                self.loaded_mtime = None
+                self.reload()
+                yield
+
+    def _new_segment_name(self):
+        name = f"seg_{self.state['next_segment']:06d}"
+        self.state["next_segment"] += 1
+        return name
+
+    @property
+    def doc_count(self):
+        deleted = sum(len(ids) for ids in self.state["deleted"].values())
+        return sum(len(segment.ids) for segment in self.segments.values()) - deleted
+
+    def add(self, chunk_ids, texts):
+        if not chunk_ids:
+            return
+        with self._writing():
+            # Re-added ids replace their older copies
+            self._mark_deleted(set(chunk_ids))
+            name = self._write_segment(chunk_ids, texts)
+            self.segments[name] = Segment(os.path.join(self.path, name))
+            self.state["segments"].append(name)
+            self._maybe_compact()
+            self._save_state()
+
+    def _write_segment(self, chunk_ids, texts):
+        """Write a new segment's files, which readers ignore until the state lists it."""
+        term_hashes, docs, freqs, lengths = [], [], [], []
+        hashes = {}
+        for doc_index, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            counts = Counter(tokens)
+            for token in counts:
+                if token not in hashes:
+                    hashes[token] = term_hash(token)
+                term_hashes.append(hashes[token])
+            docs.extend([doc_index] * len(counts))
+            freqs.extend(counts.values())
+        name = self._new_segment_name()
+        Segment.write(
+            os.path.join(self.path, name),
+            np.asarray(term_hashes, dtype=np.uint64),
+            np.asarray(docs, dtype=np.int32),
+            np.asarray(freqs, dtype=np.int64),
+            lengths,
+            chunk_ids,
+        )
+        return name
+
+    def _mark_deleted(self, chunk_ids):
+        for name, segment in self.segments.items():
+            hits = chunk_ids.intersection(segment.ids)
+            if hits:
+                deleted = set(self.state["deleted"].get(name, []))
+                self.state["deleted"][name] = sorted(deleted | hits)
+
+    def delete(self, chunk_ids):
+        with self._writing():
+            self._mark_deleted(set(chunk_ids))
+            self._maybe_compact()
+            self._save_state()
+
+    def _maybe_compact(self):
+        total = sum(len(segment.ids) for segment in self.segments.values())
+        deleted = sum(len(ids) for ids in self.state["deleted"].values())
+        if len(self.segments) > MAX_SEGMENTS or (total and deleted / total > MAX_DELETED_FRACTION):
+            self._compact()
+
+    def _compact(self):
+        """Merge every segment into one, dropping deleted chunks, without going back to Python per posting."""
+        all_terms, all_docs, all_freqs, all_lengths, all_ids = [], [], [], [], []
+        doc_base = 0
+        for name, segment in self.segments.items():
+            deleted = set(self.state["deleted"].get(name, []))
+            keep = np.array([chunk_id not in deleted for chunk_id in segment.ids], dtype=bool)
+            new_index = np.cumsum(keep) - 1 + doc_base
+            posting_terms = np.repeat(np.asarray(segment.terms), np.diff(segment.offsets))
+            live = keep[segment.docs]
+            all_terms.append(posting_terms[live])
+            all_docs.append(new_index[segment.docs[live]])
+            all_freqs.append(np.asarray(segment.freqs)[live])
+            all_lengths.append(np.asarray(segment.lengths)[keep])
+            all_ids.extend(chunk_id for chunk_id, kept in zip(segment.ids, keep) if kept)
+            doc_base += int(keep.sum())
+        old_segments = list(self.segments)
+        self.segments = {}
+        self.state["segments"] = []
+        self.state["deleted"] = {}
+        if all_ids:
+            name = self._new_segment_name()
+            Segment.write(
+                os.path.join(self.path, name),
+                np.concatenate(all_terms),
+                np.concatenate(all_docs),
+                np.concatenate(all_freqs),
+                np.concatenate(all_lengths),
+                all_ids,
+            )
+            self.segments[name] = Segment(os.path.join(self.path, name))
+            self.state["segments"].append(name)
+        # Old segment files are removed once the new state no longer points at them
+        self._save_state()
+        for name in old_segments:
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+    def search(self, query, k=10):
+        """Top-k (chunk id, BM25 score) pairs for the query."""
+        with self.lock:
+            self.reload()
+            segments = list(self.segments.items())
+            deleted_by_segment = self.deleted
+        query_terms = hash_terms(list(dict.fromkeys(tokenize(query))))
+        doc_count = self.doc_count
+        if not segments or not doc_count or not len(query_terms):
+            return []
+        average_length = sum(float(np.sum(segment.lengths)) for _, segment in segments) / max(
+            sum(len(segment.ids) for _, segment in segments), 1
+        )
+
+        per_segment = []
+        document_frequency = np.zeros(len(query_terms))
+        for _, segment in segments:
+            postings = [segment.postings(hashed) for hashed in query_terms]
+            per_segment.append(postings)
+            document_frequency += [0 if docs is None else len(docs) for docs, _ in postings]
+        idf = np.log(1 + (doc_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+        results = []
+        for (name, segment), postings in zip(segments, per_segment):
+            docs_parts, score_parts = [], []
+            for term_index, (docs, freqs) in enumerate(postings):
+                if docs is None:
+                    continue
+                freqs = np.asarray(freqs, dtype=np.float32)
+                lengths = np.asarray(segment.lengths[docs], dtype=np.float32)
+                norm = self.k1 * (1 - self.b + self.b * lengths / average_length)
+                docs_parts.append(np.asarray(docs))
+                score_parts.append(idf[term_index] * freqs * (self.k1 + 1) / (freqs + norm))
+            if not docs_parts:
+                continue
+            unique_docs, inverse = np.unique(np.concatenate(docs_parts), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+            deleted = deleted_by_segment.get(name, set())
+            top = np.argsort(-scores)[: k + len(deleted)]
+            for position in top:
+                chunk_id = segment.ids[unique_docs[position]]
+                if chunk_id not in deleted:
+                    results.append((chunk_id, float(scores[position])))
+        results.sort(key=lambda item: -item[1])
+        return results[:k]
+
+    def rebuild_from_collection(self, collection, page_size=1000, segment_size=50000):
+        """Index every chunk already stored in a Chroma collection, replacing whatever was indexed before.
+
+        Writers wait for the whole rebuild, and searches keep using the old segments until the new
+        ones replace them in a single state write.
+        """
+        with self._writing():
+            new_segments = []
+            ids, texts = [], []
+            offset = 0
+            while True:
+                page = collection.get(include=["documents"], limit=page_size, offset=offset)
+                if not page["ids"]:
+                    break
+                ids.extend(page["ids"])
+                texts.extend(document or "" for document in page["documents"])
+                # Large segments keep the number of merges low on big collections
+                if len(ids) >= segment_size:
+                    new_segments.append(self._write_segment(ids, texts))
+                    ids, texts = [], []
+                offset += page_size
+            if ids:
+                new_segments.append(self._write_segment(ids, texts))
+            self.segments = {name: Segment(os.path.join(self.path, name)) for name in new_segments}
+            self.state["segments"] = new_segments
+            self.state["deleted"] = {}
+            self._maybe_compact()
+            self._save_state()
+            # Old segments, and any left behind by an interrupted write, are no longer listed
+            for name in os.listdir(self.path):
+                if name.startswith("seg_") and name not in self.state["segments"]:
+                    shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_lexical_index(db_path, collection_name):
+    key = (os.path.abspath(db_path), collection_name)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = LexicalIndex(*key)
+        return _indexes[key]
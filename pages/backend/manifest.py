@@ -0,0 +1,118 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+MANIFEST_FILE = 'ingest_manifest.sqlite3'
+
+
+def content_hash(texts):
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def chunk_ids_for(source, texts):
+    # Same source + same text gives the same id, repeated chunks get their occurrence number
+    seen = {}
+    ids = []
+    for text in texts:
+        occurrence = seen.get(text, 0)
+        seen[text] = occurrence + 1
+        digest = hashlib.sha256(f"{source}\x00{occurrence}\x00{text}".encode("utf-8"))
+        ids.append(digest.hexdigest()[:32])
+    return ids
+
+
+def like_pattern(search):
+    escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+class IngestManifest:
+    """Per-collection record of source -> content hash -> chunk ids, stored in the database directory.
+
+    It doubles as the source catalog: every source with its chunk count and ingest time.
+    """
+
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(os.path.join(db_path, MANIFEST_FILE))
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS sources ("
+                "collection TEXT, source TEXT, content_hash TEXT, chunk_count INTEGER, ingested_at REAL, "
+                "PRIMARY KEY (collection, source))"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "collection TEXT, chunk_id TEXT, source TEXT, "
+                "PRIMARY KEY (collection, chunk_id))"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_by_source ON chunks (collection, source)")
+
+    def close(self):
+        self.conn.close()
+
+    def source_hash(self, collection, source):
+        row = self.conn.execute(
+            "SELECT content_hash FROM sources WHERE collection = ? AND source = ?", (collection, source)
+        ).fetchone()
+        return row[0] if row else None
+
+    def chunk_ids(self, collection, source):
+        rows = self.conn.execute(
+            "SELECT chunk_id FROM chunks WHERE collection = ? AND source = ?", (collection, source)
+        )
+        return {row[0] for row in rows}
+
+    def tracked_chunk_count(self, collection):
+        return self.conn.execute("SELECT COUNT(*) FROM chunks WHERE collection = ?", (collection,)).fetchone()[0]
+
+    def record(self, collection, source, source_hash, chunk_ids):
+        with self.conn:
+            self.conn.execute("DELETE FROM chunks WHERE collection = ? AND source = ?", (collection, source))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO chunks (collection, chunk_id, source) VALUES (?, ?, ?)",
+                [(collection, chunk_id, source) for chunk_id in chunk_ids],
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sources (collection, source, content_hash, chunk_count, ingested_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (collection, source, source_hash, len(chunk_ids), time.time()),
+            )
+
+    def remove_source(self, collection, source):
+        chunk_ids = self.chunk_ids(collection, source)
+        with self.conn:
+            self.conn.execute("DELETE FROM chunks WHERE collection = ? AND source = ?", (collection, source))
+            self.conn.execute("DELETE FROM sources WHERE collection = ? AND source = ?", (collection, source))
+        return chunk_ids
+
+    def tracked_ids(self, collection, chunk_ids):
+        tracked = set()
+        chunk_ids = list(chunk_ids)
+        # Stay below SQLite's bound parameter limit
+        for start in range(0, len(chunk_ids), 900):
+            batch = chunk_ids[start:start + 900]
+            rows = self.conn.execute(
+                f"SELECT chunk_id FROM chunks WHERE collection = ? AND chunk_id IN ({','.join('?' * len(batch))})",
+                (collection, *batch),
+            )
+            tracked.update(row[0] for row in rows)
+        return tracked
+
+    def count_sources(self, collection, search=""):
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM sources WHERE collection = ? AND source LIKE ? ESCAPE '\\'",
+            (collection, like_pattern(search)),
+        ).fetchone()[0]
+
+    def list_sources(self, collection, search="", limit=50, offset=0):
+        rows = self.conn.execute(
+            "SELECT source, chunk_count, ingested_at FROM sources WHERE collection = ? AND source LIKE ? ESCAPE '\\' "
+            "ORDER BY source LIMIT ? OFFSET ?",
+            (collection, like_pattern(search), limit, offset),
+        )
+        return [{"source": row[0], "chunk_count": row[1], "ingested_at": row[2]} for row in rows]
@@ -0,0 +1,186 @@
+import contextvars
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+RECENT_TRACES = 200
+
+_current_trace = contextvars.ContextVar("easy_rag_trace", default=None)
+
+
+class Trace:
+    """Timing spans of one request (a query, a chat turn, an ingestion), in the order they started."""
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.origin = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self.depth = 0
+        self.token = None
+        self.lock = threading.Lock()
+
+    def add(self, stage, duration, start=None, depth=None, **attributes):
+        start = time.perf_counter() - duration if start is None else start
+        with self.lock:
+            self.spans.append({
+                "stage": stage,
+                "start_ms": (start - self.origin) * 1000,
+                "duration_ms": duration * 1000,
+                "depth": self.depth if depth is None else depth,
+                "attributes": attributes,
+            })
+            self.spans.sort(key=lambda entry: entry["start_ms"])
+
+    def rows(self):
+        return [
+            {
+                "stage": "  " * entry["depth"] + entry["stage"],
+                "start (ms)": round(entry["start_ms"], 1),
+                "duration (ms)": round(entry["duration_ms"], 1),
+                "details": ", ".join(f"{key}={value}" for key, value in entry["attributes"].items()),
+            }
+            for entry in self.spans
+        ]
+
+    def to_dict(self):
+        return {
+            "trace": self.name,
+            "started_at": self.started_at,
+            "duration_ms": None if self.duration is None else self.duration * 1000,
+            "attributes": self.attributes,
+            "spans": self.spans,
+        }
+
+
+class StageHistograms:
+    """Process-wide latency histograms and item counters per stage, rendered in the Prometheus text format."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def observe(self, stage, seconds, items=None):
+        with self.lock:
+            entry = self.stages.setdefault(stage, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0, "items": 0})
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    entry["buckets"][index] += 1
+            entry["sum"] += seconds
+            entry["count"] += 1
+            if items:
+                entry["items"] += items
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP easy_rag_stage_seconds Time spent in each pipeline stage.",
+            "# TYPE easy_rag_stage_seconds histogram",
+        ]
+        with self.lock:
+            stages = {stage: dict(entry, buckets=list(entry["buckets"])) for stage, entry in sorted(self.stages.items())}
+        for stage, entry in stages.items():
+            for bound, count in zip(self.buckets, entry["buckets"]):
+                lines.append(f'easy_rag_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'easy_rag_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {entry["count"]}')
+            lines.append(f'easy_rag_stage_seconds_sum{{stage="{stage}"}} {entry["sum"]}')
+            lines.append(f'easy_rag_stage_seconds_count{{stage="{stage}"}} {entry["count"]}')
+        lines.append("# HELP easy_rag_stage_items_total Items (documents, chunks, texts) processed by each stage.")
+        lines.append("# TYPE easy_rag_stage_items_total counter")
+        for stage, entry in stages.items():
+            lines.append(f'easy_rag_stage_items_total{{stage="{stage}"}} {entry["items"]}')
+        return "\n".join(lines) + "\n"
+
+
+stage_histograms = StageHistograms()
+recent_traces = deque(maxlen=RECENT_TRACES)
+# One-off process values such as startup times, exported as gauges
+gauges = {}
+# Functions returning Prometheus lines for labelled series kept elsewhere, such as per-model queues
+collectors = []
+
+
+def begin_trace(name, **attributes):
+    trace = Trace(name, **attributes)
+    trace.token = _current_trace.set(trace)
+    return trace
+
+
+def end_trace(trace):
+    trace.duration = time.perf_counter() - trace.origin
+    if trace.token is not None:
+        _current_trace.reset(trace.token)
+        trace.token = None
+    recent_traces.append(trace)
+    return trace
+
+
+@contextmanager
+def traced(name, **attributes):
+    trace = begin_trace(name, **attributes)
+    try:
+        yield trace
+    finally:
+        end_trace(trace)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def span(stage, **attributes):
+    """Time a stage. Spans nest, and go to the current trace if there is one and to the histograms always.
+
+    The yielded dict can be filled in while the stage runs, e.g. with a cache hit or a result count.
+    """
+    trace = _current_trace.get()
+    depth = None
+    if trace is not None:
+        depth = trace.depth
+        trace.depth += 1
+    start = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        duration = time.perf_counter() - start
+        if trace is not None:
+            trace.depth -= 1
+            trace.add(stage, duration, start=start, depth=depth, **attributes)
+        stage_histograms.observe(stage, duration, attributes.get("items"))
+
+
+def record(stage, seconds, start=None, **attributes):
+    """Add a stage measured elsewhere, such as the time to first token reported by a stream."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds, start=start, **attributes)
+    stage_histograms.observe(stage, seconds, attributes.get("items"))
+
+
+def set_gauge(name, value, help_text=""):
+    gauges[name] = (value, help_text)
+
+
+def add_collector(collector):
+    collectors.append(collector)
+
+
+def prometheus_text():
+    lines = []
+    for name, (value, help_text) in sorted(gauges.items()):
+        lines.append(f"# HELP easy_rag_{name} {help_text}")
+        lines.append(f"# TYPE easy_rag_{name} gauge")
+        lines.append(f"easy_rag_{name} {value}")
+    for collector in collectors:
+        lines.extend(collector())
+    return stage_histograms.prometheus_text() + "".join(line + "\n" for line in lines)
+
+
+def traces_jsonl(traces=None):
+    return "".join(json.dumps(trace.to_dict()) + "\n" for trace in (recent_traces if traces is None else traces))
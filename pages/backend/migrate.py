@@ -0,0 +1,129 @@
+import time
+from pages.backend.metrics import span
+from pages.backend.collection_map import get_collection_map
+
+# Shadow and replaced collections only exist while a migration runs, the UI hides them
+MIGRATING_MARKER = "__migrating_"
+REPLACED_MARKER = "__replaced_"
+MIGRATION_BATCH_SIZE = 256
+
+
+def shadow_collection_name(collection_name, job_id):
+    return f"{collection_name}{MIGRATING_MARKER}{job_id}"
+
+
+def replaced_collection_name(collection_name, job_id):
+    return f"{collection_name}{REPLACED_MARKER}{job_id}"
+
+
+def is_migration_collection(name):
+    return MIGRATING_MARKER in name or REPLACED_MARKER in name
+
+
+def collection_names(client):
+    return {collection.name for collection in client.list_collections()}
+
+
+def copy_batch(client, shadow, flat_index, embedding_model, ids, texts, metadatas):
+    from pages.backend.resources import get_embeddings
+    from pages.backend.ingest import upsert_embeddings
+    with span("embed", model=embedding_model, items=len(ids)):
+        embeddings = get_embeddings(embedding_model).embed_documents(texts)
+    with span("upsert", collection=shadow.name, items=len(ids)):
+        # Same ids, so the manifest and the BM25 index stay valid for the swapped collection
+        upsert_embeddings(client, shadow.name, ids, texts, metadatas, embeddings, flat_index=flat_index)
+
+
+def catch_up(client, source, shadow, flat_index, embedding_model, batch_size):
+    """Apply changes made to the source collection while it was being copied, returns the chunks embedded."""
+    from pages.backend.ingest import delete_chunks
+    source_ids = set(source.get(include=[])["ids"])
+    shadow_ids = set(shadow.get(include=[])["ids"])
+    missing = sorted(source_ids - shadow_ids)
+    for start in range(0, len(missing), batch_size):
+        page = source.get(ids=missing[start:start + batch_size], include=["documents", "metadatas"])
+        copy_batch(client, shadow, flat_index, embedding_model, page["ids"], page["documents"], page["metadatas"])
+    removed = list(shadow_ids - source_ids)
+    if removed:
+        delete_chunks(client, shadow.name, removed, flat_index=flat_index)
+    return len(missing)
+
+
+def swap_collections(client, db_path, collection_name, embedding_model, storage, job_id):
+    """Put the shadow collection in place of the original under the original name, then point the map at the new model.
+
+    Each step checks what already happened, so a swap interrupted by a restart completes when the job resumes.
+    """
+    from pages.backend.resources import invalidate_collection
+    from pages.backend.flat import replace_flat_index, delete_flat_index
+    shadow_name = shadow_collection_name(collection_name, job_id)
+    replaced_name = replaced_collection_name(collection_name, job_id)
+    names = collection_names(client)
+    if shadow_name in names:
+        if collection_name in names:
+            # Vector stores already open keep querying the renamed old collection until they are invalidated
+            client.get_collection(collection_name).modify(name=replaced_name)
+        client.get_collection(shadow_name).modify(name=collection_name)
+    if storage.get("engine") == "flat":
+        replace_flat_index(db_path, shadow_name, collection_name)
+    else:
+        delete_flat_index(db_path, collection_name)
+    get_collection_map(db_path).set_collection(collection_name, embedding_model, storage)
+    invalidate_collection(db_path, collection_name)
+    if replaced_name in collection_names(client):
+        client.delete_collection(replaced_name)
+
+
+def run_migration(store, db_path, job):
+    """Re-embed a collection's stored chunks with a new model or storage engine into a shadow collection, then swap it in.
+
+    Chunks are read back from Chroma page by page, so sources are never fetched again. Progress is
+    committed after every batch and a resumed job continues from the last committed page.
+    """
+    from pages.backend.resources import get_client
+    from pages.backend.flat import create_collection, get_flat_index
+    job_id = job["id"]
+    params = job["params"]
+    collection_name = params["collection"]
+    embedding_model = params["embedding_model"]
+    batch_size = params.get("batch_size", MIGRATION_BATCH_SIZE)
+    # Without a storage parameter the collection keeps its current engine
+    storage = params.get("storage") or get_collection_map(db_path).storage(collection_name)
+    client = get_client(db_path)
+    if job["phase"] != "swapping":
+        source = client.get_collection(collection_name)
+        shadow_name = shadow_collection_name(collection_name, job_id)
+        shadow = create_collection(client, shadow_name, storage, metadata=source.metadata)
+        flat_index = get_flat_index(db_path, shadow_name, storage)
+        total_chunks = source.count()
+        done_chunks = job["done_chunks"]
+        summary = job["summary"]
+        summary["models"] = {embedding_model: [collection_name]}
+        store.update(
+            job_id,
+            phase="embedding",
+            total_chunks=total_chunks,
+            total_batches=-(-total_chunks // batch_size),
+            run_started_at=time.time(),
+            run_start_chunks=done_chunks,
+        )
+        while done_chunks < total_chunks:
+            if store.get(job_id)["status"] == "cancelling":
+                # The shadow collection is kept, a retry continues from here
+                store.update(job_id, status="cancelled", phase="cancelled", finished_at=time.time())
+                return
+            page = source.get(include=["documents", "metadatas"], limit=batch_size, offset=done_chunks)
+            if not page["ids"]:
+                break
+            copy_batch(client, shadow, flat_index, embedding_model, page["ids"], page["documents"], page["metadatas"])
+            done_chunks += len(page["ids"])
+            summary["embedding_calls"] += len(page["ids"])
+            summary["added_chunks"] += len(page["ids"])
+            store.update(job_id, done_batches=-(-done_chunks // batch_size), done_chunks=done_chunks, summary=summary)
+        store.update(job_id, phase="catching up")
+        caught_up = catch_up(client, source, shadow, flat_index, embedding_model, batch_size)
+        summary["embedding_calls"] += caught_up
+        summary["added_chunks"] += caught_up
+        store.update(job_id, phase="swapping", summary=summary)
+    swap_collections(client, db_path, collection_name, embedding_model, storage, job_id)
+    store.update(job_id, status="done", phase="done", finished_at=time.time())
@@ -0,0 +1,295 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from langchain_core.embeddings import Embeddings
+from pages.backend.metrics import add_collector, record
+
+# Chat and search queries wait on these, ingestion and migrations do not
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Chat models offered by the chatbot page and the LLM block of the flow builder
+CHAT_MODELS = ["llama3", "llama3.1", "llama3.2", "llama3.3", "deepseek-r1:1.5b"]
+
+
+def client_settings():
+    """Client settings from EASY_RAG_OLLAMA_* environment variables."""
+    max_in_flight = int(os.environ.get("EASY_RAG_OLLAMA_MAX_IN_FLIGHT", 4))
+    return {
+        # Keep-alive connections shared by every session, at least one per request in flight
+        "connections": int(os.environ.get("EASY_RAG_OLLAMA_CONNECTIONS", 16)),
+        # Requests sent to one model at a time, match OLLAMA_NUM_PARALLEL on the server
+        "max_in_flight": max_in_flight,
+        # At most this many of them from bulk work, the rest stay free for interactive requests
+        "bulk_in_flight": int(os.environ.get("EASY_RAG_OLLAMA_BULK_IN_FLIGHT", max(max_in_flight - 1, 1))),
+        "embed_batch_size": int(os.environ.get("EASY_RAG_OLLAMA_EMBED_BATCH_SIZE", 64)),
+        "retries": int(os.environ.get("EASY_RAG_OLLAMA_RETRIES", 3)),
+        "backoff": float(os.environ.get("EASY_RAG_OLLAMA_BACKOFF", 0.5)),
+        "timeout": float(os.environ.get("EASY_RAG_OLLAMA_TIMEOUT", 300)),
+    }
+
+
+def is_retryable(error):
+    import httpx
+    from ollama import ResponseError
+    if isinstance(error, ResponseError):
+        return error.status_code in RETRY_STATUSES
+    # The ollama client turns connection failures into the builtin ConnectionError
+    return isinstance(error, (ConnectionError, httpx.TransportError))
+
+
+class ModelGate:
+    """Requests in flight to one model, with slots held back for interactive requests.
+
+    Bulk requests use at most bulk_limit of the limit slots and do not start while an interactive
+    request is queued, so a large ingestion cannot hold up chat and search.
+    """
+
+    def __init__(self, limit, bulk_limit):
+        self.limit = limit
+        self.bulk_limit = min(bulk_limit, limit)
+        self.condition = threading.Condition()
+        self.in_flight = dict.fromkeys(LANES, 0)
+        self.waiting = dict.fromkeys(LANES, 0)
+
+    def can_start(self, lane):
+        if sum(self.in_flight.values()) >= self.limit:
+            return False
+        return lane == INTERACTIVE or (self.in_flight[BULK] < self.bulk_limit and not self.waiting[INTERACTIVE])
+
+    @contextmanager
+    def slot(self, lane):
+        with self.condition:
+            self.waiting[lane] += 1
+            try:
+                while not self.can_start(lane):
+                    self.condition.wait()
+            finally:
+                self.waiting[lane] -= 1
+            self.in_flight[lane] += 1
+            # Bulk requests waiting behind this one may be able to start now
+            self.condition.notify_all()
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.in_flight[lane] -= 1
+                self.condition.notify_all()
+
+
+class OllamaClient:
+    """One pooled HTTP client to the Ollama server, shared by every session, with per-model gates.
+
+    Embeddings are sent in batches to /api/embed, several batches at once up to the model's limit.
+    Failed requests are retried with exponential backoff and jitter, streams only before their
+    first token.
+    """
+
+    def __init__(self, host=None, connections=16, max_in_flight=4, bulk_in_flight=3, embed_batch_size=64, retries=3, backoff=0.5, timeout=300):
+        import httpx
+        from ollama import Client
+        self.client = Client(
+            host=host,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=connections, max_keepalive_connections=connections, keepalive_expiry=60),
+        )
+        self.max_in_flight = max_in_flight
+        self.bulk_in_flight = bulk_in_flight
+        self.embed_batch_size = embed_batch_size
+        self.retries = retries
+        self.backoff = backoff
+        self.gates = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=connections, thread_name_prefix="ollama")
+
+    def gate(self, model):
+        with self.lock:
+            if model not in self.gates:
+                self.gates[model] = ModelGate(self.max_in_flight, self.bulk_in_flight)
+                self.counters[model] = {"requests": 0, "retries": 0, "failures": 0, "texts": 0}
+            return self.gates[model]
+
+    def count(self, model, counter, amount=1):
+        with self.lock:
+            self.counters[model][counter] += amount
+
+    @contextmanager
+    def slot(self, model, lane):
+        gate = self.gate(model)
+        start = time.perf_counter()
+        with gate.slot(lane):
+            record("ollama_queue", time.perf_counter() - start, start=start, model=model, lane=lane)
+            self.count(model, "requests")
+            yield
+
+    def retry_delay(self, attempt):
+        return self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def call(self, model, lane, request):
+        for attempt in range(self.retries + 1):
+            try:
+                with self.slot(model, lane):
+                    return request()
+            except Exception as e:
+                if not is_retryable(e) or attempt == self.retries:
+                    self.count(model, "failures")
+                    raise
+            self.count(model, "retries")
+            # Waits without holding the slot, other requests go ahead meanwhile
+            time.sleep(self.retry_delay(attempt))
+
+    def embed_batch(self, model, texts, lane):
+        start = time.perf_counter()
+        embeddings = self.call(model, lane, lambda: self.client.embed(model=model, input=texts)["embeddings"])
+        record("ollama_embed", time.perf_counter() - start, start=start, model=model, lane=lane, items=len(texts))
+        self.count(model, "texts", len(texts))
+        return embeddings
+
+    def embed(self, model, texts, lane=BULK):
+        texts = list(texts)
+        batches = [texts[start:start + self.embed_batch_size] for start in range(0, len(texts), self.embed_batch_size)]
+        if len(batches) <= 1:
+            return self.embed_batch(model, texts, lane) if texts else []
+        # Batches go out concurrently, the model's gate decides how many run at once
+        results = self.executor.map(lambda batch: self.embed_batch(model, batch, lane), batches)
+        return [embedding for embeddings in results for embedding in embeddings]
+
+    def chat_stream(self, model, prompt, lane=INTERACTIVE):
+        """Yield the responses of a streamed chat. The model's slot is held until the stream ends."""
+        attempt = 0
+        while True:
+            started = False
+            try:
+                with self.slot(model, lane):
+                    for response in self.client.chat(model=model, messages=[{"role": "user", "content": prompt}], stream=True):
+                        started = True
+                        yield response
+                return
+            except Exception as e:
+                # Tokens already shown cannot be taken back, a stream is only retried before its first one
+                if started or not is_retryable(e) or attempt == self.retries:
+                    self.count(model, "failures")
+                    raise
+            self.count(model, "retries")
+            time.sleep(self.retry_delay(attempt))
+            attempt += 1
+
+    def load(self, model, lane=BULK):
+        # An empty prompt only loads the model, see the Ollama FAQ
+        return self.call(model, lane, lambda: self.client.generate(model=model, prompt=""))
+
+    def queue_stats(self):
+        with self.lock:
+            gates = dict(self.gates)
+            counters = {model: dict(values) for model, values in self.counters.items()}
+        stats = {}
+        for model, gate in gates.items():
+            with gate.condition:
+                stats[model] = dict(counters[model], in_flight=dict(gate.in_flight), waiting=dict(gate.waiting))
+        return stats
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_ollama_client():
+    """The shared client for the server in OLLAMA_HOST, created with client_settings()."""
+    host = os.environ.get("OLLAMA_HOST")
+    with _clients_lock:
+        if host not in _clients:
+            _clients[host] = OllamaClient(host=host, **client_settings())
+        return _clients[host]
+
+
+class PooledEmbeddings(Embeddings):
+    """Embeddings through the shared client: documents on the bulk lane, queries on the interactive one."""
+
+    def __init__(self, model):
+        self.model = model
+
+    def embed_documents(self, texts):
+        return get_ollama_client().embed(self.model, texts, lane=BULK)
+
+    def embed_query(self, text):
+        return get_ollama_client().embed(self.model, [text], lane=INTERACTIVE)[0]
+
+
+class ChatChunk:
+    def __init__(self, content, usage_metadata=None):
+        self.content = content
+        self.usage_metadata = usage_metadata
+
+
+class PooledChatModel:
+    """The parts of ChatOllama the app uses, stream() and invoke(), through the shared client."""
+
+    def __init__(self, model, lane=INTERACTIVE):
+        self.model = model
+        self.lane = lane
+
+    def stream(self, prompt):
+        for response in get_ollama_client().chat_stream(self.model, prompt, lane=self.lane):
+            usage = None
+            if response.done:
+                # Same usage metadata as ChatOllama puts on its last chunk
+                input_tokens, output_tokens = response.prompt_eval_count or 0, response.eval_count or 0
+                usage = {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+            yield ChatChunk(response.message.content or "", usage)
+
+    def invoke(self, prompt):
+        return ChatChunk("".join(chunk.content for chunk in self.stream(prompt)))
+
+
+def get_chat_model(model, lane=INTERACTIVE):
+    return PooledChatModel(model, lane=lane)
+
+
+def format_queue_stats(stats):
+    if not stats:
+        return "Ollama: no requests yet"
+    return "Ollama: " + "; ".join(
+        f"{model} {values['in_flight'][INTERACTIVE]}+{values['in_flight'][BULK]} in flight, "
+        f"{values['waiting'][INTERACTIVE]}+{values['waiting'][BULK]} queued (interactive+bulk), "
+        f"{values['requests']} requests, {values['retries']} retries"
+        for model, values in sorted(stats.items())
+    )
+
+
+def prometheus_lines():
+    with _clients_lock:
+        clients = list(_clients.values())
+    stats = {}
+    for client in clients:
+        for model, values in client.queue_stats().items():
+            stats[model] = values
+    if not stats:
+        return []
+    lines = [
+        "# HELP easy_rag_ollama_in_flight Requests being served by Ollama, per model and lane.",
+        "# TYPE easy_rag_ollama_in_flight gauge",
+    ]
+    lines += [f'easy_rag_ollama_in_flight{{model="{model}",lane="{lane}"}} {values["in_flight"][lane]}' for model, values in sorted(stats.items()) for lane in LANES]
+    lines += [
+        "# HELP easy_rag_ollama_queue_depth Requests waiting for a free slot, per model and lane.",
+        "# TYPE easy_rag_ollama_queue_depth gauge",
+    ]
+    lines += [f'easy_rag_ollama_queue_depth{{model="{model}",lane="{lane}"}} {values["waiting"][lane]}' for model, values in sorted(stats.items()) for lane in LANES]
+    for counter, help_text in (
+        ("requests", "Requests sent to Ollama, retries included."),
+        ("retries", "Requests retried after a connection error or a 429/5xx response."),
+        ("failures", "Requests that failed after their last retry."),
+        ("texts", "Texts embedded."),
+    ):
+        lines.append(f"# HELP easy_rag_ollama_{counter}_total {help_text}")
+        lines.append(f"# TYPE easy_rag_ollama_{counter}_total counter")
+        lines += [f'easy_rag_ollama_{counter}_total{{model="{model}"}} {values[counter]}' for model, values in sorted(stats.items())]
+    return lines
+
+
+add_collector(prometheus_lines)
@@ -0,0 +1,122 @@
+import io
+import os
+import tempfile
+import time
+from concurrent.futures import as_completed
+from datetime import datetime
+from langchain_core.documents import Document
+from pypdf import PdfReader
+from pages.backend.chunking import get_parser_executor, split_documents
+from pages.backend.metrics import record
+
+MIN_PAGES_PER_TASK = 8
+
+
+def info_metadata(reader):
+    """The document info of the PDF as PyPDFLoader reports it: lower-case keys, ISO dates and PyPDF defaults."""
+    metadata = {"producer": "PyPDF", "creator": "PyPDF", "creationdate": ""}
+    for key, value in (reader.metadata or {}).items():
+        key = key.lstrip("/").lower()
+        value = value if type(value) in (str, int) else str(value)
+        if key in ("creationdate", "moddate"):
+            try:
+                value = datetime.strptime(value.replace("'", ""), "D:%Y%m%d%H%M%S%z").isoformat("T")
+            except ValueError:
+                pass
+        elif isinstance(value, str):
+            value = value.strip()
+        metadata[key] = value
+    return metadata
+
+
+def extract_pages(pdf, source, start, end, chunking=None):
+    """Text of pages [start, end) of a PDF path or bytes, split into chunks when a chunking is given.
+
+    Same text and metadata as PyPDFLoader, with the upload name as source.
+    """
+    reader = PdfReader(io.BytesIO(pdf) if isinstance(pdf, bytes) else pdf)
+    total_pages = len(reader.pages)
+    metadata = dict(info_metadata(reader), source=source, total_pages=total_pages)
+    docs = [
+        Document(
+            page_content=reader.pages[index].extract_text().strip(),
+            metadata=dict(metadata, page=index, page_label=reader.page_labels[index]),
+        )
+        for index in range(start, min(end, total_pages))
+    ]
+    if chunking:
+        docs = split_documents(docs, chunking)
+    return docs
+
+
+def load_pdf(data, source, chunking=None):
+    """Whole PDF in the current process, for callers that already run one file per worker."""
+    return extract_pages(data, source, 0, len(PdfReader(io.BytesIO(data)).pages), chunking)
+
+
+def pages_per_task(total_pages, workers):
+    # Every task reopens the PDF, so ranges are as large as possible while still keeping each worker busy
+    return max(MIN_PAGES_PER_TASK, -(-total_pages // (workers * 2)))
+
+
+def parse_pdfs(files, chunking=None, executor=None):
+    """Parse (name, bytes) PDFs with their page ranges spread over a process pool.
+
+    Yields (name, documents, error) for each file as soon as all of its pages are done, so callers
+    can embed one file while the others are still being parsed. A failing file only fails itself.
+    """
+    executor = executor or get_parser_executor()
+    tasks = {}
+    names = {}
+    remaining = {}
+    results = {}
+    errors = {}
+    submitted_at = {}
+    # Workers read the PDF from a temporary file, so its bytes are not pickled for every page range
+    paths = {}
+    try:
+        # Files are tracked by position, two uploads can share a name
+        for file_index, (name, data) in enumerate(files):
+            try:
+                total_pages = len(PdfReader(io.BytesIO(data)).pages)
+            except Exception as e:
+                yield name, [], str(e)
+                continue
+            if not total_pages:
+                yield name, [], None
+                continue
+            names[file_index] = name
+            submitted_at[file_index] = time.perf_counter()
+            remaining[file_index] = 0
+            results[file_index] = {}
+            fd, paths[file_index] = tempfile.mkstemp(suffix=".pdf")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            task_pages = pages_per_task(total_pages, os.cpu_count() or 1)
+            for start in range(0, total_pages, task_pages):
+                future = executor.submit(extract_pages, paths[file_index], name, start, start + task_pages, chunking)
+                tasks[future] = (file_index, start)
+                remaining[file_index] += 1
+
+        for future in as_completed(tasks):
+            file_index, start = tasks[future]
+            try:
+                results[file_index][start] = future.result()
+            except Exception as e:
+                errors.setdefault(file_index, str(e))
+            remaining[file_index] -= 1
+            if remaining[file_index] == 0:
+                os.remove(paths.pop(file_index))
+                if file_index in errors:
+                    yield names[file_index], [], errors[file_index]
+                else:
+                    # Page ranges finish in any order, documents are returned in page order
+                    pages = results[file_index]
+                    docs = [doc for start in sorted(pages) for doc in pages[start]]
+                    # Parsing and splitting happen in the workers, this is the file's time from submission to its last page
+                    record("load", time.perf_counter() - submitted_at[file_index], start=submitted_at[file_index], source=names[file_index], items=len(docs))
+                    yield names[file_index], docs, None
+                del results[file_index]
+    finally:
+        for path in paths.values():
+            os.remove(path)
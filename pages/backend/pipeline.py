@@ -0,0 +1,401 @@
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pages.backend.Blocks import blocks
+from pages.backend.metrics import record
+
+BLOCK_DEFINITIONS = {block["type"]: block for block in blocks}
+DEFAULT_PROMPT_TEMPLATE = """
+Answer the question based only on the following context:
+
+{context}
+
+---
+
+Answer the question based on the above context: {question}
+"""
+FIELD_TYPES = {"int": int, "float": float, "text": str, "textarea": str, "select": str}
+FIELD_TYPE_NAMES = {"int": "a whole number", "float": "a number", "text": "text", "textarea": "text", "select": "text"}
+# Blocks mostly wait on Ollama, Chroma and the network, so threads overlap them well
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="pipeline")
+
+
+class PipelineError(ValueError):
+    """A flow that does not compile, or a block whose settings cannot run."""
+
+
+class Node:
+    def __init__(self, node_id, block_type, params, inputs):
+        self.id = node_id
+        self.type = block_type
+        self.label = BLOCK_DEFINITIONS[block_type]["label"]
+        self.params = params
+        # Input name -> ids of the nodes connected to it
+        self.inputs = inputs
+
+    @property
+    def upstream(self):
+        return {node_id for node_ids in self.inputs.values() for node_id in node_ids}
+
+    def __repr__(self):
+        return f"{self.label} #{self.id}"
+
+
+class Pipeline:
+    def __init__(self, nodes, order):
+        self.nodes = nodes
+        self.order = order
+
+    def sinks(self):
+        """Nodes nothing else reads from, their outputs are the results of the flow."""
+        used = set().union(*(node.upstream for node in self.nodes.values()))
+        return [node_id for node_id in self.order if node_id not in used]
+
+
+def flow_nodes(flow):
+    """Nodes of a Drawflow export, from every module, keyed by node id."""
+    if isinstance(flow, (str, bytes)):
+        try:
+            flow = json.loads(flow)
+        except json.JSONDecodeError as e:
+            raise PipelineError(f"The flow is not valid JSON: {e}") from e
+    if not isinstance(flow, dict) or not isinstance(flow.get("drawflow"), dict):
+        raise PipelineError("Not a Drawflow export, expected a \"drawflow\" object.")
+    nodes = {}
+    for module in flow["drawflow"].values():
+        for node_id, node in (module.get("data") or {}).items():
+            nodes[str(node_id)] = node
+    return nodes
+
+
+def field_value(node_label, field, value):
+    if value is None or value == "":
+        return field["default"]
+    try:
+        value = FIELD_TYPES[field["type"]](value)
+    except (TypeError, ValueError) as e:
+        raise PipelineError(f"{node_label}: {field['label']} must be {FIELD_TYPE_NAMES[field['type']]}, got {value!r}.") from e
+    if field["type"] == "select" and value not in field["options"]:
+        raise PipelineError(f"{node_label}: {field['label']} must be one of {', '.join(field['options'])}.")
+    return value
+
+
+def topological_order(nodes):
+    remaining = {node_id: set(node.upstream) for node_id, node in nodes.items()}
+    order = []
+    while remaining:
+        ready = sorted((node_id for node_id, upstream in remaining.items() if not upstream), key=node_sort_key)
+        if not ready:
+            raise PipelineError(f"The flow has a cycle through {', '.join(str(nodes[node_id]) for node_id in sorted(remaining, key=node_sort_key))}.")
+        for node_id in ready:
+            del remaining[node_id]
+            order.append(node_id)
+        for upstream in remaining.values():
+            upstream.difference_update(ready)
+    return order
+
+
+def node_sort_key(node_id):
+    return (0, int(node_id), "") if node_id.isdigit() else (1, 0, node_id)
+
+
+def compile_flow(flow):
+    """Compile a Drawflow export into a Pipeline of the blocks in pages/backend/Blocks.py."""
+    exported = flow_nodes(flow)
+    if not exported:
+        raise PipelineError("The flow is empty.")
+    nodes = {}
+    for node_id, node in exported.items():
+        block_type = node.get("class") or node.get("name")
+        definition = BLOCK_DEFINITIONS.get(block_type)
+        if definition is None:
+            raise PipelineError(f"Node #{node_id} has unknown block type {block_type!r}.")
+        label = f"{definition['label']} #{node_id}"
+        data = node.get("data") or {}
+        params = {field["name"]: field_value(label, field, data.get(field["name"])) for field in definition["fields"]}
+        inputs = {}
+        for index, port in enumerate(definition["inputs"], start=1):
+            connections = ((node.get("inputs") or {}).get(f"input_{index}") or {}).get("connections") or []
+            inputs[port["name"]] = [str(connection["node"]) for connection in connections]
+            if not inputs[port["name"]] and not port.get("optional"):
+                raise PipelineError(f"{label}: connect its {port['label']} input.")
+        for node_ids in inputs.values():
+            for upstream_id in node_ids:
+                if upstream_id not in exported:
+                    raise PipelineError(f"{label} is connected to node #{upstream_id}, which is not in the flow.")
+        nodes[node_id] = Node(node_id, block_type, params, inputs)
+    return Pipeline(nodes, topological_order(nodes))
+
+
+def block_version(node):
+    """State outside the flow that a block's output depends on, part of its cache key."""
+    if node.type == "Retriever":
+        from pages.backend.collection_map import get_collection_map
+        collection_map = get_collection_map(os.path.join(".", node.params["database"]))
+        collection_name = node.params["collection"]
+        # Ingestion and removal update the stats, a migration changes the model or the engine
+        return [
+            collection_map.embedding_model(collection_name),
+            collection_map.storage(collection_name),
+            collection_map.stats(collection_name).get("updated_at"),
+        ]
+    if node.type == "PDFLoader":
+        try:
+            stat = os.stat(node.params["path"])
+        except OSError:
+            return None
+        return [stat.st_mtime_ns, stat.st_size]
+    return None
+
+
+def block_key(node, input_keys):
+    """Cache key of a node's output: its block, settings and version, and the keys of its inputs.
+
+    Input keys stand in for the input values, so a key changes whenever anything upstream changes
+    without hashing large outputs such as fetched pages.
+    """
+    payload = {
+        "type": node.type,
+        "params": node.params,
+        "inputs": {name: [input_keys[node_id] for node_id in node_ids] for name, node_ids in node.inputs.items()},
+        "version": block_version(node),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class BlockCache:
+    """Block outputs by cache key, least recently used dropped first."""
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, output):
+        with self.lock:
+            self.entries[key] = output
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self.entries),
+        }
+
+
+block_cache = BlockCache()
+
+
+def as_documents(items):
+    """Documents from block outputs: document lists, (url, html) pages and plain text."""
+    from langchain_core.documents import Document
+    from pages.backend.fetcher import html_to_document
+    docs = []
+    for item in items:
+        if isinstance(item, Document):
+            docs.append(item)
+        elif isinstance(item, tuple):
+            docs.append(html_to_document(*item))
+        elif isinstance(item, str):
+            docs.append(Document(page_content=item))
+        else:
+            docs.extend(as_documents(item))
+    return docs
+
+
+def as_text(values):
+    return "\n".join(value if isinstance(value, str) else "\n\n".join(doc.page_content for doc in as_documents(value)) for value in values)
+
+
+def flatten(values):
+    return [item for value in values for item in (value if isinstance(value, list) else [value])]
+
+
+def run_text_input(params, inputs):
+    return params["text"]
+
+
+def run_sitemap_loader(params, inputs):
+    from pages.backend.fetcher import WebFetcher, fetch_sitemap_pages
+    if not params["url"]:
+        raise PipelineError("Enter a sitemap URL.")
+    return fetch_sitemap_pages(params["url"], WebFetcher())
+
+
+def run_page_loader(params, inputs):
+    from pages.backend.fetcher import WebFetcher, fetch_html_pages
+    urls = [url.strip() for url in params["urls"].split(",") if url.strip()]
+    if not urls:
+        raise PipelineError("Enter at least one URL.")
+    return fetch_html_pages(urls, WebFetcher())
+
+
+def run_pdf_loader(params, inputs):
+    from pages.backend.pdf import load_pdf
+    path = params["path"]
+    if not os.path.isfile(path):
+        raise PipelineError(f"No PDF at {path!r}.")
+    with open(path, "rb") as f:
+        return load_pdf(f.read(), os.path.basename(path))
+
+
+def run_splitter(params, inputs):
+    from pages.backend.chunking import chunk_all, chunking_from_settings
+    return chunk_all(flatten(inputs["documents"]), chunking_from_settings(params))
+
+
+def run_retriever(params, inputs):
+    from pages.backend.collection_map import get_collection_map
+    from pages.backend.resources import get_vector_store
+    from pages.backend.retrieval import retrieve
+    db_path = os.path.join(".", params["database"])
+    if not params["database"] or not os.path.isdir(db_path):
+        raise PipelineError(f"No database {params['database']!r}.")
+    embedding_model = get_collection_map(db_path).embedding_model(params["collection"])
+    if embedding_model is None:
+        raise PipelineError(f"No collection {params['collection']!r} in {params['database']}.")
+    number = params["number"]
+    if params["search_type"] != "similarity_score_threshold":
+        number = int(number)
+    return retrieve(
+        get_vector_store(db_path, params["collection"], embedding_model),
+        as_text(inputs["question"]),
+        params["search_type"],
+        number,
+        db_path=db_path,
+        collection_name=params["collection"],
+        fetch_k=params["fetch_k"],
+        lambda_mult=params["lambda_mult"],
+    )
+
+
+def run_prompt(params, inputs):
+    from pages.backend.context import pack_context
+    context_text, _ = pack_context(as_documents(flatten(inputs["context"])), max_tokens=params["context_tokens"])
+    try:
+        return (params["template"] or DEFAULT_PROMPT_TEMPLATE).format(context=context_text, question=as_text(inputs["question"]))
+    except (KeyError, IndexError, ValueError) as e:
+        raise PipelineError(f"The template can only use {{context}} and {{question}}: {e}") from e
+
+
+def run_llm(params, inputs):
+    from pages.backend.ollama_client import get_chat_model
+    return get_chat_model(params["model"]).invoke(as_text(inputs["prompt"])).content
+
+
+BLOCK_RUNNERS = {
+    "TextInput": run_text_input,
+    "SitemapLoader": run_sitemap_loader,
+    "PageLoader": run_page_loader,
+    "PDFLoader": run_pdf_loader,
+    "Splitter": run_splitter,
+    "Retriever": run_retriever,
+    "Prompt": run_prompt,
+    "LLM": run_llm,
+}
+
+
+def run_block(node, inputs):
+    start = time.perf_counter()
+    try:
+        output, error = BLOCK_RUNNERS[node.type](node.params, inputs), None
+    except Exception as e:
+        output, error = None, str(e) or type(e).__name__
+    seconds = time.perf_counter() - start
+    record("block", seconds, start=start, block=node.type, node=node.id, cache="miss")
+    return output, seconds, error
+
+
+def run_pipeline(pipeline, cache=block_cache, use_cache=True, executor=None):
+    """Run every block as soon as its inputs are ready, independent branches at the same time.
+
+    Outputs found in the cache are reused without running the block, so a re-run only runs the
+    blocks whose settings or upstream changed. Blocks downstream of a failure are skipped.
+    Returns {node id: {"status", "seconds", "output", "error"}}, status being "done", "cached",
+    "failed" or "skipped".
+    """
+    executor = executor or _executor
+    results = {}
+    keys = {}
+    waiting = {node_id: pipeline.nodes[node_id].upstream for node_id in pipeline.order}
+    running = {}
+    while waiting or running:
+        ready = [node_id for node_id, upstream in waiting.items() if upstream.issubset(results)]
+        for node_id in ready:
+            del waiting[node_id]
+            node = pipeline.nodes[node_id]
+            failed = sorted(upstream_id for upstream_id in node.upstream if results[upstream_id]["status"] in ("failed", "skipped"))
+            if failed:
+                error = f"Input {', '.join(str(pipeline.nodes[upstream_id]) for upstream_id in failed)} did not run."
+                results[node_id] = {"status": "skipped", "seconds": 0.0, "output": None, "error": error}
+                continue
+            keys[node_id] = block_key(node, keys)
+            if use_cache:
+                hit, output = cache.get(keys[node_id])
+                if hit:
+                    record("block", 0.0, block=node.type, node=node.id, cache="hit")
+                    results[node_id] = {"status": "cached", "seconds": 0.0, "output": output, "error": None}
+                    continue
+            inputs = {name: [results[upstream_id]["output"] for upstream_id in node_ids] for name, node_ids in node.inputs.items()}
+            # Copied context, so the blocks' spans go to the caller's trace
+            running[executor.submit(contextvars.copy_context().run, run_block, node, inputs)] = node_id
+        if ready:
+            # Cached and skipped nodes may have made others ready without anything finishing
+            continue
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            node_id = running.pop(future)
+            output, seconds, error = future.result()
+            if error is None:
+                cache.put(keys[node_id], output)
+            results[node_id] = {"status": "failed" if error else "done", "seconds": seconds, "output": output, "error": error}
+    return results
+
+
+def timing_labels(results):
+    """Per-node badge text and status for the canvas."""
+    labels = {}
+    for node_id, result in results.items():
+        if result["status"] == "cached":
+            text = "cached"
+        elif result["status"] == "skipped":
+            text = "skipped"
+        else:
+            text = f"{result['seconds'] * 1000:.0f} ms" if result["seconds"] < 10 else f"{result['seconds']:.1f} s"
+            if result["error"]:
+                text += f" · {result['error']}"
+        labels[node_id] = {"text": text, "status": result["status"]}
+    return labels
+
+
+def builder_config(flow=None, results=None):
+    """Script that hands the block definitions, the flow to restore and the block timings to the canvas."""
+    config = {"blocks": blocks, "flow": flow, "timings": timing_labels(results or {})}
+    # Escaped so that text in the flow cannot close the script element
+    script = json.dumps(config).replace("</", "<\\/")
+    return f"<script>window.ragBuilder = {script};</script>"
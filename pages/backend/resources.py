@@ -0,0 +1,114 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class ResourcePool:
+    """Bounded LRU registry of expensive objects, shared by every Streamlit session in the process."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, factory):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+        value = factory()
+        with self.lock:
+            # Another session may have built the same entry meanwhile, keep the first one
+            value = self.entries.setdefault(key, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return value
+
+    def invalidate(self, predicate):
+        with self.lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                del self.entries[key]
+
+
+_clients = ResourcePool(max_size=8)
+_embeddings = ResourcePool(max_size=8)
+_vector_stores = ResourcePool(max_size=32)
+_invalidation_hooks = []
+
+
+def _db_key(db_path):
+    return os.path.abspath(db_path)
+
+
+# chromadb and the langchain integrations take seconds to import, they are loaded with the first resource built
+
+
+def get_client(db_path):
+    import chromadb
+    db_path = _db_key(db_path)
+    return _clients.get(db_path, lambda: chromadb.PersistentClient(path=db_path))
+
+
+def get_embeddings(embedding_model):
+    from pages.backend.ollama_client import PooledEmbeddings
+    return _embeddings.get(embedding_model, lambda: PooledEmbeddings(embedding_model))
+
+
+def get_query_embeddings(db_path, embedding_model):
+    from pages.backend.embedding_cache import CachedQueryEmbeddings
+    # Query embeddings go through the (model, text) cache, with its disk tier in the database directory
+    return CachedQueryEmbeddings(get_embeddings(embedding_model), embedding_model, db_path=_db_key(db_path))
+
+
+def get_vector_store(db_path, collection_name, embedding_model):
+    db_path = _db_key(db_path)
+    return _vector_stores.get(
+        (db_path, collection_name, embedding_model),
+        lambda: _build_vector_store(db_path, collection_name, embedding_model),
+    )
+
+
+def _build_vector_store(db_path, collection_name, embedding_model):
+    from langchain_chroma import Chroma
+    from pages.backend.flat import FlatCollection, get_flat_index
+    vector_store = Chroma(
+        client=get_client(db_path),
+        collection_name=collection_name,
+        embedding_function=get_query_embeddings(db_path, embedding_model),
+    )
+    flat_index = get_flat_index(db_path, collection_name)
+    if flat_index is not None:
+        # Vector queries of flat collections are answered by the flat index, the rest by Chroma
+        vector_store._chroma_collection = FlatCollection(vector_store._chroma_collection, flat_index)
+    return vector_store
+
+
+def on_collection_invalidated(hook):
+    # Caches derived from a collection's contents register here to be dropped with it
+    _invalidation_hooks.append(hook)
+
+
+def invalidate_collection(db_path, collection_name):
+    # Called whenever a collection is created or its data changes
+    db_path = _db_key(db_path)
+    _vector_stores.invalidate(lambda key: key[0] == db_path and key[1] == collection_name)
+    for hook in _invalidation_hooks:
+        hook(db_path, collection_name)
+
+
+def invalidate_database(db_path):
+    db_path = _db_key(db_path)
+    _vector_stores.invalidate(lambda key: key[0] == db_path)
+    _clients.invalidate(lambda key: key == db_path)
+
+
+def pool_stats():
+    return {
+        name: {"size": len(pool.entries), "hits": pool.hits, "misses": pool.misses}
+        for name, pool in (("clients", _clients), ("embeddings", _embeddings), ("vector_stores", _vector_stores))
+    }
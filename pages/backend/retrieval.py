@@ -0,0 +1,113 @@
+import numpy as np
+from langchain_core.documents import Document
+from pages.backend.lexical import get_lexical_index
+from pages.backend.metrics import span
+
+SEARCH_TYPES = ["similarity_score_threshold", "mmr", "top_k", "hybrid"]
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    # Each ranking is a list of ids, best first
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def hybrid_search(vector_store, lexical_index, query, k=4, fetch_k=20):
+    """Merge dense and BM25 candidates with reciprocal rank fusion."""
+    vector_docs = vector_store.similarity_search(query, k=fetch_k)
+    with span("bm25_search", items=fetch_k):
+        lexical_hits = lexical_index.search(query, k=fetch_k)
+    docs_by_id = {doc.id: doc for doc in vector_docs}
+    fused_ids = reciprocal_rank_fusion([
+        [doc.id for doc in vector_docs],
+        [chunk_id for chunk_id, _ in lexical_hits],
+    ])[:k]
+    missing_ids = [chunk_id for chunk_id in fused_ids if chunk_id not in docs_by_id]
+    if missing_ids:
+        stored = vector_store.get(ids=missing_ids, include=["documents", "metadatas"])
+        for chunk_id, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"]):
+            docs_by_id[chunk_id] = Document(id=chunk_id, page_content=text or "", metadata=metadata or {})
+    return [docs_by_id[chunk_id] for chunk_id in fused_ids if chunk_id in docs_by_id]
+
+
+def maximal_marginal_relevance(query_embedding, candidate_embeddings, k=4, lambda_mult=0.5):
+    """Indices of the MMR selection, computed on a precomputed candidate similarity matrix."""
+    candidates = np.asarray(candidate_embeddings, dtype=np.float32)
+    k = min(k, len(candidates))
+    if k <= 0:
+        return []
+    query = np.asarray(query_embedding, dtype=np.float32)
+    candidates = candidates / np.maximum(np.linalg.norm(candidates, axis=1, keepdims=True), 1e-12)
+    query = query / max(np.linalg.norm(query), 1e-12)
+    relevance = candidates @ query
+    similarity = candidates @ candidates.T
+    selected = [int(np.argmax(relevance))]
+    # Highest similarity of every candidate to anything selected so far, updated one row at a time
+    redundancy = similarity[selected[0]].copy()
+    available = np.ones(len(candidates), dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < k:
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return selected
+
+
+def mmr_search(vector_store, query, k=4, fetch_k=20, lambda_mult=0.5):
+    """MMR over the stored embeddings of the fetch_k nearest chunks, read from Chroma in one query."""
+    query_embedding = vector_store.embeddings.embed_query(query)
+    with span("vector_search", items=fetch_k):
+        result = vector_store._collection.query(
+            query_embeddings=[query_embedding],
+            n_results=fetch_k,
+            include=["documents", "metadatas", "embeddings"],
+        )
+    if not result["ids"][0]:
+        return []
+    with span("mmr_select", items=len(result["ids"][0])):
+        selected = maximal_marginal_relevance(query_embedding, result["embeddings"][0], k=k, lambda_mult=lambda_mult)
+    # Same order as LangChain's Chroma MMR: the selected chunks in relevance order
+    return [
+        Document(
+            id=result["ids"][0][index],
+            page_content=result["documents"][0][index] or "",
+            metadata=result["metadatas"][0][index] or {},
+        )
+        for index in sorted(selected)
+    ]
+
+
+def retrieve(vector_store, query, search_type, number=None, db_path=None, collection_name=None, fetch_k=20, lambda_mult=0.5):
+    """Run one of SEARCH_TYPES against a vector store and return the matching documents."""
+    with span("search", search_type=search_type) as attributes:
+        results = _retrieve(vector_store, query, search_type, number, db_path, collection_name, fetch_k, lambda_mult)
+        attributes["items"] = len(results)
+    return results
+
+
+def _retrieve(vector_store, query, search_type, number, db_path, collection_name, fetch_k, lambda_mult):
+    if search_type == "similarity_score_threshold":
+        retriever = vector_store.as_retriever(
+            search_type="similarity_score_threshold",
+            search_kwargs={"score_threshold": float(number)}
+        )
+    elif search_type == "mmr":
+        return mmr_search(vector_store, query, k=int(number or 4), fetch_k=int(fetch_k), lambda_mult=lambda_mult)
+    elif search_type == "top_k":
+        retriever = vector_store.as_retriever(search_kwargs={"k": number})
+    elif search_type == "hybrid":
+        lexical_index = get_lexical_index(db_path, collection_name)
+        if not lexical_index.doc_count and vector_store._collection.count():
+            # Collections ingested before the BM25 index existed are indexed on first use
+            lexical_index.rebuild_from_collection(vector_store._collection)
+        return hybrid_search(vector_store, lexical_index, query, k=int(number or 4), fetch_k=int(fetch_k))
+    else:
+        raise ValueError(f"Unknown search type: {search_type}")
+    return retriever.invoke(query)
@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+from pages.backend.metrics import traced, span, set_gauge
+from pages.backend.collection_map import get_collection_map
+
+# Warm-up is off unless enabled, it loads every configured model into Ollama
+WARM_UP_ENV = "EASY_RAG_WARM_UP"
+WARM_UP_DATABASES_ENV = "EASY_RAG_WARM_UP_DATABASES"
+WARM_UP_LLMS_ENV = "EASY_RAG_WARM_UP_LLMS"
+
+
+class StartupTimes:
+    """How long the process took to become usable, measured from the first script run."""
+
+    def __init__(self):
+        self.started = None
+        self.imports = None
+        self.first_query = None
+        self.lock = threading.Lock()
+
+    def mark_imports(self, script_started):
+        # Only the first run counts, later reruns find every module already imported
+        with self.lock:
+            if self.started is not None:
+                return
+            self.started = script_started
+            self.imports = time.perf_counter() - script_started
+        set_gauge("startup_import_seconds", self.imports, "Time the first script run spent importing the app.")
+
+    def mark_first_query(self):
+        with self.lock:
+            if self.started is None or self.first_query is not None:
+                return
+            self.first_query = time.perf_counter() - self.started
+        set_gauge("time_to_first_query_seconds", self.first_query, "Time from the first script run to the first answered query.")
+
+    def summary(self):
+        if self.started is None:
+            return "Startup not measured yet"
+        first_query = "no query yet" if self.first_query is None else f"first query after {self.first_query:.2f} s"
+        return f"Startup: imports {self.imports:.2f} s, {first_query}"
+
+
+class WarmUp:
+    def __init__(self, databases, llms):
+        self.databases = databases
+        self.llms = llms
+        self.status = "running"
+        self.collections = 0
+        self.models = set()
+        self.errors = []
+        self.started = time.perf_counter()
+        self.duration = None
+
+    def summary(self):
+        if self.status == "running":
+            return f"Warming up {len(self.databases)} database(s) and {len(self.llms)} LLM(s)..."
+        text = (
+            f"Warm-up done in {self.duration:.1f} s: {len(self.databases)} database(s), "
+            f"{self.collections} collection(s), {len(self.models)} model(s) preloaded"
+        )
+        if self.errors:
+            text += f", {len(self.errors)} error(s): " + "; ".join(self.errors)
+        return text
+
+
+startup_times = StartupTimes()
+_warm_up = None
+_warm_up_lock = threading.Lock()
+
+
+def warm_up_settings(current_dir, databases):
+    """(database paths, LLM names) to warm up, or None when warm-up is not enabled.
+
+    EASY_RAG_WARM_UP=1 turns it on. EASY_RAG_WARM_UP_DATABASES and EASY_RAG_WARM_UP_LLMS are comma
+    separated lists, all databases and no LLM by default.
+    """
+    if os.environ.get(WARM_UP_ENV, "").lower() not in ("1", "true", "yes"):
+        return None
+    names = [name.strip() for name in os.environ.get(WARM_UP_DATABASES_ENV, "").split(",") if name.strip()]
+    llms = [name.strip() for name in os.environ.get(WARM_UP_LLMS_ENV, "").split(",") if name.strip()]
+    return [os.path.join(current_dir, name) for name in (names or databases)], llms
+
+
+def warm_up_database(db_path, warm_up):
+    from pages.backend.resources import get_client, get_vector_store
+    from pages.backend.flat import get_flat_index
+    collection_embedding_map = get_collection_map(db_path).embedding_models()
+    if not collection_embedding_map:
+        return
+    client = get_client(db_path)
+    for collection in client.list_collections():
+        embedding_model = collection_embedding_map.get(collection.name)
+        if not embedding_model:
+            continue
+        with span("warm_up_collection", database=os.path.basename(db_path), collection=collection.name):
+            flat_index = get_flat_index(db_path, collection.name)
+            if flat_index is not None:
+                flat_index.warm()
+            else:
+                # A query loads the collection's HNSW segment, get() alone only reads the metadata store
+                sample = collection.get(limit=1, include=["embeddings"])
+                if len(sample["ids"]):
+                    collection.query(query_embeddings=[sample["embeddings"][0]], n_results=1)
+            get_vector_store(db_path, collection.name, embedding_model)
+        warm_up.collections += 1
+        warm_up.models.add(embedding_model)
+
+
+def preload_embedding_model(embedding_model):
+    from pages.backend.resources import get_embeddings
+    # Not through the query cache, the point is making Ollama load the model
+    get_embeddings(embedding_model).embed_query("warm up")
+
+
+def preload_llm(llm):
+    from pages.backend.ollama_client import get_ollama_client
+    get_ollama_client().load(llm)
+
+
+def run_warm_up(warm_up):
+    with traced("warm_up", databases=len(warm_up.databases), llms=len(warm_up.llms)):
+        for db_path in warm_up.databases:
+            try:
+                warm_up_database(db_path, warm_up)
+            except Exception as e:
+                warm_up.errors.append(f"{os.path.basename(db_path)}: {e}")
+        for embedding_model in sorted(warm_up.models):
+            try:
+                with span("preload_model", model=embedding_model):
+                    preload_embedding_model(embedding_model)
+            except Exception as e:
+                warm_up.errors.append(f"{embedding_model}: {e}")
+        for llm in warm_up.llms:
+            try:
+                with span("preload_model", model=llm):
+                    preload_llm(llm)
+                warm_up.models.add(llm)
+            except Exception as e:
+                warm_up.errors.append(f"{llm}: {e}")
+    warm_up.duration = time.perf_counter() - warm_up.started
+    warm_up.status = "done"
+    set_gauge("warm_up_seconds", warm_up.duration, "Time the startup warm-up took.")
+
+
+def start_warm_up(databases, llms):
+    """Warm up once per process in a background thread, the page does not wait for it."""
+    global _warm_up
+    with _warm_up_lock:
+        if _warm_up is None:
+            _warm_up = WarmUp(databases, llms)
+            threading.Thread(target=run_warm_up, args=(_warm_up,), name="warm-up", daemon=True).start()
+        return _warm_up
@@ -0,0 +1,56 @@
+import time
+
+
+class TokenStream:
+    """Iterates over a chat model's streamed tokens and records time-to-first-token and tokens/sec."""
+
+    def __init__(self, model, prompt_text):
+        self.model = model
+        self.prompt_text = prompt_text
+        self.started = None
+        self.time_to_first_token = None
+        self.generation_time = None
+        self.tokens = 0
+
+    def __iter__(self):
+        start = self.started = time.perf_counter()
+        output_tokens = None
+        for chunk in self.model.stream(self.prompt_text):
+            usage = getattr(chunk, "usage_metadata", None)
+            if usage:
+                output_tokens = usage.get("output_tokens")
+            if not chunk.content:
+                continue
+            if self.time_to_first_token is None:
+                self.time_to_first_token = time.perf_counter() - start
+            self.tokens += 1
+            yield chunk.content
+        self.generation_time = time.perf_counter() - start
+        # Ollama reports the real token count on the last chunk, stream chunks are only an estimate
+        if output_tokens:
+            self.tokens = output_tokens
+
+    @property
+    def tokens_per_sec(self):
+        if not self.generation_time or self.time_to_first_token is None:
+            return 0.0
+        decode_time = self.generation_time - self.time_to_first_token
+        return self.tokens / decode_time if decode_time > 0 else 0.0
+
+    def metrics(self):
+        return {
+            "time_to_first_token": self.time_to_first_token,
+            "generation_time": self.generation_time,
+            "tokens": self.tokens,
+            "tokens_per_sec": self.tokens_per_sec,
+        }
+
+
+def format_stream_metrics(metrics):
+    if not metrics or metrics.get("time_to_first_token") is None:
+        return ""
+    return (
+        f"First token {metrics['time_to_first_token']:.2f}s · "
+        f"{metrics['tokens']} tokens in {metrics['generation_time']:.1f}s · "
+        f"{metrics['tokens_per_sec']:.1f} tokens/sec"
+    )
@@ -1,18 +1,38 @@
+import time
+script_started = time.perf_counter()
 import streamlit as st
-from langchain_chroma import Chroma
-from langchain_ollama import OllamaEmbeddings
-from langchain_ollama import ChatOllama
 import os
-import chromadb
 from streamlit_option_menu import option_menu
-import json
+from pages.backend.streaming import TokenStream, format_stream_metrics
+from pages.backend.resources import get_client, get_vector_store
+from pages.backend.embedding_cache import query_cache, format_query_cache_stats
+from pages.backend.answer_cache import answer_cache, retrieved_chunk_ids
+from pages.backend.retrieval import retrieve
+from pages.backend.federated import federated_search
+from pages.backend.context import DEFAULT_CONTEXT_TOKENS, estimate_tokens, pack_context, format_pack_report
+from pages.backend.metrics import span, traced, record, prometheus_text, traces_jsonl
+from pages.backend.startup import startup_times, warm_up_settings, start_warm_up
+from pages.backend.migrate import is_migration_collection
+from pages.backend.collection_map import get_collection_map
+from pages.backend.ollama_client import CHAT_MODELS, get_chat_model, get_ollama_client, format_queue_stats
+startup_times.mark_imports(script_started)
 
-def get_collection_embedding_map(db_path):
-    mapping_path = os.path.join(db_path, 'collection_embedding_map.json')
-    if os.path.exists(mapping_path):
-        with open(mapping_path, 'r') as f:
-            return json.load(f)
-    return {}
+SEARCH_TYPE_OPTIONS = {
+    "similarity score": "similarity_score_threshold",
+    "mmr": "mmr",
+    "top k": "top_k",
+    "hybrid": "hybrid",
+}
+
+def show_performance(trace):
+    st.caption(f"Total {trace.duration * 1000:.1f} ms. {startup_times.summary()}")
+    st.caption(format_queue_stats(get_ollama_client().queue_stats()))
+    st.dataframe(trace.rows(), hide_index=True)
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("Prometheus metrics", prometheus_text(), file_name="easy_rag_metrics.prom", mime="text/plain")
+    with col2:
+        st.download_button("Traces (JSONL)", traces_jsonl(), file_name="easy_rag_traces.jsonl", mime="application/jsonl")
 
 st.set_page_config(page_title="Chatbot", layout="wide", initial_sidebar_state="collapsed")
 
@@ -28,6 +48,10 @@ with st.expander("**Chatbot Parameters**"):
         if os.path.isdir(full_path) and 'data_' in entry:
             Databases.append(entry)
 
+    warm_up_databases = warm_up_settings(os.path.abspath('./'), Databases)
+    if warm_up_databases is not None:
+        st.caption(start_warm_up(*warm_up_databases).summary())
+
     chosen_database = st.selectbox(
         "Select Database",
         Databases,
@@ -36,12 +60,12 @@ with st.expander("**Chatbot Parameters**"):
     )
 
     if chosen_database is not None:
-        client = chromadb.PersistentClient(path=f'./{chosen_database}')
-        collection_embedding_map = get_collection_embedding_map(f'./{chosen_database}')
-        collections = [col.name for col in client.list_collections()]
+        client = get_client(f'./{chosen_database}')
+        collection_map = get_collection_map(f'./{chosen_database}')
+        collection_embedding_map = collection_map.embedding_models()
+        collections = [col.name for col in client.list_collections() if not is_migration_collection(col.name)]
     else:
         client = None
-        embedding_function = None
         collections = []
 
     chosen_collection = st.selectbox(
@@ -51,12 +75,30 @@ with st.expander("**Chatbot Parameters**"):
         placeholder="xxxx...",
     )
 
+    # Search settings last used on the chosen collection, here or on the main page
+    search_settings = {}
     if chosen_collection is not None:
-        embedding_function = OllamaEmbeddings(model=collection_embedding_map.get(chosen_collection))
+        search_settings = collection_map.settings(chosen_collection)
+
+    # Other collections, from any database, searched in parallel with the chosen one.
+    # Listed only when asked for, from the collection maps, without opening every database.
+    chosen_extra_targets = []
+    if chosen_collection is not None and st.checkbox("Also search other collections"):
+        extra_targets = []
+        for database in Databases:
+            for name, model in get_collection_map(f'./{database}').embedding_models().items():
+                if model and not is_migration_collection(name) and (database, name) != (chosen_database, chosen_collection):
+                    extra_targets.append((f'./{database}', name, model))
+        chosen_extra_targets = st.multiselect(
+            "Also search these collections",
+            extra_targets,
+            format_func=lambda target: f"{os.path.basename(target[0])} / {target[1]}",
+            help="Results from all selected collections are merged by relevance; the search type below is then ignored",
+        )
 
     llm = st.selectbox(
         "Select Large Language Model (LLM)",
-        ["llama3","llama3.1", "llama3.2", "llama3.3","deepseek-r1:1.5b"],
+        CHAT_MODELS,
         help="Select the LLM model to use for generating responses",
     )
 
@@ -65,10 +107,10 @@ with st.expander("**Chatbot Parameters**"):
 
     mmr_sst_topk = option_menu(
         "RAG search type",
-        ["similarity score", "mmr", "top k"],
-        icons=["1-square-fill", "2-square-fill", "3-square-fill"],
+        list(SEARCH_TYPE_OPTIONS),
+        icons=["1-square-fill", "2-square-fill", "3-square-fill", "4-square-fill"],
         menu_icon="search",
-        default_index=1,
+        default_index=list(SEARCH_TYPE_OPTIONS.values()).index(search_settings.get("search_type", "mmr")),
         orientation="horizontal",
     )
 
@@ -82,18 +124,71 @@ with st.expander("**Chatbot Parameters**"):
             help="Minimum similarity score of the retrieved results",
             format="%.2f"
         )
-    elif mmr_sst_topk == "top k":
+    elif mmr_sst_topk in ("top k", "hybrid", "mmr"):
         search_number_input = st.number_input(
             "Number of top results",
             min_value=1,
             max_value=100,
-            value=3,
+            value=max(int(search_settings.get("number_of_results") or 3), 1),
             step=1,
             help="Number of top results to retrieve",
         )
     else:
         search_number_input = None
 
+    fetch_k = search_settings.get("fetch_k", 20)
+    lambda_mult = search_settings.get("lambda_mult", 0.5)
+    if mmr_sst_topk in ("mmr", "hybrid"):
+        fetch_k = st.number_input(
+            "Candidates (fetch_k)",
+            min_value=1,
+            max_value=1000,
+            value=search_settings.get("fetch_k", 20),
+            step=1,
+            help="Number of nearest chunks considered before MMR selection or rank fusion",
+        )
+    if mmr_sst_topk == "mmr":
+        lambda_mult = st.slider(
+            "Diversity (lambda)",
+            min_value=0.0,
+            max_value=1.0,
+            value=search_settings.get("lambda_mult", 0.5),
+            step=0.05,
+            help="1 favours relevance only, 0 favours diversity only",
+        )
+
+    context_token_budget = st.number_input(
+        "Context token budget",
+        min_value=128,
+        max_value=131072,
+        value=search_settings.get("context_tokens", DEFAULT_CONTEXT_TOKENS),
+        step=128,
+        help="Estimated tokens of retrieved context put in the prompt. Overlapping chunks are merged, duplicates dropped and the most relevant passages kept",
+    )
+
+    use_answer_cache = st.checkbox(
+        "Reuse cached answers",
+        value=False,
+        help="Answer near-identical questions from the cache when the retrieved context is unchanged",
+    )
+    if use_answer_cache:
+        answer_cache_threshold = st.slider(
+            "Answer cache similarity threshold",
+            min_value=0.80,
+            max_value=1.00,
+            value=0.95,
+            step=0.01,
+            help="Minimum cosine similarity between the new and the cached question",
+        )
+        answer_cache_max_age = st.number_input(
+            "Answer cache max age (minutes)",
+            min_value=1,
+            max_value=1440,
+            value=60,
+            help="Cached answers older than this are not reused",
+        )
+
+    st.caption(format_query_cache_stats(query_cache.stats()))
 
 
 st.title("💬 Chatbot")
@@ -105,6 +200,8 @@ if "messages" not in st.session_state:
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
+        if message.get("metrics"):
+            st.caption(format_stream_metrics(message["metrics"]))
 
 # Chat input at the bottom
 if prompt := st.chat_input("Ask me anything..."):
@@ -114,27 +211,29 @@ if prompt := st.chat_input("Ask me anything..."):
 
     # Only respond if database and collection are selected
     if chosen_database and chosen_collection:
-        with st.chat_message("assistant"):
-            with st.spinner("Bot is typing..."):
-                # RAG retrieval
-                vector_store = Chroma(
-                    persist_directory=f'./{chosen_database}',
-                    embedding_function=embedding_function,
-                    collection_name=f'{chosen_collection}'
-                )
-                if mmr_sst_topk == "similarity score":
-                    retriever = vector_store.as_retriever(
-                        search_type="similarity_score_threshold",
-                        search_kwargs={"score_threshold": float(search_number_input)}
+        with traced("chat_turn", database=chosen_database, collection=chosen_collection, llm=chosen_llm) as turn_trace:
+            with st.chat_message("assistant"):
+                stream = None
+                with st.spinner("Bot is typing..."):
+                    # RAG retrieval
+                    with span("vector_store"):
+                        vector_store = get_vector_store(
+                            f'./{chosen_database}',
+                            chosen_collection,
+                            collection_embedding_map.get(chosen_collection),
+                        )
+                    search_type = SEARCH_TYPE_OPTIONS.get(mmr_sst_topk)
+                    collection_map.update_settings(
+                        chosen_collection,
+                        search_type=search_type,
+                        fetch_k=fetch_k,
+                        lambda_mult=lambda_mult,
+                        context_tokens=context_token_budget,
+                        # The score threshold is a float, the main page's number input only takes whole numbers
+                        **({"number_of_results": search_number_input} if search_type != "similarity_score_threshold" else {}),
                     )
-                elif mmr_sst_topk == "mmr":
-                    retriever = vector_store.as_retriever(search_type="mmr")
-                elif mmr_sst_topk == "top k":
-                    retriever = vector_store.as_retriever(search_kwargs={"k": search_number_input})
-                else:
-                    retriever = None
 
-                PROMPT_TEMPLATE = """
+                    PROMPT_TEMPLATE = """
                 Answer the question based only on the following context:
 
                 {context}
@@ -144,25 +243,97 @@ if prompt := st.chat_input("Ask me anything..."):
                 Answer the question based on the above context: {question}
                 """
 
-                if retriever:
-                    results = retriever.invoke(prompt)
-                    if not results:
+                    if chosen_extra_targets:
+                        targets = [(f'./{chosen_database}', chosen_collection, collection_embedding_map.get(chosen_collection))]
+                        k = int(search_number_input) if mmr_sst_topk != "similarity score" else 4
+                        with span("federated_search", targets=len(targets + chosen_extra_targets)):
+                            results, search_report = federated_search(targets + chosen_extra_targets, prompt, k=k)
+                        for (database, collection_name, _), status in search_report.items():
+                            if status["status"] != "ok":
+                                st.warning(f"{os.path.basename(database)} / {collection_name}: {status['status']}")
+                    elif search_type:
+                        results = retrieve(
+                            vector_store,
+                            prompt,
+                            search_type,
+                            search_number_input,
+                            db_path=f'./{chosen_database}',
+                            collection_name=chosen_collection,
+                            fetch_k=fetch_k,
+                            lambda_mult=lambda_mult,
+                        )
+                    else:
+                        results = None
+                    startup_times.mark_first_query()
+                    cached_answer = cached_similarity = None
+                    if results is None:
+                        bot_response = "Sorry, something went wrong with the retrieval."
+                    elif not results:
                         bot_response = "Sorry, I couldn't find any relevant information."
                     else:
-                        context_text = "\n\n---\n\n".join([r.page_content for r in results])
-                        prompt_text = PROMPT_TEMPLATE.format(context=context_text, question=prompt)
-                        model = ChatOllama(model=chosen_llm)
-                        # Streaming not supported, so just show the response
-                        bot_response = model.invoke(prompt_text).content
+                        with span("prompt", items=len(results)) as prompt_span:
+                            context_text, pack_report = pack_context(results, max_tokens=context_token_budget)
+                            prompt_text = PROMPT_TEMPLATE.format(context=context_text, question=prompt)
+                            prompt_span["tokens"] = estimate_tokens(prompt_text)
+                        if use_answer_cache:
+                            with span("answer_cache") as cache_span:
+                                query_embedding = vector_store.embeddings.embed_query(prompt)
+                                chunk_ids = retrieved_chunk_ids(results)
+                                cached_answer, cached_similarity = answer_cache.lookup(
+                                    f'./{chosen_database}',
+                                    chosen_collection,
+                                    chosen_llm,
+                                    query_embedding,
+                                    chunk_ids,
+                                    threshold=answer_cache_threshold,
+                                    max_age=answer_cache_max_age * 60,
+                                )
+                                cache_span["cache"] = "hit" if cached_answer is not None else "miss"
+                        if cached_answer is not None:
+                            bot_response = cached_answer
+                        else:
+                            model = get_chat_model(chosen_llm)
+                            stream = TokenStream(model, prompt_text)
+                if stream is not None:
+                    # Tokens are written as they arrive instead of after the full generation
+                    bot_response = st.write_stream(stream)
+                    metrics = stream.metrics()
+                    st.caption(format_stream_metrics(metrics))
+                    if metrics["time_to_first_token"] is not None:
+                        record("time_to_first_token", metrics["time_to_first_token"], start=stream.started, model=chosen_llm)
+                        record(
+                            "generation",
+                            metrics["generation_time"] - metrics["time_to_first_token"],
+                            start=stream.started + metrics["time_to_first_token"],
+                            items=metrics["tokens"],
+                            tokens_per_sec=round(metrics["tokens_per_sec"], 1),
+                        )
+                    if use_answer_cache:
+                        answer_cache.store(
+                            f'./{chosen_database}',
+                            chosen_collection,
+                            chosen_llm,
+                            query_embedding,
+                            chunk_ids,
+                            bot_response,
+                        )
                 else:
-                    bot_response = "Sorry, something went wrong with the retrieval."
-                st.markdown(bot_response)
-        st.session_state.messages.append({"role": "assistant", "content": bot_response})
+                    metrics = None
+                    st.markdown(bot_response)
+                    if use_answer_cache and cached_answer is not None:
+                        st.caption(f"Answered from cache (question similarity {cached_similarity:.3f})")
+            st.session_state.messages.append({"role": "assistant", "content": bot_response, "metrics": metrics})
+        st.session_state.last_trace = turn_trace
     else:
         with st.chat_message("assistant"):
             st.markdown("Please select a database and collection to start chatting.")
         st.session_state.messages.append({"role": "assistant", "content": "Please select a database and collection to start chatting."})
 
-if prompt is not None:
-    with st.expander("View Full Prompt"):
-        st.write(prompt_text)
\ No newline at end of file
+if prompt is not None and 'prompt_text' in locals():
+    with st.expander(f"View Full Prompt (~{estimate_tokens(prompt_text)} tokens)"):
+        st.caption(format_pack_report(pack_report))
+        st.write(prompt_text)
+
+if st.session_state.get("last_trace") is not None:
+    with st.expander("Performance"):
+        show_performance(st.session_state.last_trace)
\ No newline at end of file
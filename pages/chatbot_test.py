@@ -1,18 +1,18 @@
 import streamlit as st
-from langchain_chroma import Chroma
-from langchain_ollama import OllamaEmbeddings
-from langchain_ollama import ChatOllama
 import os
-import chromadb
 from streamlit_option_menu import option_menu
-import json
+from pages.backend.streaming import TokenStream, format_stream_metrics
+from pages.backend.resources import get_client, get_embeddings, get_vector_store
+from pages.backend.ollama_client import get_chat_model
+from pages.backend.collection_map import collection_embedding_map as get_collection_embedding_map
 
-def get_collection_embedding_map(db_path):
-    mapping_path = os.path.join(db_path, 'collection_embedding_map.json')
-    if os.path.exists(mapping_path):
-        with open(mapping_path, 'r') as f:
-            return json.load(f)
-    return {}
+def assistant_bubble(content):
+    return f"""
+        <div class="stChatMessage assistant" style="text-align: left;">
+            <span style="font-size:1.5em;">🤖</span>
+            <span style="margin-left: 8px;">{content}</span>
+        </div>
+        """
 
 st.set_page_config(page_title="Chatbot", layout="wide", initial_sidebar_state="collapsed")
 
@@ -72,7 +72,7 @@ with st.sidebar:
     )
 
     if chosen_database is not None:
-        client = chromadb.PersistentClient(path=f'./{chosen_database}')
+        client = get_client(f'./{chosen_database}')
         collection_embedding_map = get_collection_embedding_map(f'./{chosen_database}')
         collections = [col.name for col in client.list_collections()]
     else:
@@ -88,7 +88,7 @@ with st.sidebar:
     )
 
     if chosen_collection is not None:
-        embedding_function = OllamaEmbeddings(model=collection_embedding_map.get(chosen_collection))
+        embedding_function = get_embeddings(collection_embedding_map.get(chosen_collection))
 
     mmr_sst_topk = option_menu(
         "RAG search type",
@@ -145,6 +145,8 @@ for message in st.session_state.messages:
         """,
         unsafe_allow_html=True
     )
+    if message.get("metrics"):
+        st.caption(format_stream_metrics(message["metrics"]))
 
 # --- Chat Input at the bottom ---
 prompt = st.chat_input("Ask me anything...")
@@ -163,13 +165,14 @@ if prompt:
     )
 
     # Only respond if database and collection are selected
+    stream = None
     if chosen_database and chosen_collection:
         with st.spinner("🤖 Bot is typing..."):
             # RAG retrieval
-            vector_store = Chroma(
-                persist_directory=f'./{chosen_database}',
-                embedding_function=embedding_function,
-                collection_name=f'{chosen_collection}'
+            vector_store = get_vector_store(
+                f'./{chosen_database}',
+                chosen_collection,
+                collection_embedding_map.get(chosen_collection),
             )
             if mmr_sst_topk == "similarity score":
                 retriever = vector_store.as_retriever(
@@ -200,24 +203,26 @@ if prompt:
                 else:
                     context_text = "\n\n---\n\n".join([r.page_content for r in results])
                     prompt_text = PROMPT_TEMPLATE.format(context=context_text, question=prompt)
-                    model = ChatOllama(model="llama3.1")
-                    bot_response = model.invoke(prompt_text).content
+                    model = get_chat_model("llama3.1")
+                    stream = TokenStream(model, prompt_text)
             else:
                 bot_response = "Sorry, something went wrong with the retrieval."
     else:
         bot_response = "Please select a database and collection to start chatting."
 
-    # Display assistant message
-    st.markdown(
-        f"""
-        <div class="stChatMessage assistant" style="text-align: left;">
-            <span style="font-size:1.5em;">🤖</span>
-            <span style="margin-left: 8px;">{bot_response}</span>
-        </div>
-        """,
-        unsafe_allow_html=True
-    )
-    st.session_state.messages.append({"role": "assistant", "content": bot_response})
+    # Display assistant message, streamed token by token when the LLM is called
+    response_placeholder = st.empty()
+    metrics = None
+    if stream is not None:
+        bot_response = ""
+        for token in stream:
+            bot_response += token
+            response_placeholder.markdown(assistant_bubble(bot_response), unsafe_allow_html=True)
+        metrics = stream.metrics()
+        st.caption(format_stream_metrics(metrics))
+    else:
+        response_placeholder.markdown(assistant_bubble(bot_response), unsafe_allow_html=True)
+    st.session_state.messages.append({"role": "assistant", "content": bot_response, "metrics": metrics})
 
 # --- Optional: Show full prompt for debugging ---
 if prompt and 'prompt_text' in locals():
@@ -1,6 +1,35 @@
+import json
 import streamlit as st
 from streamlit_javascript import st_javascript
-from pages.backend.Blocks import blocks
+from pages.backend.pipeline import PipelineError, block_cache, builder_config, compile_flow, run_pipeline
+from pages.backend.metrics import traced
+
+# The canvas is a sibling iframe, look for the one that exposes getFlow
+GET_FLOW_JS = """
+for (const frame of window.parent.document.querySelectorAll('iframe')) {
+    try {
+        if (frame.contentWindow.getFlow) {
+            return frame.contentWindow.getFlow();
+        }
+    } catch (e) {}
+}
+return null;
+"""
+
+
+def show_output(output):
+    if isinstance(output, str):
+        st.markdown(output)
+    elif isinstance(output, list):
+        st.caption(f"{len(output)} items")
+        for item in output[:20]:
+            if isinstance(item, tuple):
+                st.write({"url": item[0], "size": len(item[1])})
+            else:
+                st.write({"text": item.page_content[:500], "metadata": item.metadata})
+    else:
+        st.write(output)
+
 
 st.set_page_config(layout="wide")
 st.title("🧠 Visual RAG Builder")
@@ -8,12 +37,77 @@ st.title("🧠 Visual RAG Builder")
 with open("pages/backend/test.html") as f:
     drawflow_html = f.read()
 
+# The canvas is rebuilt from the last run's flow, with the time each block took
+drawflow_html = drawflow_html.replace(
+    "</head>",
+    builder_config(st.session_state.get("flow"), st.session_state.get("pipeline_results")) + "</head>",
+    1,
+)
 st.components.v1.html(drawflow_html, height=850)
 
 if st.button("Get Flow JSON"):
-    flow_json = st_javascript("return window.getFlow ? window.getFlow() : null;")
-    if flow_json:
-        st.subheader("Exported Flow JSON")
-        st.json(flow_json)
+    st.session_state.reading_flow = True
+    # A new key per read, the component keeps returning its last value under the same key
+    st.session_state.flow_reads = st.session_state.get("flow_reads", 0) + 1
+if st.session_state.get("reading_flow"):
+    flow_json = st_javascript(GET_FLOW_JS, key=f"read_flow_{st.session_state.flow_reads}")
+    # 0 until the component has answered
+    if flow_json != 0:
+        st.session_state.reading_flow = False
+        if flow_json:
+            st.session_state.flow_text = json.dumps(json.loads(flow_json), indent=2)
+        else:
+            st.warning("No flow found. Please build your flow and try again.")
+
+flow_text = st.text_area("Flow JSON", key="flow_text", height=200, help="Exported from the canvas, or pasted from a saved flow")
+
+col1, col2, col3 = st.columns(3)
+with col1:
+    run_clicked = st.button("Run pipeline", type="primary")
+with col2:
+    use_block_cache = st.checkbox("Reuse unchanged block outputs", value=True, help="Blocks whose settings and inputs did not change since an earlier run are not run again")
+with col3:
+    if st.button("Clear block cache"):
+        block_cache.clear()
+
+if run_clicked:
+    try:
+        pipeline = compile_flow(flow_text)
+    except PipelineError as e:
+        st.error(str(e))
     else:
-        st.warning("No flow found. Please build your flow and try again.")
\ No newline at end of file
+        with st.spinner("Running pipeline..."):
+            with traced("pipeline", blocks=len(pipeline.nodes)) as trace:
+                results = run_pipeline(pipeline, use_cache=use_block_cache)
+        st.session_state.flow = flow_text
+        st.session_state.pipeline = pipeline
+        st.session_state.pipeline_results = results
+        st.session_state.pipeline_trace = trace
+        # Rerun so the canvas shows the timings
+        st.rerun()
+
+if st.session_state.get("pipeline_results"):
+    pipeline = st.session_state.pipeline
+    results = st.session_state.pipeline_results
+    st.caption(
+        f"Ran in {st.session_state.pipeline_trace.duration * 1000:.1f} ms. "
+        f"Block cache: {block_cache.stats()['size']} outputs, {block_cache.stats()['hit_rate']:.0%} hit rate"
+    )
+    st.dataframe(
+        [
+            {
+                "block": str(pipeline.nodes[node_id]),
+                "status": results[node_id]["status"],
+                "time (ms)": round(results[node_id]["seconds"] * 1000, 1),
+                "error": results[node_id]["error"] or "",
+            }
+            for node_id in pipeline.order
+        ],
+        hide_index=True,
+    )
+    for node_id in pipeline.sinks():
+        with st.expander(f"{pipeline.nodes[node_id]}: {results[node_id]['status']}", expanded=True):
+            if results[node_id]["error"]:
+                st.error(results[node_id]["error"])
+            else:
+                show_output(results[node_id]["output"])